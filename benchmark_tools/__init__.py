@@ -1,130 +1,443 @@
-import os
+import time
+# the first import of the package, it measures the import time of the rest
+from .clock import IMPORT_START
+import logging
 import math
 import copy
-import time
 from datetime import datetime
-from typing import List, Union, Tuple
+from typing import Dict, List, Union, TYPE_CHECKING
+import multiprocessing
 from multiprocessing import Process, Queue
 import threading
+import queue
 import uvloop
+from colorama import Fore, Style
 from .helper import ThreadWrapper
 from .benchmark_conf import BenchmarkConfig, load_benchmark_config_from_file
 from .benchmark_tool import BenchmarkTool
 from .benchmark_context import RunResult, FinalResult
 from .client_protocol import ClientProtocol
+from .scenario import ScenarioClient, Flow, task
+from .http_client import HttpClient
+from .socket_client import SocketClient
 from .benchmark_result import BenchmarkResult
-from . import rps_dash
+from .histogram import LatencyHistogram
+from .shm_channel import ShmChannel
+from .load_shape import Stage, split_stages
+from .saturation import SaturationSearch, split_load
+from .timeseries import TimeSeries, Window, WindowAggregator, PhaseSplitter
+from .helper import load_benchmark_class_from_file, check_client_class
+from .monitor import is_overloaded
+from .export import RunExporter
+from .compare import RunData, compare_runs
+from .thresholds import ThresholdMonitor
+if TYPE_CHECKING:
+    # the agent and the dashboard are imported only when they are enabled
+    from .agent import AgentServer, AgentConnection
+    from .rps_dash import DashServer
+
+
+# the api of the client files, the rest is imported for the controller
+__all__ = ['ClientProtocol', 'ScenarioClient', 'Flow', 'task', 'HttpClient', 'SocketClient', 'LatencyHistogram',
+           'Stage', 'BenchmarkConfig', 'BenchmarkResult', 'BenchmarkTools', 'benchmark_tool']
 
 
 REPORT_INTERVAL = 1
+# how often the controller reads the shared memory channels of the workers
+POLL_INTERVAL = 0.1
 
 
-def run_benchmark_in_process(index: int, conf: BenchmarkConfig):
+def run_benchmark_in_process(index: int, conf: BenchmarkConfig, command_queue: Queue,
+                             client_class: Union[None, type] = None):
     # print(f'using config in worker {index}, pid {os.getpid()}:{conf}')
     uvloop.install()
-    tool = BenchmarkTool(index, conf, benchmark_tool.on_results, REPORT_INTERVAL)
+    tool = BenchmarkTool(index, conf, benchmark_tool.on_results, REPORT_INTERVAL, command_queue, client_class)
     tool.run()
 
 
+def preload_client_class(class_file: str) -> Union[None, type]:
+    """
+    load the client class in the parent, the forked workers inherit it instead of loading it again
+
+    :return: None when the workers are not forked, they load the class themselves
+    """
+    if multiprocessing.get_start_method() != 'fork':
+        return None
+    return load_benchmark_class_from_file(class_file)
+
+
 class BenchmarkTools:
     def __init__(self):
         self._rq = Queue()
-        self._wq = Queue()
         self._processes: List[Process] = []
+        self._channels: List[ShmChannel] = []
+        # commands from the controller to every worker
+        self._command_queues: List[Queue] = []
         self._config: [None, BenchmarkConfig] = None
         # don't copy data in worker process
         self._result: Union[None, FinalResult] = None
         self._calc_thread: Union[None, ThreadWrapper] = None
         self._lock: Union[None, threading.RLock] = None
         self._start_time: Union[None, float] = None
-        self._mid_results: Union[None, List[RunResult]] = None
-        self._realtime_rps: Union[None, List[Tuple[str, float]]] = None
+        self._windows: Union[None, WindowAggregator] = None
+        self._time_series: Union[None, TimeSeries] = None
+        self._printed_rows = 0
+        self._search: Union[None, SaturationSearch] = None
+        self._search_thread: Union[None, ThreadWrapper] = None
+        self._agent_server: Union[None, 'AgentServer'] = None
+        self._agent_threads: List[ThreadWrapper] = []
+        self._finished: List[bool] = []
+        self._dash: Union[None, 'DashServer'] = None
+        # timestamps of the startup phases of the controller and every worker
+        self._startup: Dict[str, float] = {}
+        self._worker_startup: Dict[int, Dict[str, float]] = {}
+        self._last_overload_warning = 0.0
+        self._exporter: Union[None, RunExporter] = None
+        self._threshold_monitor: Union[None, ThresholdMonitor] = None
+        self._phases: Union[None, PhaseSplitter] = None
 
-    def run(self, config_file: str):
+    def run(self, config_file: str, profile_startup: bool = False) -> int:
+        """
+        :return: exit code, 1 when a threshold tripped or the run regressed against the baseline,
+                 None when interrupted
+        """
+        self._startup['run'] = time.time()
         config = load_benchmark_config_from_file(config_file)
         print('print using config:\n' + str(config))
         assert config.users >= config.worker
+        self._startup['load config'] = time.time()
+        # load the baseline before any worker starts, a broken one fails at once
+        baseline = RunData.load(config.baseline.run) if config.baseline is not None else None
+        if config.replay is not None:
+            check_client_class(load_benchmark_class_from_file(config.benchmark_class_file), True)
         workers_config = self.__generate_conf_for_workers(config)
         self._calc_thread = ThreadWrapper(target=self.__count_result)
-        for i in range(config.worker):
-            self._processes.append(Process(target=run_benchmark_in_process, args=(i, workers_config[i])))
-        self._start_time = time.time()
-        for process in self._processes:
-            process.start()
+        self._finished = [False] * config.worker
+        if config.agents > 0:
+            from .agent import AgentServer
+            self._agent_server = AgentServer(config.listen, config.authkey)
+            self._agent_server.accept(config.agents)
+            self._start_time = time.time()
+            self.__start_agents(workers_config)
+        else:
+            client_class = preload_client_class(config.benchmark_class_file)
+            self._startup['preload class'] = time.time()
+            for i in range(config.worker):
+                self._channels.append(ShmChannel(i))
+                self._command_queues.append(Queue())
+                self._processes.append(Process(target=run_benchmark_in_process,
+                                               args=(i, workers_config[i], self._command_queues[i], client_class)))
+            self._start_time = time.time()
+            for process in self._processes:
+                process.start()
+        self._startup['fork workers'] = time.time()
         self._config = config
-        self._mid_results = []
-        self._realtime_rps = []
-        self._result = FinalResult(config.worker)
+        self._windows = WindowAggregator(config.worker, self._start_time, REPORT_INTERVAL)
+        self._time_series = TimeSeries(REPORT_INTERVAL)
+        if config.warmup > 0 or config.cooldown > 0:
+            self._phases = PhaseSplitter(self._start_time, config.warmup, config.cooldown)
+        self._result = FinalResult(config.worker, failure_conf=config.failures)
+        if config.thresholds is not None:
+            self._threshold_monitor = ThresholdMonitor(config.thresholds, self._start_time, REPORT_INTERVAL)
         self._lock = threading.RLock()
+        if config.export is not None:
+            self._exporter = RunExporter(config.export, config_file)
 
         self._calc_thread.start()
+        for thread in self._agent_threads:
+            thread.start()
         if self._config.enable_dash:
-            rps_dash.run_dash_server(self._wq)
+            from .rps_dash import DashServer
+            self._dash = DashServer(('127.0.0.1', self._config.dash_port))
+            self._dash.start()
+        if self._config.search is not None:
+            self._search_thread = ThreadWrapper(target=self.__run_search)
+            self._search = SaturationSearch(self._config.search, self.__set_load, self.__snapshot,
+                                            self._search_thread.need_quit)
+            self._search_thread.start()
 
-        wait_end_sigs = [False] * config.worker
         try:
             while True:
-                result: RunResult = self._rq.get()
-                # print(f'receive result in main process{result}')
-                if result.finish:
-                    wait_end_sigs[result.worker_index] = True
-                with self._lock:
-                    self._result.update(result)
-                    if self._config.enable_dash and not result.finish:
-                        self._update_realtime_result(result)
-                if wait_end_sigs.count(True) == len(wait_end_sigs):
-                    if self._config.enable_dash:
-                        rps_dash.stop_dash_server()
+                try:
+                    result: Union[None, RunResult] = self._rq.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    result = None
+                if result is not None:
+                    # print(f'receive result in main process{result}')
+                    with self._lock:
+                        if result.finish:
+                            self._finished[result.worker_index] = True
+                        if result.startup is not None:
+                            self._worker_startup[result.worker_index] = result.startup
+                        self._result.update(result)
+                        self.__on_windows(self._windows.add(result, False))
+                self.__poll_channels()
+                if all(self._finished):
+                    with self._lock:
+                        self.__on_windows(self._windows.flush())
+                    if self._dash is not None:
+                        self._dash.stop()
                     self._calc_thread.shutdown()
-                    # wait for sub process exit
-                    time.sleep(3.0)
+                    if self._search_thread is not None:
+                        self._search_thread.shutdown()
+                    for thread in self._agent_threads:
+                        thread.shutdown()
+                    # the workers exit right after the finish report
+                    for process in self._processes:
+                        process.join(timeout=5.0)
+                        if process.is_alive():
+                            process.terminate()
                     break
             print('final benchmark:')
             self._result.run_time = self._result.last_time - self._start_time
-            fr = BenchmarkResult.generate_benchmark_result(self._result)
+            if self._phases is not None:
+                self._phases.finish()
+            fr = BenchmarkResult.generate_benchmark_result(self._result, self._time_series, self._phases)
             fr.print()
-
-            # import plotly.express as px
-            # from pandas import DataFrame
-            # df = DataFrame(self._realtime_rps, columns=['time', 'rps'])
-            # fig = px.line(df, x='time', y='rps')
-            # fig.update_yaxes(rangemode="tozero")
-            # fig.update_layout(title=str(self._config))
-            # fig.show()
+            if self._threshold_monitor is not None:
+                print(self._threshold_monitor.report())
+            if self._exporter is not None:
+                summary = fr.to_dict()
+                if self._threshold_monitor is not None:
+                    summary['breaches'] = [b.to_dict() for b in self._threshold_monitor.breaches]
+                self._exporter.finish(self._result, summary)
+            if self._search is not None:
+                print(self._search.report())
+            if self._agent_server is not None:
+                print(self._agent_server.report())
+            if profile_startup:
+                print(self.startup_report())
+            failed = self._threshold_monitor is not None and len(self._threshold_monitor.breaches) > 0
+            if baseline is not None:
+                rows = compare_runs(baseline, RunData.from_result(self._result, self._time_series),
+                                    config.baseline.alpha, config.baseline.tolerance)
+                print(BenchmarkResult.comparison_table(rows))
+                failed = failed or any(row.regressed for row in rows)
+            return 1 if failed else 0
         except KeyboardInterrupt:
             self._calc_thread.shutdown()
+            if self._search_thread is not None:
+                self._search_thread.shutdown()
+            for thread in self._agent_threads:
+                thread.shutdown()
+            if self._exporter is not None:
+                with self._lock:
+                    self._exporter.finish(self._result, None, 'interrupted')
+        finally:
+            for channel in self._channels:
+                channel.close()
+            if self._exporter is not None:
+                self._exporter.close()
+            if self._agent_server is not None:
+                self._agent_server.close()
 
     def on_results(self, result: RunResult):
-        self._rq.put_nowait(result)
+        # called in the worker process, histograms, counters and named operations go through the shared memory
+        if self._channels[result.worker_index].write(result):
+            result.operations = None
+            result.operation_fails = None
+            result.timings = None
+            result.new_operations = None
+        if result.finish or result.operations or result.operation_fails or result.new_operations or result.timings \
+                or result.startup is not None or any(count > 0 for count in result.failed_reason.values()):
+            result.success_results = None
+            result.schedule_lag = None
+            result.dropped = 0
+            self._rq.put_nowait(result)
+
+    def __poll_channels(self):
+        for channel in self._channels:
+            for result in channel.read():
+                with self._lock:
+                    self._result.update(result)
+                    self.__on_windows(self._windows.add(result))
+
+    def __start_agents(self, workers_config: List[BenchmarkConfig]):
+        from .agent import RemoteCommandQueue
+        # split the workers to the agents, every agent gets a continuous range of worker indexes
+        agents = self._agent_server.agents
+        first_worker = 0
+        for i, agent in enumerate(agents):
+            count = len(workers_config) // len(agents) + (1 if i < len(workers_config) % len(agents) else 0)
+            agent.start(first_worker, workers_config[first_worker:first_worker + count], REPORT_INTERVAL)
+            for worker_index in agent.workers:
+                self._command_queues.append(RemoteCommandQueue(agent, worker_index))
+            self._agent_threads.append(ThreadWrapper(target=self.__receive_from_agent, args=(agent,)))
+            first_worker += count
+
+    def __receive_from_agent(self, agent: 'AgentConnection'):
+        from .agent import AGENT_TIMEOUT
+        thread = threading.current_thread()
+        last_receive = time.time()
+        while not thread.need_quit():
+            try:
+                result = agent.recv_result(POLL_INTERVAL)
+            except (EOFError, OSError):
+                result = None
+                last_receive = 0.0
+            if result is not None:
+                last_receive = time.time()
+                with self._lock:
+                    if result.finish:
+                        self._finished[result.worker_index] = True
+                    if result.startup is not None:
+                        self._worker_startup[result.worker_index] = result.startup
+                    self._result.update(result)
+                    self.__on_windows(self._windows.add(result))
+                continue
+            finished = all(self._finished[i] for i in agent.workers)
+            if finished:
+                break
+            if time.time() - last_receive > AGENT_TIMEOUT:
+                self.__on_agent_dropped(agent)
+                break
+
+    def __on_agent_dropped(self, agent: 'AgentConnection'):
+        agent.set_dropped()
+        agent.close()
+        logging.warning(f'agent {agent.address} dropped out, '
+                        f'workers {agent.workers.start}-{agent.workers.stop - 1} lost')
+        with self._lock:
+            for i in agent.workers:
+                if self._finished[i]:
+                    continue
+                # the users of the lost workers are gone
+                result = RunResult()
+                result.worker_index = i
+                result.failed_reason = {}
+                result.finish = True
+                self._result.update(result)
+                self._finished[i] = True
+
+    def startup_report(self) -> str:
+        """
+        time of every startup phase, the worker phases are the slowest of all workers
+        """
+        lines = ['startup profile (ms):', f"{'phase':<24}{'time':>10}"]
+        prev = IMPORT_START
+        lines.append(f"{'import':<24}{IMPORT_TIME * 1000:>10.1f}")
+        for phase, t in self._startup.items():
+            if phase != 'run':
+                lines.append(f'{phase:<24}{(t - prev) * 1000:>10.1f}')
+            prev = t
+        worker_phases = ('worker start', 'class load', 'global init', 'first request')
+        workers = [s for s in self._worker_startup.values() if all(p in s for p in worker_phases)]
+        if len(workers) > 0:
+            # the workers start after the fork of the controller
+            fork_start = self._startup.get('preload class', self._startup['load config'])
+            prev_phase = None
+            for phase in worker_phases:
+                if prev_phase is None:
+                    cost = max(s[phase] - fork_start for s in workers)
+                else:
+                    cost = max(s[phase] - s[prev_phase] for s in workers)
+                lines.append(f"{'worker ' + phase if not phase.startswith('worker') else phase:<24}"
+                             f"{cost * 1000:>10.1f}")
+                prev_phase = phase
+            first_request = min(s['first request'] for s in workers)
+            lines.append(f"{'time to first request':<24}{(first_request - IMPORT_START) * 1000:>10.1f}")
+        return '\n'.join(lines)
+
+    @property
+    def time_series(self) -> Union[None, TimeSeries]:
+        """
+        statistics of every reporting interval
+        """
+        return self._time_series
+
+    def __on_windows(self, windows: List[Window]):
+        for window in windows:
+            self.__check_overload(window)
+            if self._threshold_monitor is not None:
+                self.__check_thresholds(window)
+            row = self._time_series.append(window)
+            if self._phases is not None:
+                self._phases.add(window)
+            if self._exporter is not None:
+                self._exporter.on_interval(self._time_series, row)
+                if self._exporter.need_checkpoint():
+                    self._exporter.checkpoint(self._result)
+            if self._dash is not None:
+                ts = self._time_series
+                self._dash.publish({'time': datetime.fromtimestamp(ts.time[row]).strftime('%H:%M:%S'),
+                                    'stage': ts.stage[row], 'users': ts.users[row], 'rps': ts.rps[row],
+                                    'error_rate': ts.error_rate[row], 'p50': ts.p50[row],
+                                    'p90': ts.p90[row], 'p99': ts.p99[row], 'p999': ts.p999[row],
+                                    'cpu': {str(k): round(v, 1) for k, v in sorted(window.cpu.items())},
+                                    'loop_lag': {str(k): round(v * 1000, 1)
+                                                 for k, v in sorted(window.loop_lag.items())}})
+
+    def __check_overload(self, window: Window):
+        overloaded = [i for i in window.cpu if is_overloaded(window.cpu[i], window.loop_lag.get(i, 0.0))]
+        # warn at most every 10 seconds
+        if len(overloaded) == 0 or time.time() - self._last_overload_warning < 10:
+            return
+        self._last_overload_warning = time.time()
+        details = ', '.join(f'worker {i} cpu {window.cpu[i]:.0f}% '
+                            f'loop lag {window.loop_lag.get(i, 0.0) * 1000:.1f} ms' for i in sorted(overloaded))
+        logging.warning(Fore.RED + f'the load generator is the bottleneck, add workers or nodes: {details}'
+                        + Style.RESET_ALL)
+
+    def __check_thresholds(self, window: Window):
+        aborted = self._threshold_monitor.aborted
+        for breach in self._threshold_monitor.on_window(window):
+            logging.warning(Fore.RED + str(breach) + Style.RESET_ALL)
+        if not aborted and self._threshold_monitor.aborted:
+            logging.warning(Fore.RED + 'stopping the run' + Style.RESET_ALL)
+            # the workers finish gracefully, a running search is shut down with them
+            self.send_command('stop')
+
+    def send_command(self, *command) -> None:
+        for q in self._command_queues:
+            q.put_nowait(command)
+
+    def __run_search(self):
+        self._search.run()
+        # the search is done, stop the workers
+        self.send_command('stop')
+
+    def __set_load(self, step: int, load: float):
+        mode = self._config.search.mode
+        hatch_rate = max(round(self._config.hatch_rate / self._config.worker), 1)
+        for i, (users, arrival_rate) in enumerate(split_load(load, self._config.worker, mode)):
+            self._command_queues[i].put_nowait(('stage', step))
+            if mode == 'users':
+                self._command_queues[i].put_nowait(('users', users, hatch_rate))
+            else:
+                self._command_queues[i].put_nowait(('arrival_rate', arrival_rate))
+
+    def __snapshot(self) -> FinalResult:
+        with self._lock:
+            return self._result.snapshot()
 
     def __count_result(self, time_wait=5.0):
         while not self._calc_thread.need_quit():
             self.__print_current_result()
             time.sleep(time_wait)
 
-    def _update_realtime_result(self, result: RunResult):
-        count = 0
-        self._mid_results.append(result)
-        if len(self._mid_results) == self._config.worker:
-            for r in self._mid_results:
-                count += len(r.success_results)
-            self._wq.put_nowait((datetime.now().strftime('%H:%M:%S'), count / float(REPORT_INTERVAL)))
-            # self._realtime_rps.append((datetime.now().strftime('%H:%M:%S'), count / float(REPORT_INTERVAL)))
-            self._mid_results.clear()
-
     def __print_current_result(self):
+        # only copy the aggregates under the lock, the receive loop must not wait for the printing
         with self._lock:
-            self._result.run_time = self._result.last_time - self._start_time
-            if self._result.run_time > 0.9:
-                fr = BenchmarkResult.generate_benchmark_result(self._result)
-                fr.print()
+            snapshot = self._result.snapshot()
+            rows = len(self._time_series)
+        snapshot.run_time = snapshot.last_time - self._start_time
+        if snapshot.run_time > 0.9:
+            fr = BenchmarkResult.generate_benchmark_result(snapshot)
+            if rows > self._printed_rows:
+                # rows are only appended, read them without the lock
+                print('last intervals (response time in ms):\n' + TimeSeries.header())
+                for i in range(self._printed_rows, rows):
+                    print(self._time_series.format_row(i))
+                self._printed_rows = rows
+            fr.print()
 
     @staticmethod
     def __generate_conf_for_workers(config: BenchmarkConfig) -> List[BenchmarkConfig]:
         # mod users and hatch rate
         base_count = math.floor(config.users / config.worker)
         add_user_count = config.users - base_count * config.worker
-        hatch_rate = round(config.hatch_rate / config.worker)
+        hatch_rate = max(round(config.hatch_rate / config.worker), 1)
+        stages = split_stages(config.stages, config.worker) if config.stages is not None else None
         ret = []
         for i in range(config.worker):
             worker_config = copy.copy(config)
@@ -133,8 +446,14 @@ class BenchmarkTools:
             else:
                 worker_config.users = base_count
             worker_config.hatch_rate = hatch_rate
+            if config.arrival_rate is not None:
+                worker_config.arrival_rate = config.arrival_rate / config.worker
+            if stages is not None:
+                worker_config.stages = stages[i]
             ret.append(worker_config)
         return ret
 
 
 benchmark_tool = BenchmarkTools()
+# seconds spent importing the package
+IMPORT_TIME = time.time() - IMPORT_START
@@ -1,11 +1,56 @@
+import sys
 import click
 from benchmark_tools import benchmark_tool
 
 
-@click.command()
-@click.option('-f', '--file', help='The benchmark client class file', required=True, type=click.Path(exists=True))
-def run_benchmark(file):
-    benchmark_tool.run(file)
+@click.group(invoke_without_command=True)
+@click.option('-f', '--file', help='The benchmark client class file', type=click.Path(exists=True))
+@click.option('--profile-startup', is_flag=True, help='Print the time of every startup phase')
+@click.pass_context
+def run_benchmark(ctx, file, profile_startup):
+    if ctx.invoked_subcommand is not None:
+        return
+    if file is None:
+        raise click.UsageError('Missing option "-f" / "--file".')
+    sys.exit(benchmark_tool.run(file, profile_startup))
+
+
+@run_benchmark.command(help='Run the workers assigned by a remote controller')
+@click.option('--controller', help='host:port of the controller', required=True)
+@click.option('--authkey', help='The authkey of the controller', required=True)
+def agent(controller, authkey):
+    from benchmark_tools.agent import run_agent
+    run_agent(controller, authkey)
+
+
+@run_benchmark.command(help='Compare an exported run with a baseline run, exit 1 on a regression')
+@click.argument('baseline', type=click.Path(exists=True))
+@click.argument('current', type=click.Path(exists=True))
+@click.option('--alpha', default=0.01, show_default=True, help='Significance level of the tests')
+@click.option('--tolerance', default=0.05, show_default=True, help='Smallest relative change counted as a regression')
+def compare(baseline, current, alpha, tolerance):
+    from benchmark_tools.compare import RunData, compare_runs
+    from benchmark_tools.benchmark_result import BenchmarkResult
+    rows = compare_runs(RunData.load(baseline), RunData.load(current), alpha, tolerance)
+    print(BenchmarkResult.comparison_table(rows))
+    sys.exit(1 if any(row.regressed for row in rows) else 0)
+
+
+@run_benchmark.command(help='Run a local HTTP server answering every request with the same response')
+@click.option('--listen', default='127.0.0.1:8080', show_default=True, help='host:port to listen on')
+@click.option('--body', default='ok', show_default=True, help='The body of the response')
+@click.option('--delay', default=0.0, show_default=True, help='Seconds before every response is sent')
+def stub(listen, body, delay):
+    from benchmark_tools.stub_server import run_stub_server
+    run_stub_server(listen, body.encode(), delay)
+
+
+@run_benchmark.command(help='Run a local server sending every byte or datagram back')
+@click.option('--listen', default='tcp://127.0.0.1:9000', show_default=True,
+              help='tcp://host:port, udp://host:port or unix:///path to listen on')
+def echo(listen):
+    from benchmark_tools.stub_server import run_echo_server
+    run_echo_server(listen)
 
 
 if __name__ == '__main__':
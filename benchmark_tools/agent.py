@@ -0,0 +1,243 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from multiprocessing import Process, Queue
+from multiprocessing.connection import Listener, Client, Connection
+from typing import List, Optional
+import queue
+import uvloop
+from .benchmark_conf import BenchmarkConfig
+from .benchmark_context import RunResult
+from .benchmark_tool import BenchmarkTool
+from .helper import parse_address
+
+
+# rounds of the clock synchronization, the round with the shortest round trip wins
+CLOCK_SYNC_ROUNDS = 5
+# an agent which sends nothing for this many seconds is taken as dropped out
+AGENT_TIMEOUT = 10.0
+
+
+class AgentConnection:
+    """
+    Controller side of the connection to one agent.
+
+    The worker indexes of an agent are global, so the results of remote workers
+    are merged exactly like the local ones.
+    """
+    def __init__(self, conn: Connection, address: str):
+        self._conn = conn
+        self._address = address
+        self._send_lock = threading.Lock()
+        self._first_worker = 0
+        self._worker_count = 0
+        # agent clock minus controller clock, in seconds
+        self._clock_offset = 0.0
+        self._rtt = 0.0
+        self._dropped_time: Optional[float] = None
+
+    @property
+    def address(self) -> str:
+        return self._address
+
+    @property
+    def workers(self) -> range:
+        return range(self._first_worker, self._first_worker + self._worker_count)
+
+    @property
+    def clock_offset(self) -> float:
+        return self._clock_offset
+
+    @property
+    def rtt(self) -> float:
+        return self._rtt
+
+    @property
+    def dropped_time(self) -> Optional[float]:
+        return self._dropped_time
+
+    def sync_clock(self, rounds: int = CLOCK_SYNC_ROUNDS) -> None:
+        best = None
+        for _ in range(rounds):
+            t0 = time.time()
+            self._conn.send(('clock',))
+            _, agent_time = self._conn.recv()
+            t1 = time.time()
+            if best is None or t1 - t0 < best[0]:
+                best = (t1 - t0, agent_time - (t0 + t1) / 2)
+        self._rtt, self._clock_offset = best
+
+    def start(self, first_worker: int, configs: List[BenchmarkConfig], report_interval: float) -> None:
+        self._first_worker = first_worker
+        self._worker_count = len(configs)
+        # the agent may not have the client class file, send its source
+        class_file = configs[0].benchmark_class_file
+        with open(class_file, 'r') as f:
+            source = f.read()
+        self.send(('start', first_worker, configs, report_interval, os.path.basename(class_file), source))
+
+    def send(self, message: tuple) -> None:
+        with self._send_lock:
+            self._conn.send(message)
+
+    def recv_result(self, timeout: float) -> Optional[RunResult]:
+        """
+        :return: None when nothing arrived in the timeout
+        :raise EOFError: the agent closed the connection
+        """
+        if not self._conn.poll(timeout):
+            return None
+        _, result = self._conn.recv()
+        # move the times to the clock of the controller
+        result.start_time -= self._clock_offset
+        result.last_time -= self._clock_offset
+        if result.startup is not None:
+            result.startup = {k: v - self._clock_offset for k, v in result.startup.items()}
+        return result
+
+    def set_dropped(self) -> None:
+        self._dropped_time = time.time()
+
+    def close(self) -> None:
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+
+    def __str__(self):
+        s = f'{self._address:>22}{self._first_worker:>8}-{self._first_worker + self._worker_count - 1:<6}' \
+            f'{self._clock_offset * 1000:>+14.1f}{self._rtt * 1000:>10.1f}'
+        if self._dropped_time is not None:
+            s += f"    dropped at {datetime.fromtimestamp(self._dropped_time).strftime('%H:%M:%S')}"
+        return s
+
+
+class RemoteCommandQueue:
+    """
+    Command queue of a remote worker, same interface as the queue of a local worker.
+    """
+    def __init__(self, agent: AgentConnection, worker_index: int):
+        self._agent = agent
+        self._worker_index = worker_index
+
+    def put_nowait(self, command: tuple) -> None:
+        if self._agent.dropped_time is not None:
+            return
+        try:
+            self._agent.send(('command', self._worker_index, command))
+        except OSError as e:
+            logging.warning(f'send command to agent {self._agent.address} failed: {e}')
+
+
+class AgentServer:
+    def __init__(self, address: str, authkey: str):
+        self._listener = Listener(parse_address(address), authkey=authkey.encode())
+        self._agents: List[AgentConnection] = []
+
+    @property
+    def agents(self) -> List[AgentConnection]:
+        return self._agents
+
+    def accept(self, count: int) -> List[AgentConnection]:
+        while len(self._agents) < count:
+            print(f'waiting for agents {len(self._agents)}/{count} on {self._listener.address}')
+            conn = self._listener.accept()
+            host, port = self._listener.last_accepted
+            agent = AgentConnection(conn, f'{host}:{port}')
+            agent.sync_clock()
+            print(f'agent {agent.address} connected, clock offset {agent.clock_offset * 1000:+.1f} ms, '
+                  f'rtt {agent.rtt * 1000:.1f} ms')
+            self._agents.append(agent)
+        return self._agents
+
+    def close(self) -> None:
+        for agent in self._agents:
+            agent.close()
+        self._listener.close()
+
+    def report(self) -> str:
+        header = f"{'agent':>22}{'workers':>15}{'clock skew ms':>14}{'rtt ms':>10}"
+        lines = ['agents:', header]
+        for agent in self._agents:
+            lines.append(str(agent))
+        return '\n'.join(lines)
+
+
+def run_agent_worker(index: int, conf: BenchmarkConfig, report_interval: float,
+                     command_queue: Queue, result_queue: Queue, client_class: Optional[type]):
+    uvloop.install()
+    tool = BenchmarkTool(index, conf, result_queue.put_nowait, report_interval, command_queue, client_class)
+    tool.run()
+
+
+def run_agent(controller: str, authkey: str) -> None:
+    """
+    connect to the controller, run the workers it assigns and send their results back
+    """
+    conn = Client(parse_address(controller), authkey=authkey.encode())
+    print(f'connected to controller {controller}')
+    while True:
+        message = conn.recv()
+        if message[0] == 'clock':
+            conn.send(('clock', time.time()))
+        elif message[0] == 'start':
+            break
+    _, first_worker, configs, report_interval, file_name, source = message
+    class_dir = tempfile.mkdtemp(prefix='benchmark_agent_')
+    class_file = os.path.join(class_dir, file_name)
+    with open(class_file, 'w') as f:
+        f.write(source)
+    from . import preload_client_class
+    client_class = preload_client_class(class_file)
+    result_queue = Queue()
+    command_queues = []
+    processes = []
+    for i, conf in enumerate(configs):
+        conf.benchmark_class_file = class_file
+        command_queues.append(Queue())
+        processes.append(Process(target=run_agent_worker,
+                                 args=(first_worker + i, conf, report_interval, command_queues[i], result_queue,
+                                       client_class)))
+    for process in processes:
+        process.start()
+    print(f'running workers {first_worker}-{first_worker + len(configs) - 1}')
+
+    def receive_commands():
+        try:
+            while True:
+                _, worker_index, command = conn.recv()
+                command_queues[worker_index - first_worker].put_nowait(command)
+        except (EOFError, OSError):
+            # the controller is gone, stop the workers gracefully
+            for q in command_queues:
+                q.put_nowait(('stop',))
+
+    threading.Thread(target=receive_commands, daemon=True).start()
+    finished = 0
+    connected = True
+    while finished < len(processes):
+        try:
+            result: RunResult = result_queue.get(timeout=1.0)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes):
+                break
+            continue
+        if result.finish:
+            finished += 1
+        if connected:
+            try:
+                conn.send(('result', result))
+            except OSError as e:
+                logging.warning(f'send result to controller failed: {e}')
+                connected = False
+    for process in processes:
+        process.join(timeout=5.0)
+        if process.is_alive():
+            process.terminate()
+    conn.close()
+    os.remove(class_file)
+    os.rmdir(class_dir)
+    print('all workers finished')
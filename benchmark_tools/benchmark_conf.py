@@ -1,7 +1,16 @@
 import os.path
+import math
 import yaml
 import re
-from typing import Tuple, Union, Optional
+from typing import Tuple, Union, Optional, List
+from .load_shape import Stage, parse_stages, generate_shape
+from .saturation import SearchConfig
+from .data_feeder import DataFeederConfig, build_index
+from .replay import ReplayConfig
+from .export import ExportConfig
+from .compare import BaselineConfig
+from .thresholds import Threshold, parse_thresholds
+from .failures import FailureConfig
 
 from yaml.constructor import Constructor
 
@@ -24,6 +33,22 @@ class BenchmarkConfig:
         self._worker = config_obj['worker']
         self._benchmark_class_file = config_obj['benchmark_class_file']
         self._enable_dash = config_obj['enable_dash']
+        self._dash_port: int = config_obj['dash_port']
+        self._arrival_rate: Optional[float] = config_obj['arrival_rate']
+        self._shutdown_timeout: float = config_obj['shutdown_timeout']
+        self._warmup: float = config_obj['warmup']
+        self._cooldown: float = config_obj['cooldown']
+        self._stages: Optional[List[Stage]] = config_obj['stages']
+        self._search: Optional[SearchConfig] = config_obj['search']
+        self._agents: int = config_obj['agents']
+        self._listen: str = config_obj['listen']
+        self._authkey: Optional[str] = config_obj['authkey']
+        self._data_feeder: Optional[DataFeederConfig] = config_obj['data_feeder']
+        self._replay: Optional[ReplayConfig] = config_obj['replay']
+        self._export: Optional[ExportConfig] = config_obj['export']
+        self._baseline: Optional[BaselineConfig] = config_obj['baseline']
+        self._thresholds: Optional[List[Threshold]] = config_obj['thresholds']
+        self._failures: FailureConfig = config_obj['failures']
         self._custom_config: Union[None, dict] = config_obj['custom_config']
 
     def __str__(self):
@@ -35,6 +60,21 @@ class BenchmarkConfig:
                f'worker: {self._worker}\n' \
                f'benchmark_class_file: {self._benchmark_class_file}\n' \
                f'enable_dash: {self._enable_dash}\n' \
+               f'dash_port: {self._dash_port}\n' \
+               f'arrival_rate: {self._arrival_rate}\n' \
+               f'shutdown_timeout: {self._shutdown_timeout}\n' \
+               f'warmup: {self._warmup}\n' \
+               f'cooldown: {self._cooldown}\n' \
+               f'stages: {self._stages}\n' \
+               f'search: {self._search}\n' \
+               f'agents: {self._agents}\n' \
+               f'listen: {self._listen}\n' \
+               f'data_feeder: {self._data_feeder}\n' \
+               f'replay: {self._replay}\n' \
+               f'export: {self._export}\n' \
+               f'baseline: {self._baseline}\n' \
+               f'thresholds: {self._thresholds}\n' \
+               f'failures: {self._failures}\n' \
                f'custom_config: {self._custom_config}'
 
     @property
@@ -71,6 +111,10 @@ class BenchmarkConfig:
     def benchmark_class_file(self) -> str:
         return self._benchmark_class_file
 
+    @benchmark_class_file.setter
+    def benchmark_class_file(self, value: str) -> None:
+        self._benchmark_class_file = value
+
     @property
     def worker(self) -> int:
         return self._worker
@@ -79,6 +123,127 @@ class BenchmarkConfig:
     def enable_dash(self) -> bool:
         return self._enable_dash
 
+    @property
+    def dash_port(self) -> int:
+        """
+        port of the dashboard on 127.0.0.1
+        """
+        return self._dash_port
+
+    @property
+    def arrival_rate(self) -> Optional[float]:
+        """
+        target requests per second of the open loop mode, None means closed loop mode
+        """
+        return self._arrival_rate
+
+    @arrival_rate.setter
+    def arrival_rate(self, value: float) -> None:
+        assert value > 0
+        self._arrival_rate = value
+
+    @property
+    def shutdown_timeout(self) -> float:
+        """
+        total deadline of the teardown phase of a worker, in seconds
+        """
+        return self._shutdown_timeout
+
+    @property
+    def warmup(self) -> float:
+        """
+        seconds at the start of the run excluded from the headline statistics
+        """
+        return self._warmup
+
+    @property
+    def cooldown(self) -> float:
+        """
+        seconds at the end of the run excluded from the headline statistics
+        """
+        return self._cooldown
+
+    @property
+    def stages(self) -> Optional[List[Stage]]:
+        """
+        the load shape, None means reach the users at the hatch rate and keep them for the run time
+        """
+        return self._stages
+
+    @stages.setter
+    def stages(self, value: List[Stage]) -> None:
+        self._stages = value
+
+    @property
+    def search(self) -> Optional[SearchConfig]:
+        """
+        the saturation search, None means a normal run
+        """
+        return self._search
+
+    @property
+    def agents(self) -> int:
+        """
+        number of remote agents which run the workers, 0 means the workers run on this machine
+        """
+        return self._agents
+
+    @property
+    def listen(self) -> str:
+        """
+        host:port the controller listens on for the agents
+        """
+        return self._listen
+
+    @property
+    def authkey(self) -> Optional[str]:
+        """
+        the key shared with the agents, the agents run the code the controller sends, so there is no default
+        """
+        return self._authkey
+
+    @property
+    def data_feeder(self) -> Optional[DataFeederConfig]:
+        """
+        the shared data file of the clients, None means no data feeder
+        """
+        return self._data_feeder
+
+    @property
+    def replay(self) -> Optional[ReplayConfig]:
+        """
+        the timestamped log to replay, None means a normal run
+        """
+        return self._replay
+
+    @property
+    def export(self) -> Optional[ExportConfig]:
+        """
+        where the results are written during the run, None means only print them
+        """
+        return self._export
+
+    @property
+    def baseline(self) -> Optional[BaselineConfig]:
+        """
+        the exported run this run is compared with at the end, None means no comparison
+        """
+        return self._baseline
+
+    @property
+    def thresholds(self) -> Optional[List[Threshold]]:
+        """
+        the limits checked during the run, a breach stops the run, None means no limit
+        """
+        return self._thresholds
+
+    @property
+    def failures(self) -> FailureConfig:
+        """
+        how the failures are grouped into categories
+        """
+        return self._failures
+
     @property
     def custom_config(self) -> Optional[dict]:
         return self._custom_config
@@ -91,19 +256,75 @@ def load_benchmark_config_from_file(conf_file: str) -> BenchmarkConfig:
             pass
         else:
             raise ValueError('config err: "host" must be set with string type')
+        if 'stages' in c or 'shape' in c:
+            if 'stages' in c and 'shape' in c:
+                raise ValueError('config err: only one of "stages" and "shape" can be set')
+            if 'run_time' in c:
+                raise ValueError('config err: "run_time" is the sum of the stages, do not set it with stages')
+            hatch_rate = c['hatch_rate'] if isinstance(c.get('hatch_rate'), int) and c['hatch_rate'] > 0 else None
+            arrival_rate = c['arrival_rate'] if type(c.get('arrival_rate')) in (int, float) else None
+            if 'stages' in c:
+                stages = parse_stages(c['stages'], hatch_rate, arrival_rate)
+            else:
+                stages = generate_shape(c['shape'], hatch_rate, arrival_rate)
+            if any(s.arrival_rate is not None for s in stages):
+                if stages[0].arrival_rate is None:
+                    raise ValueError('config err: "arrival_rate" must be set for the first stage')
+                c['arrival_rate'] = stages[0].arrival_rate
+            c['stages'] = stages
+            c['run_time'] = sum(s.duration for s in stages)
+            c['users'] = max(max(s.users for s in stages), 1)
+            c['hatch_rate'] = stages[0].hatch_rate
+        else:
+            c['stages'] = None
+        if 'search' in c:
+            if c['stages'] is not None:
+                raise ValueError('config err: "search" can not be used with stages')
+            search = SearchConfig(c['search'], c.get('arrival_rate'))
+            # the workers start at the first load of the search
+            if search.mode == 'users':
+                c['users'] = search.start
+            else:
+                c['arrival_rate'] = search.start
+                if 'users' not in c:
+                    c['users'] = max(math.ceil(search.max), c.get('worker', 1))
+            c['search'] = search
+        else:
+            c['search'] = None
+        if 'replay' in c:
+            if 'arrival_rate' in c or c['stages'] is not None or c['search'] is not None:
+                raise ValueError('config err: "replay" can not be used with arrival_rate, stages or search')
+            c['replay'] = ReplayConfig(c['replay'])
+            # users is the size of the client pool of the replay
+            if 'users' not in c:
+                c['users'] = 100 * c.get('worker', 1)
+        else:
+            c['replay'] = None
+        if 'arrival_rate' in c:
+            if type(c['arrival_rate']) in (int, float) and c['arrival_rate'] > 0:
+                c['arrival_rate'] = float(c['arrival_rate'])
+            else:
+                raise ValueError('config err: "arrival_rate" need > 0')
+            # in open loop mode users is the size of the client pool, one second of requests by default
+            if 'users' not in c:
+                c['users'] = max(math.ceil(c['arrival_rate']), c.get('worker', 1))
+        else:
+            c['arrival_rate'] = None
         if 'users' in c and isinstance(c['users'], int) and c['users'] > 0:
             pass
         else:
             raise ValueError('config err: "users" need >=0')
+        # the users of a saturation search grow up to the max of the search
+        max_users = c['search'].max if c['search'] is not None and c['search'].mode == 'users' else c['users']
         if 'hatch_rate' in c:
             if isinstance(c['hatch_rate'], int) and c['hatch_rate'] >= 0:
 
-                if c['hatch_rate'] == 0 or c['hatch_rate'] > c['users']:
-                    c['hatch_rate'] = c['users']
+                if c['hatch_rate'] == 0 or c['hatch_rate'] > max_users:
+                    c['hatch_rate'] = max_users
             else:
                 raise ValueError('config err: "hatch_rate" need >= 0')
         else:
-            c['hatch_rate'] = c['users']
+            c['hatch_rate'] = max_users
 
         if 'run_time' in c:
             if isinstance(c['run_time'], int) and c['run_time'] > 0:
@@ -197,12 +418,83 @@ def load_benchmark_config_from_file(conf_file: str) -> BenchmarkConfig:
                 raise ValueError('config err: "enable_dash" must be boolean type')
         else:
             c['enable_dash'] = False
+        if 'dash_port' in c:
+            if isinstance(c['dash_port'], int) and 0 < c['dash_port'] < 65536:
+                pass
+            else:
+                raise ValueError('config err: "dash_port" need between 1 and 65535')
+        else:
+            c['dash_port'] = 8050
+
+        if 'shutdown_timeout' in c:
+            if type(c['shutdown_timeout']) in (int, float) and c['shutdown_timeout'] > 0:
+                c['shutdown_timeout'] = float(c['shutdown_timeout'])
+            else:
+                raise ValueError('config err: "shutdown_timeout" need > 0')
+        else:
+            c['shutdown_timeout'] = 5.0
+
+        for key in ('warmup', 'cooldown'):
+            if key in c:
+                if type(c[key]) in (int, float) and c[key] >= 0:
+                    c[key] = float(c[key])
+                else:
+                    raise ValueError(f'config err: "{key}" need >= 0')
+            else:
+                c[key] = 0.0
+
+        if 'agents' in c:
+            if isinstance(c['agents'], int) and c['agents'] >= 0:
+                pass
+            else:
+                raise ValueError('config err: "agents" need >= 0')
+            if c['agents'] > c['worker']:
+                raise ValueError('config err: "worker" need >= "agents", every agent runs one worker at least')
+        else:
+            c['agents'] = 0
+        if 'listen' in c:
+            if isinstance(c['listen'], str) and ':' in c['listen']:
+                pass
+            else:
+                raise ValueError('config err: "listen" must be host:port')
+        else:
+            # only local agents by default, listen on the address of the network for remote ones
+            c['listen'] = '127.0.0.1:5557'
+        if 'authkey' in c:
+            if isinstance(c['authkey'], str) and len(c['authkey']) > 0:
+                pass
+            else:
+                raise ValueError('config err: "authkey" must be a none empty string')
+        elif c['agents'] > 0:
+            raise ValueError('config err: "agents" need an "authkey" shared with the agents')
+        else:
+            c['authkey'] = None
+
+        if 'data_feeder' in c:
+            feeder = DataFeederConfig(c['data_feeder'])
+            feeder.partitions = c['users']
+            feeder.workers = c['worker']
+            # build the index once here, the workers only map it
+            build_index(feeder.file, feeder.format)
+            c['data_feeder'] = feeder
+        else:
+            c['data_feeder'] = None
+
+        c['export'] = ExportConfig(c['export']) if 'export' in c else None
+        c['baseline'] = BaselineConfig(c['baseline']) if 'baseline' in c else None
+        # by default the thresholds are checked once all users are hatched
+        c['thresholds'] = parse_thresholds(c['thresholds'], c['users'] / max(c['hatch_rate'], 1)) \
+            if 'thresholds' in c else None
+        c['failures'] = FailureConfig(c.get('failures', {}))
 
         custom_config = {}
         for k, v in c.items():
             if k not in ['host', 'users', 'hatch_rate', 'run_time',
                          'worker', 'benchmark_class_file', 'wait_time',
-                         'min_wait_time', 'max_wait_time', 'enable_dash']:
+                         'min_wait_time', 'max_wait_time', 'enable_dash', 'dash_port', 'arrival_rate',
+                         'shutdown_timeout', 'warmup', 'cooldown', 'stages', 'shape', 'search', 'agents', 'listen',
+                         'authkey', 'data_feeder', 'replay', 'export', 'baseline', 'thresholds',
+                         'failures']:
                 custom_config[k] = v
 
         c['custom_config'] = custom_config if len(custom_config) > 0 else None
@@ -1,14 +1,45 @@
-from typing import List, Dict, Optional, Union
+from typing import Dict, List, Optional, Union, Tuple
 import time
+import random
+from .histogram import LatencyHistogram
+from .data_feeder import DataFeeder
+from .monitor import rss_bytes
+from .failures import FailureConfig, FailureClassifier, DEFAULT, MAX_MESSAGE_LENGTH, merge_failures
 
 
 class RunResult:
     def __init__(self):
         self.worker_index = 0
         self.now_user = 0
-        self.success_results: Union[None, List[float]] = None
+        # index of the load shape stage which the interval belongs to
+        self.stage = 0
+        self.success_results: Union[None, LatencyHistogram] = None
+        # failures by category, and the first raw messages of the categories
         self.failed_reason: Union[None, Dict[str, int]] = None
+        self.failure_examples: Union[None, Dict[str, List[str]]] = None
+        self.schedule_lag: Union[None, LatencyHistogram] = None
+        self.dropped = 0
+        self.start_time: float = 0.0
         self.last_time: float = 0.0
+        # self monitoring of the worker: cpu usage in the interval (100 is one core), max and mean
+        # delay of the event loop in seconds, resident memory and the requests running at the report
+        self.cpu_percent = 0.0
+        self.loop_lag_max = 0.0
+        self.loop_lag_mean = 0.0
+        self.rss = 0
+        self.inflight = 0
+        # only set in the finish result
+        self.teardown_time = 0.0
+        self.teardown_timeouts = 0
+        # named operations, keyed by the id of the name interned in the worker
+        self.operations: Union[None, Dict[int, LatencyHistogram]] = None
+        self.operation_fails: Union[None, Dict[int, int]] = None
+        # timing phases of the requests, keyed like the operations
+        self.timings: Union[None, Dict[int, LatencyHistogram]] = None
+        # names used for the first time in this interval
+        self.new_operations: Union[None, Dict[int, str]] = None
+        # timestamps of the startup phases of the worker, only sent once
+        self.startup: Union[None, Dict[str, float]] = None
 
         self.finish = False
 
@@ -19,14 +50,178 @@ class RunResult:
                f'last_time:{self.last_time}\n'
 
 
+class WorkerStats:
+    """
+    load generator health of one worker over the run
+    """
+    def __init__(self):
+        self.intervals = 0
+        self.cpu_sum = 0.0
+        self.cpu_max = 0.0
+        self.loop_lag_sum = 0.0
+        self.loop_lag_max = 0.0
+        self.rss_max = 0
+        self.inflight = 0
+        self.inflight_max = 0
+
+    def update(self, result: RunResult) -> None:
+        self.intervals += 1
+        self.cpu_sum += result.cpu_percent
+        self.cpu_max = max(self.cpu_max, result.cpu_percent)
+        self.loop_lag_sum += result.loop_lag_mean
+        self.loop_lag_max = max(self.loop_lag_max, result.loop_lag_max)
+        self.rss_max = max(self.rss_max, result.rss)
+        self.inflight = result.inflight
+        self.inflight_max = max(self.inflight_max, result.inflight)
+
+    @property
+    def cpu_mean(self) -> float:
+        return self.cpu_sum / self.intervals if self.intervals > 0 else 0.0
+
+    @property
+    def loop_lag_mean(self) -> float:
+        return self.loop_lag_sum / self.intervals if self.intervals > 0 else 0.0
+
+    def copy(self) -> 'WorkerStats':
+        ws = WorkerStats()
+        ws.__dict__.update(self.__dict__)
+        return ws
+
+
+class StageSummary:
+    """
+    Results of one load shape stage.
+
+    The latencies are kept as a sparse histogram, a shape of thousands of short stages holds only
+    the buckets each stage used instead of a full histogram per stage.
+    """
+    def __init__(self, num_of_worker: int, generation: int = 0):
+        self._users_list = [0] * num_of_worker
+        self._buckets: Dict[int, int] = {}
+        self._count = 0
+        self._sum = 0
+        self._min = 0
+        self._max = 0
+        self._fail_count = 0
+        self._first_time = 0.0
+        self._last_time = 0.0
+        # the snapshot generation of the FinalResult when the summary was created, see FinalResult.snapshot
+        self.generation = generation
+
+    def update(self, result: RunResult) -> None:
+        self._users_list[result.worker_index] = result.now_user
+        h = result.success_results
+        if h is not None and h.count > 0:
+            buckets = self._buckets
+            for i, c in h.nonzero_buckets():
+                buckets[i] = buckets.get(i, 0) + c
+            if self._count == 0 or h.min_us < self._min:
+                self._min = h.min_us
+            if h.max_us > self._max:
+                self._max = h.max_us
+            self._count += h.count
+            self._sum += h.total_us
+        self._fail_count += sum(result.failed_reason.values())
+        if result.start_time > 0 and (self._first_time == 0 or result.start_time < self._first_time):
+            self._first_time = result.start_time
+        if result.last_time > self._last_time:
+            self._last_time = result.last_time
+
+    def copy(self, generation: int) -> 'StageSummary':
+        ss = StageSummary(0, generation)
+        ss._users_list = list(self._users_list)
+        ss._buckets = dict(self._buckets)
+        ss._count, ss._sum, ss._min, ss._max = self._count, self._sum, self._min, self._max
+        ss._fail_count = self._fail_count
+        ss._first_time, ss._last_time = self._first_time, self._last_time
+        return ss
+
+    @property
+    def users(self) -> int:
+        return sum(self._users_list)
+
+    @property
+    def success_count(self) -> int:
+        return self._count
+
+    @property
+    def fail_count(self) -> int:
+        return self._fail_count
+
+    @property
+    def first_time(self) -> float:
+        return self._first_time
+
+    @property
+    def last_time(self) -> float:
+        return self._last_time
+
+    def histogram(self) -> LatencyHistogram:
+        """
+        the full histogram of the stage, built for the report
+        """
+        return LatencyHistogram.from_buckets(self._buckets, self._sum, self._min, self._max)
+
+
 class FinalResult:
-    def __init__(self, num_of_worker: int):
+    def __init__(self, num_of_worker: int, track_stages: bool = True, track_operations: bool = True,
+                 track_workers: bool = True, failure_conf: Optional[FailureConfig] = None):
         self._users_list = [0] * num_of_worker
         self._users = 0
-        self._failed_reasons = {}
-        self._success_results = []
+        self._failure_conf = failure_conf if failure_conf is not None else FailureConfig({})
+        self._failed_reasons: Dict[str, int] = {}
+        self._failure_examples: Dict[str, List[str]] = {}
+        self._fail_count = 0
+        self._success_results = LatencyHistogram()
+        self._schedule_lag = LatencyHistogram()
+        self._dropped = 0
+        self._teardown_time = 0.0
+        self._teardown_timeouts = 0
+        self._first_time = 0
         self._last_time = 0
         self._run_time = 0
+        self._stage_results: Optional[Dict[int, StageSummary]] = {} if track_stages else None
+        # counts the snapshots, a stage summary older than the last snapshot is shared with it
+        self._generation = 0
+        # (worker index, operation id) -> operation name
+        self._operation_names: Optional[Dict[Tuple[int, int], str]] = {} if track_operations else None
+        # results with operations whose names did not arrive yet, the names come with the first use of an
+        # operation and the shared memory and the queue do not keep the order
+        self._unnamed: List[RunResult] = []
+        self._operations: Dict[str, LatencyHistogram] = {}
+        self._operation_fails: Dict[str, int] = {}
+        self._timings: Dict[str, LatencyHistogram] = {}
+        self._worker_stats: Optional[Dict[int, WorkerStats]] = {} if track_workers else None
+
+    def snapshot(self) -> 'FinalResult':
+        """
+        copy the running aggregates, the cost is constant and does not grow with the run time
+        """
+        fr = FinalResult(len(self._users_list), False, False, False, self._failure_conf)
+        fr._users_list = list(self._users_list)
+        fr._users = self._users
+        fr._failed_reasons = dict(self._failed_reasons)
+        fr._failure_examples = {k: list(v) for k, v in self._failure_examples.items()}
+        fr._fail_count = self._fail_count
+        fr._success_results = self._success_results.copy()
+        fr._schedule_lag = self._schedule_lag.copy()
+        fr._dropped = self._dropped
+        fr._teardown_time = self._teardown_time
+        fr._teardown_timeouts = self._teardown_timeouts
+        fr._first_time = self._first_time
+        fr._last_time = self._last_time
+        fr._run_time = self._run_time
+        if self._stage_results is not None:
+            # the summaries are shared, update copies a shared one before changing it, so only the
+            # stages still reported are copied, once per snapshot
+            fr._stage_results = dict(self._stage_results)
+            self._generation += 1
+        fr._operations = {k: v.copy() for k, v in self._operations.items()}
+        fr._operation_fails = dict(self._operation_fails)
+        fr._timings = {k: v.copy() for k, v in self._timings.items()}
+        if self._worker_stats is not None:
+            fr._worker_stats = {k: v.copy() for k, v in self._worker_stats.items()}
+        return fr
 
     @property
     def users(self) -> int:
@@ -37,9 +232,43 @@ class FinalResult:
         return self._failed_reasons
 
     @property
-    def success_results(self) -> List[float]:
+    def failure_examples(self) -> Dict[str, List[str]]:
+        return self._failure_examples
+
+    @property
+    def timings(self) -> Dict[str, LatencyHistogram]:
+        """
+        histograms of the timing phases marked by the clients
+        """
+        return self._timings
+
+    @property
+    def fail_count(self) -> int:
+        return self._fail_count
+
+    @property
+    def success_results(self) -> LatencyHistogram:
         return self._success_results
 
+    @property
+    def schedule_lag(self) -> LatencyHistogram:
+        return self._schedule_lag
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    @property
+    def teardown_time(self) -> float:
+        """
+        the longest teardown of all workers
+        """
+        return self._teardown_time
+
+    @property
+    def teardown_timeouts(self) -> int:
+        return self._teardown_timeouts
+
     @property
     def run_time(self) -> float:
         return self._run_time
@@ -48,33 +277,161 @@ class FinalResult:
     def run_time(self, value: float) -> None:
         self._run_time = value
 
+    @property
+    def first_time(self) -> float:
+        """
+        start time of the first reported interval
+        """
+        return self._first_time
+
     @property
     def last_time(self) -> float:
         return self._last_time
 
+    @property
+    def stage_results(self) -> Dict[int, StageSummary]:
+        """
+        results of every load shape stage, keyed by the stage index
+        """
+        return self._stage_results if self._stage_results is not None else {}
+
+    @property
+    def operations(self) -> Dict[str, LatencyHistogram]:
+        """
+        success latency of every named operation
+        """
+        return self._operations
+
+    @property
+    def operation_fails(self) -> Dict[str, int]:
+        return self._operation_fails
+
+    @property
+    def worker_stats(self) -> Dict[int, WorkerStats]:
+        """
+        self monitoring of every worker, keyed by the worker index
+        """
+        return self._worker_stats if self._worker_stats is not None else {}
+
     def update(self, result: RunResult):
+        if self._stage_results is not None:
+            stage = self._stage_results.get(result.stage)
+            if stage is None:
+                stage = StageSummary(len(self._users_list), self._generation)
+                self._stage_results[result.stage] = stage
+            elif stage.generation < self._generation:
+                stage = stage.copy(self._generation)
+                self._stage_results[result.stage] = stage
+            stage.update(result)
         self._users_list[result.worker_index] = result.now_user
         self._users = sum(self._users_list)
-        self._success_results.extend(result.success_results)
+        self._success_results.merge(result.success_results)
+        self._schedule_lag.merge(result.schedule_lag)
+        self._dropped += result.dropped
+        if result.finish:
+            self._teardown_time = max(self._teardown_time, result.teardown_time)
+            self._teardown_timeouts += result.teardown_timeouts
+        if result.start_time > 0 and (self._first_time == 0 or result.start_time < self._first_time):
+            self._first_time = result.start_time
         if result.last_time > self._last_time:
             self._last_time = result.last_time
-        for failed_reason, count in result.failed_reason.items():
-            if failed_reason in self._failed_reasons:
-                self._failed_reasons[failed_reason] += count
-            else:
-                self._failed_reasons[failed_reason] = count
+        self._fail_count += sum(result.failed_reason.values())
+        merge_failures(self._failed_reasons, self._failure_examples, result.failed_reason, result.failure_examples,
+                       self._failure_conf)
+        if self._operation_names is not None:
+            self.__update_operations(result)
+        # the data sent beside the interval report has no histogram and carries no new stats
+        if self._worker_stats is not None and result.success_results is not None:
+            if result.worker_index not in self._worker_stats:
+                self._worker_stats[result.worker_index] = WorkerStats()
+            self._worker_stats[result.worker_index].update(result)
+
+    def __update_operations(self, result: RunResult):
+        names = self._operation_names
+        if result.new_operations:
+            for op_id, name in result.new_operations.items():
+                names[(result.worker_index, op_id)] = name
+        for ids in (result.operations, result.timings, result.operation_fails):
+            if ids and any((result.worker_index, op_id) not in names for op_id in ids):
+                self._unnamed.append(result)
+                return
+        if result.operations:
+            for op_id, h in result.operations.items():
+                name = names[(result.worker_index, op_id)]
+                if name not in self._operations:
+                    self._operations[name] = LatencyHistogram()
+                self._operations[name].merge(h)
+        if result.timings:
+            for op_id, h in result.timings.items():
+                name = names[(result.worker_index, op_id)]
+                if name not in self._timings:
+                    self._timings[name] = LatencyHistogram()
+                self._timings[name].merge(h)
+        if result.operation_fails:
+            for op_id, count in result.operation_fails.items():
+                name = names[(result.worker_index, op_id)]
+                self._operation_fails[name] = self._operation_fails.get(name, 0) + count
+        if result.new_operations and len(self._unnamed) > 0:
+            waiting, self._unnamed = self._unnamed, []
+            for r in waiting:
+                self.__update_operations(r)
 
 
 class BenchmarkContext:
-    def __init__(self, worker_index: int):
+    def __init__(self, worker_index: int, failure_conf: Optional[FailureConfig] = None):
         self._worker_index = worker_index
         self._users = 0
-        self._failed_reason = {'_default': 0}
-        self._success_results: List[float] = list()
+        self._stage = 0
+        self._start_time = time.time()
+        self._start_cpu = time.process_time()
+        self._failed_reason = {DEFAULT: 0}
+        self._failure_examples: Dict[str, List[str]] = {}
+        self._classifier = FailureClassifier(failure_conf if failure_conf is not None else FailureConfig({}))
+        self._success_results = LatencyHistogram()
+        self._schedule_lag = LatencyHistogram()
+        self._dropped = 0
         self._last_time = 0.0
+        # operation names are interned to ids, a name is only sent once to the controller
+        self._operation_ids: Dict[str, int] = {}
+        self._new_operations: Dict[int, str] = {}
+        self._operations: Dict[int, LatencyHistogram] = {}
+        self._operation_fails: Dict[int, int] = {}
+        self._timings: Dict[int, LatencyHistogram] = {}
+        self._data_feeder: Optional[DataFeeder] = None
+        self._loop_lag_max = 0.0
+        self._loop_lag_sum = 0.0
+        self._loop_lag_count = 0
+        self._inflight = 0
+        self._wait_time: Tuple[float, float] = (0.0, 0.0)
 
     @property
-    def success_results(self) -> List[float]:
+    def inflight(self) -> int:
+        return self._inflight
+
+    @inflight.setter
+    def inflight(self, value: int) -> None:
+        self._inflight = value
+
+    def set_wait_time(self, wait_time: Tuple[float, float]) -> None:
+        self._wait_time = wait_time
+
+    def wait_time(self) -> float:
+        """
+        a wait time of the config in seconds
+        """
+        min_wait, max_wait = self._wait_time
+        return min_wait if min_wait >= max_wait else random.uniform(min_wait, max_wait)
+
+    @property
+    def data_feeder(self) -> Optional[DataFeeder]:
+        return self._data_feeder
+
+    @data_feeder.setter
+    def data_feeder(self, value: DataFeeder) -> None:
+        self._data_feeder = value
+
+    @property
+    def success_results(self) -> LatencyHistogram:
         return self._success_results
 
     @property
@@ -85,29 +442,134 @@ class BenchmarkContext:
     def users(self, value: int) -> None:
         self._users = value
 
+    @property
+    def stage(self) -> int:
+        return self._stage
+
+    @stage.setter
+    def stage(self, value: int) -> None:
+        self._stage = value
+
     @property
     def current_result(self) -> RunResult:
         result = RunResult()
         result.worker_index = self._worker_index
         result.now_user = self._users
+        result.stage = self._stage
+        result.start_time = self._start_time
         result.failed_reason = self._failed_reason
+        result.failure_examples = self._failure_examples
         result.success_results = self._success_results
+        result.schedule_lag = self._schedule_lag
+        result.dropped = self._dropped
+        result.operations = self._operations
+        result.operation_fails = self._operation_fails
+        result.timings = self._timings
+        result.new_operations = self._new_operations
         result.last_time = time.time()
+        result.cpu_percent = (time.process_time() - self._start_cpu) \
+            / max(result.last_time - self._start_time, 0.001) * 100
+        result.loop_lag_max = self._loop_lag_max
+        result.loop_lag_mean = self._loop_lag_sum / self._loop_lag_count if self._loop_lag_count > 0 else 0.0
+        result.rss = rss_bytes()
+        result.inflight = self._inflight
         return result
 
     def reset(self):
-        self._failed_reason = {'_default': 0}
-        self._success_results.clear()
+        # the reported objects are handed over to the result, so create new ones instead of clearing
+        self._failed_reason = {DEFAULT: 0}
+        self._failure_examples = {}
+        self._success_results = LatencyHistogram()
+        self._schedule_lag = LatencyHistogram()
+        self._dropped = 0
+        self._start_time = time.time()
+        self._start_cpu = time.process_time()
+        self._loop_lag_max = 0.0
+        self._loop_lag_sum = 0.0
+        self._loop_lag_count = 0
+        self._new_operations = {}
+        self._operations = {}
+        self._operation_fails = {}
+        self._timings = {}
+
+    def operation_id(self, name: str) -> int:
+        op_id = self._operation_ids.get(name)
+        if op_id is None:
+            op_id = len(self._operation_ids)
+            self._operation_ids[name] = op_id
+            self._new_operations[op_id] = name
+        return op_id
+
+    def report_success(self, time_second: float, name: Optional[str] = None):
+        self._success_results.record(time_second)
+        if name is not None:
+            op_id = self.operation_id(name)
+            h = self._operations.get(op_id)
+            if h is None:
+                h = self._operations[op_id] = LatencyHistogram()
+            h.record(time_second)
+
+    def report_success_ns(self, time_ns: int, name: Optional[str] = None):
+        self._success_results.record_ns(time_ns)
+        if name is not None:
+            op_id = self.operation_id(name)
+            h = self._operations.get(op_id)
+            if h is None:
+                h = self._operations[op_id] = LatencyHistogram()
+            h.record_ns(time_ns)
+
+    def report_operation_ns(self, name: str, time_ns: int) -> None:
+        """
+        record the time of a named operation which is not a request of its own, such as a flow of requests
+        """
+        op_id = self.operation_id(name)
+        h = self._operations.get(op_id)
+        if h is None:
+            h = self._operations[op_id] = LatencyHistogram()
+        h.record_ns(time_ns)
 
-    def report_success(self, time_second: float):
-        self._success_results.append(time_second)
+    def report_operation_fail(self, name: str) -> None:
+        op_id = self.operation_id(name)
+        self._operation_fails[op_id] = self._operation_fails.get(op_id, 0) + 1
 
-    def report_fail(self, fail_reason: Optional[str] = None) -> None:
+    def report_timing(self, phase: str, time_ns: int) -> None:
+        op_id = self.operation_id(phase)
+        h = self._timings.get(op_id)
+        if h is None:
+            h = self._timings[op_id] = LatencyHistogram()
+        h.record_ns(time_ns)
+
+    def report_fail(self, fail_reason: Optional[str] = None, name: Optional[str] = None) -> None:
+        if name is not None:
+            op_id = self.operation_id(name)
+            self._operation_fails[op_id] = self._operation_fails.get(op_id, 0) + 1
         if fail_reason is None or len(fail_reason) == 0:
-            self._failed_reason['_default'] += 1
+            self._failed_reason[DEFAULT] += 1
             return
-        if fail_reason not in self._failed_reason:
-            self._failed_reason[fail_reason] = 0
-        self._failed_reason[fail_reason] += 1
+        self.__count_failure(self._classifier.classify(fail_reason), fail_reason)
+
+    def report_exception(self, e: BaseException, name: Optional[str] = None) -> None:
+        if name is not None:
+            op_id = self.operation_id(name)
+            self._operation_fails[op_id] = self._operation_fails.get(op_id, 0) + 1
+        self.__count_failure(*self._classifier.classify_exception(e))
+
+    def __count_failure(self, category: str, message: str) -> None:
+        self._failed_reason[category] = self._failed_reason.get(category, 0) + 1
+        # a message without variable parts is its own example
+        if message != category:
+            example = message[:MAX_MESSAGE_LENGTH]
+            if self._classifier.need_example(category, example):
+                self._failure_examples.setdefault(category, []).append(example)
+
+    def report_schedule_lag(self, lag_second: float) -> None:
+        self._schedule_lag.record(lag_second)
 
+    def report_dropped(self) -> None:
+        self._dropped += 1
 
+    def report_loop_lag(self, lag_second: float) -> None:
+        self._loop_lag_sum += lag_second
+        self._loop_lag_count += 1
+        if lag_second > self._loop_lag_max:
+            self._loop_lag_max = lag_second
@@ -1,12 +1,33 @@
-import math
 from colorama import Fore, Back, Style
+from typing import List, Optional
+from datetime import datetime
 from .benchmark_context import FinalResult
+from .timeseries import TimeSeries, PhaseSplitter
+from .histogram import LatencyHistogram
+from .monitor import is_overloaded
+from .compare import CompareRow
 
 
 def get_prefix_format() -> str:
     return '{0:30}'
 
 
+# latencies are shown in ms with microsecond precision
+_LATENCY_HEADER = f"{'avg':>10}{'50%':>10}{'90%':>10}{'99%':>10}{'max':>10}"
+
+
+def _latency_columns(h: LatencyHistogram) -> tuple:
+    """
+    avg, 50%, 90%, 99% and max in ms
+    """
+    p50, p90, p99 = h.percentiles_us([0.5, 0.9, 0.99])
+    return h.mean_us / 1000, p50 / 1000, p90 / 1000, p99 / 1000, h.max_us / 1000
+
+
+def _format_latency(columns: tuple) -> str:
+    return ''.join(f'{v:>10.3f}' for v in columns)
+
+
 class BenchmarkResult:
     run_time_prefix = get_prefix_format().format('run time')
     users_prefix = get_prefix_format().format('users')
@@ -19,6 +40,12 @@ class BenchmarkResult:
     max_rep_time_prefix = get_prefix_format().format('max response time')
     rep_time_90_prefix = get_prefix_format().format('90% response time')
     rep_time_50_prefix = get_prefix_format().format('Median response time')
+    schedule_lag_prefix = get_prefix_format().format('schedule lag avg/p99/max')
+    dropped_prefix = get_prefix_format().format('dropped sends')
+    peak_p99_prefix = get_prefix_format().format('peak interval 99% time')
+    teardown_prefix = get_prefix_format().format('teardown time')
+    teardown_timeouts_prefix = get_prefix_format().format('teardown timeouts')
+    steady_prefix = get_prefix_format().format('steady state')
 
     def __init__(self):
         self._run_time: int = 0
@@ -33,60 +60,219 @@ class BenchmarkResult:
         self._rep_time_50: float = 0
         self._accuracy: float = 0.0
         self._failed_reasons = dict()
+        self._failure_examples = dict()
+        self._open_loop = False
+        self._schedule_lag: tuple = (0, 0, 0)
+        self._dropped: int = 0
+        self._teardown_time: float = 0.0
+        self._teardown_timeouts: int = 0
+        self._stage_rows: list = []
+        self._peak_p99: Optional[str] = None
+        self._operation_rows: list = []
+        self._timing_rows: list = []
+        self._worker_rows: list = []
+        self._overloaded: list = []
+        self._steady: Optional[str] = None
+        self._steady_time: Optional[float] = None
+        self._phase_rows: list = []
 
     @staticmethod
     def get_prefix_format() -> str:
         return '{0:25}'
 
     def __str__(self):
-        return f'{self.run_time_prefix}:{self._run_time}\n'\
-            f"{self.users_prefix}:{self._users}\n" \
-            f"{self.success_count_prefix}:{self._success_count}\n" \
+        # with a steady state the counts, rps and response times are of it, the other values of the whole run
+        whole = ' (whole run)' if self._steady is not None else ''
+        s = f'{self.run_time_prefix}:{self._run_time}{whole}\n'\
+            f"{self.users_prefix}:{self._users}\n"
+        if self._steady is not None:
+            s += f'{self.steady_prefix}:{self._steady}\n'
+        s += f"{self.success_count_prefix}:{self._success_count}\n" \
             f"{self.fail_count_prefix}:{self._fail_count}\n" \
             f"{self.rps_prefix}:{self._rps}\n" \
             f"{self.accuracy_prefix}:{self._accuracy}%\n" \
-            f"{self.avg_rep_time_prefix}:{self._avg_rep_time} ms\n" \
-            f"{self.min_rep_time_prefix}:{self._min_rep_time} ms\n" \
-            f"{self.max_rep_time_prefix}:{self._max_rep_time} ms\n" \
-            f"{self.rep_time_90_prefix}:{self._rep_time_90} ms\n" \
-            f"{self.rep_time_50_prefix}:{self._rep_time_50} ms"
+            f"{self.avg_rep_time_prefix}:{self._avg_rep_time:.3f} ms\n" \
+            f"{self.min_rep_time_prefix}:{self._min_rep_time:.3f} ms\n" \
+            f"{self.max_rep_time_prefix}:{self._max_rep_time:.3f} ms\n" \
+            f"{self.rep_time_90_prefix}:{self._rep_time_90:.3f} ms\n" \
+            f"{self.rep_time_50_prefix}:{self._rep_time_50:.3f} ms"
+        if self._open_loop:
+            s += f"\n{self.schedule_lag_prefix}:{'/'.join(f'{t:.3f}' for t in self._schedule_lag)} ms{whole}\n" \
+                f"{self.dropped_prefix}:{self._dropped}{whole}"
+        if self._peak_p99 is not None:
+            s += f"\n{self.peak_p99_prefix}:{self._peak_p99}{whole}"
+        if self._teardown_time > 0:
+            s += f"\n{self.teardown_prefix}:{self._teardown_time:.3f} s\n" \
+                f"{self.teardown_timeouts_prefix}:{self._teardown_timeouts}"
+        return s
 
     def print(self):
         print(self.__str__())
         base = ''
-        for reason, count in self._failed_reasons.items():
+        for reason, count in sorted(self._failed_reasons.items(), key=lambda item: -item[1]):
             if count > 0:
                 base += f'count {count:6}: {reason}\n'
-            if len(base) > 0:
-                print(Fore.RED + f"failed reasons:\n" + base)
-                print(Style.RESET_ALL)
+                for example in self._failure_examples.get(reason, []):
+                    base += f'{"":14}e.g. {example}\n'
+        if len(base) > 0:
+            scope = ' of the whole run' if self._steady is not None else ''
+            print(Fore.RED + f"failed reasons{scope}:\n" + base + Style.RESET_ALL)
+        if len(self._phase_rows) > 0:
+            print(self.phase_table())
+        if len(self._stage_rows) > 1:
+            print(self.stage_table())
+        if len(self._operation_rows) > 0:
+            print(self.operation_table())
+        if len(self._timing_rows) > 0:
+            print(self.timing_table())
+        if len(self._worker_rows) > 0:
+            print(self.worker_table())
+        if len(self._overloaded) > 0:
+            print(Fore.RED + f"the load generator was the bottleneck on worker "
+                             f"{', '.join(map(str, self._overloaded))}, latencies include its own delay, "
+                             f"add workers or nodes" + Style.RESET_ALL)
         print('=' * 40)
 
+    def worker_table(self) -> str:
+        header = f"{'worker':>6}{'cpu avg%':>10}{'cpu max%':>10}{'lag avg':>9}{'lag max':>9}{'rss max':>9}" \
+                 f"{'inflight':>10}{'max':>6}"
+        lines = ['per worker (loop lag in ms, peak rss in MB):', header]
+        for worker, cpu_mean, cpu_max, lag_mean, lag_max, rss, inflight, inflight_max in self._worker_rows:
+            lines.append(f'{worker:>6}{cpu_mean:>10.1f}{cpu_max:>10.1f}{lag_mean:>9.1f}{lag_max:>9.1f}'
+                         f'{rss:>9.1f}{inflight:>10}{inflight_max:>6}')
+        return '\n'.join(lines)
+
+    def to_dict(self) -> dict:
+        """
+        the summary values for the exported results
+        """
+        return {'run_time': self._run_time, 'steady_time': self._steady_time, 'users': self._users,
+                'success_count': self._success_count,
+                'fail_count': self._fail_count, 'rps': self._rps, 'accuracy': self._accuracy,
+                'avg_rep_time': self._avg_rep_time, 'min_rep_time': self._min_rep_time,
+                'max_rep_time': self._max_rep_time, 'rep_time_90': self._rep_time_90,
+                'rep_time_50': self._rep_time_50, 'schedule_lag': list(self._schedule_lag), 'dropped': self._dropped,
+                'failed_reasons': {k: v for k, v in self._failed_reasons.items() if v > 0},
+                'phases': {row[0]: dict(zip(('run_time', 'success_count', 'fail_count', 'rps', 'avg_rep_time',
+                                             'rep_time_50', 'rep_time_90', 'rep_time_99', 'max_rep_time'), row[1:]))
+                           for row in self._phase_rows}}
+
+    def operation_table(self) -> str:
+        width = max(max(len(row[0]) for row in self._operation_rows), 9) + 2
+        header = f"{'operation':<{width}}{'success':>10}{'fail':>8}{'rps':>10}" + _LATENCY_HEADER
+        scope = ' of the whole run' if self._steady is not None else ''
+        lines = [f'per operation{scope} (response time in ms):', header]
+        for name, success, fail, rps, *latency in self._operation_rows:
+            lines.append(f'{name:<{width}}{success:>10}{fail:>8}{rps:>10.1f}' + _format_latency(latency))
+        return '\n'.join(lines)
+
+    def timing_table(self) -> str:
+        width = max(max(len(row[0]) for row in self._timing_rows), 6) + 2
+        header = f"{'timing':<{width}}{'count':>10}" + _LATENCY_HEADER
+        lines = ['per timing phase (time in ms):', header]
+        for name, count, *latency in self._timing_rows:
+            lines.append(f'{name:<{width}}{count:>10}' + _format_latency(latency))
+        return '\n'.join(lines)
+
+    def phase_table(self) -> str:
+        header = f"{'phase':<10}{'time':>8}{'success':>10}{'fail':>8}{'rps':>10}" + _LATENCY_HEADER
+        lines = ['per phase (response time in ms):', header]
+        for name, run_time, success, fail, rps, *latency in self._phase_rows:
+            lines.append(f'{name:<10}{run_time:>8.1f}{success:>10}{fail:>8}{rps:>10.1f}' + _format_latency(latency))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def __phase_row(name: str, h: LatencyHistogram, fail_count: int, run_time: float) -> tuple:
+        return (name, run_time, h.count, fail_count, h.count / max(run_time, 0.001)) + _latency_columns(h)
+
+    def stage_table(self) -> str:
+        header = f"{'stage':>6}{'users':>8}{'time':>8}{'success':>10}{'fail':>8}{'rps':>10}" + _LATENCY_HEADER
+        lines = ['per stage (response time in ms):', header]
+        for stage, users, run_time, success, fail, rps, *latency in self._stage_rows:
+            lines.append(f'{stage:>6}{users:>8}{run_time:>8.1f}{success:>10}{fail:>8}{rps:>10.1f}'
+                         + _format_latency(latency))
+        return '\n'.join(lines)
+
     @staticmethod
-    def __get_percent_index(array_len, percent: float):
-        # percent(0.0 - 1.0)
-        index = math.floor(array_len * percent) - 1
-        if index < 0:
-            index = 0
-        return index
+    def comparison_table(rows: List[CompareRow]) -> str:
+        width = max([len(row.name) for row in rows] + [9]) + 2
+        header = f"{'operation':<{width}}{'metric':>8}{'baseline':>12}{'current':>12}{'change%':>9}{'p value':>10}"
+        lines = ['compared with the baseline:', header]
+        for row in rows:
+            line = f'{row.name:<{width}}{row.metric:>8}{row.baseline:>12.3f}{row.current:>12.3f}' \
+                   f'{row.change:>+9.1f}{row.p_value:>10.4f}'
+            lines.append(Fore.RED + line + '  REGRESSION' + Style.RESET_ALL if row.regressed else line)
+        return '\n'.join(lines)
 
     @staticmethod
-    def generate_benchmark_result(fr: FinalResult):
+    def generate_benchmark_result(fr: FinalResult, time_series: Optional[TimeSeries] = None,
+                                  phases: Optional[PhaseSplitter] = None):
+        """
+        :param phases: when the run has a warmup or a cooldown, the headline numbers are those of the steady state
+        """
         r = BenchmarkResult()
         r._users = fr.users
         r._run_time = fr.run_time
         results = fr.success_results
-        r._success_count = len(results)
+        r._fail_count = fr.fail_count
+        run_time = fr.run_time
+        if phases is not None:
+            r._phase_rows.append(BenchmarkResult.__phase_row('whole', results, fr.fail_count, fr.run_time))
+            for phase in phases.phases:
+                r._phase_rows.append(BenchmarkResult.__phase_row(phase.name, phase.histogram, phase.fail_count,
+                                                                 phase.run_time))
+            steady = phases.steady
+            if steady.histogram.count > 0:
+                results = steady.histogram
+                r._fail_count = steady.fail_count
+                run_time = steady.run_time
+                r._steady_time = run_time
+                r._steady = f"{run_time:.1f} s, {datetime.fromtimestamp(steady.start_time).strftime('%H:%M:%S')}" \
+                            f" - {datetime.fromtimestamp(steady.end_time).strftime('%H:%M:%S')}, " \
+                            f"warmup and cooldown excluded"
+        r._success_count = results.count
         r._failed_reasons = fr.failed_reasons
-        r._fail_count = sum([c for c in fr.failed_reasons.values()])
-        r._rps = r._success_count / r._run_time
-        if len(results) > 0:
-            results.sort()
-            r._avg_rep_time = int((sum(t for t in results) / len(results)) * 1000)
-            r._min_rep_time = int((results[0]) * 1000)
-            r._max_rep_time = int((results[-1]) * 1000)
-            if len(results) > 9:
-                r._rep_time_90 = int((results[BenchmarkResult.__get_percent_index(r._success_count, 0.9)]) * 1000)
-                r._rep_time_50 = int((results[BenchmarkResult.__get_percent_index(r._success_count, 0.50)]) * 1000)
+        r._failure_examples = fr.failure_examples
+        r._rps = r._success_count / max(run_time, 0.001)
+        if results.count > 0:
+            r._avg_rep_time = results.mean_us / 1000
+            r._min_rep_time = results.min_us / 1000
+            r._max_rep_time = results.max_us / 1000
+            if results.count > 9:
+                p50, p90 = results.percentiles_us([0.50, 0.9])
+                r._rep_time_90 = p90 / 1000
+                r._rep_time_50 = p50 / 1000
             r._accuracy = (r._success_count / (r._fail_count + r._success_count)) * 100
+        lag = fr.schedule_lag
+        if lag.count > 0 or fr.dropped > 0:
+            r._open_loop = True
+            r._schedule_lag = (lag.mean_us / 1000, lag.percentile_us(0.99) / 1000, lag.max_us / 1000)
+            r._dropped = fr.dropped
+        r._teardown_time = fr.teardown_time
+        r._teardown_timeouts = fr.teardown_timeouts
+        if time_series is not None and len(time_series) > 0:
+            i = time_series.peak('p99')
+            r._peak_p99 = f"{time_series.p99[i]:.3f} ms at " \
+                f"{datetime.fromtimestamp(time_series.time[i]).strftime('%H:%M:%S')}, " \
+                f"rps {time_series.rps[i]:.1f}, error rate {time_series.error_rate[i]:.2f}%"
+        for name in sorted(set(fr.operations.keys()) | set(fr.operation_fails.keys())):
+            h = fr.operations.get(name)
+            if h is None:
+                r._operation_rows.append((name, 0, fr.operation_fails[name], 0.0, 0.0, 0.0, 0.0, 0.0, 0.0))
+                continue
+            r._operation_rows.append((name, h.count, fr.operation_fails.get(name, 0),
+                                      h.count / max(r._run_time, 0.001)) + _latency_columns(h))
+        for name, h in sorted(fr.timings.items()):
+            r._timing_rows.append((name, h.count) + _latency_columns(h))
+        for worker, ws in sorted(fr.worker_stats.items()):
+            r._worker_rows.append((worker, ws.cpu_mean, ws.cpu_max, ws.loop_lag_mean * 1000, ws.loop_lag_max * 1000,
+                                   ws.rss_max / 1024 / 1024, ws.inflight, ws.inflight_max))
+            # judged by the averages, a single busy interval such as the hatching is not a bottleneck
+            if is_overloaded(ws.cpu_mean, ws.loop_lag_mean):
+                r._overloaded.append(worker)
+        for stage, ss in sorted(fr.stage_results.items()):
+            h = ss.histogram()
+            run_time = max(ss.last_time - ss.first_time, 0.001)
+            r._stage_rows.append((stage, ss.users, run_time, h.count, ss.fail_count, h.count / run_time)
+                                 + _latency_columns(h))
         return r
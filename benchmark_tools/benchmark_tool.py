@@ -3,12 +3,17 @@ import logging
 import time
 import random
 import cmath
-from copy import deepcopy
-from typing import List, Callable, Union, Tuple
+import queue
+from collections import deque
+from multiprocessing import Queue
+from typing import Dict, List, Callable, Optional, Tuple, Deque, Set
 from .client_protocol import ClientProtocol
 from .benchmark_conf import BenchmarkConfig
 from .benchmark_context import BenchmarkContext
-from .helper import load_benchmark_class_from_file
+from .helper import load_benchmark_class_from_file, check_client_class
+from .data_feeder import DataFeeder
+from .replay import read_records
+from .monitor import LOOP_LAG_SAMPLE_INTERVAL
 from .benchmark_context import RunResult
 
 
@@ -17,16 +22,51 @@ class BenchmarkTool:
                  index: int,
                  conf: BenchmarkConfig,
                  result_callback: Callable[[RunResult], None],
-                 callback_interval: int = 1):
+                 callback_interval: int = 1,
+                 command_queue: Optional[Queue] = None,
+                 client_class: Optional[type] = None):
+        """
+        :param client_class: the client class preloaded before the fork, loaded from the config when None
+        """
         assert callback_interval >= 1
-        my_class = load_benchmark_class_from_file(conf.benchmark_class_file)
+        # timestamps of the startup phases, sent with the first report after the first request
+        self._startup: Optional[Dict[str, float]] = {'worker start': time.time()}
+        my_class = client_class if client_class is not None \
+            else load_benchmark_class_from_file(conf.benchmark_class_file)
+        self._startup['class load'] = time.time()
         if my_class is None:
             raise ValueError(f'can not load benchmark client from:{conf.benchmark_class_file}')
+        check_client_class(my_class, conf.replay is not None)
         self._ClientClass = my_class
         self._config = conf
-        self._clients: List[Union[ClientProtocol, None]] = [None] * self._config.users
+        # live clients, the latest hatched is the first to be stopped when ramping down
+        self._clients: List[ClientProtocol] = []
+        self._user_tasks: List[asyncio.Task] = []
+        # users ramped down, they stop after the running request
+        self._stopping: Set[ClientProtocol] = set()
+        self._retiring: Set[asyncio.Task] = set()
+        self._target_users = conf.users
+        self._hatch_rate = conf.hatch_rate
+        self._arrival_rate = conf.arrival_rate
+        if conf.stages is not None:
+            self._target_users = conf.stages[0].users
+            self._hatch_rate = conf.stages[0].hatch_rate
+            self._arrival_rate = conf.stages[0].arrival_rate
+        self._target_changed = asyncio.Event()
         self._is_time_done = False
-        self._benchmark_context = BenchmarkContext(index)
+        self._stop_requested = False
+        self._command_queue = command_queue
+        self._index = index
+        self._benchmark_context = BenchmarkContext(index, conf.failures)
+        self._benchmark_context.set_wait_time(conf.wait_time)
+        if conf.data_feeder is not None:
+            self._benchmark_context.data_feeder = DataFeeder(conf.data_feeder, index)
+        # open loop mode: clients waiting for the next scheduled send and the running sends
+        self._idle_clients: Deque[ClientProtocol] = deque()
+        self._inflight: Set[asyncio.Task] = set()
+        self._open_loop = conf.arrival_rate is not None or conf.replay is not None
+        # requests running in the closed loop mode
+        self._running = 0
 
         self._on_result = result_callback
         self._call_interval = callback_interval
@@ -37,41 +77,209 @@ class BenchmarkTool:
 
     def run(self) -> None:
         self._ClientClass.global_init(self._config.custom_config)  # type: ignore[arg-type]
+        self._startup['global init'] = time.time()
         loop = asyncio.get_event_loop()
         try:
-            loop.run_until_complete(asyncio.gather(self.__time_loop(), self.__executes()))
+            loop.run_until_complete(self.__main())
         except KeyboardInterrupt:
             pass
+        finally:
+            if self._benchmark_context.data_feeder is not None:
+                self._benchmark_context.data_feeder.close()
+
+    async def __main(self) -> None:
+        if self._config.replay is not None:
+            runner = asyncio.ensure_future(self.__replay_loop())
+        elif self._config.arrival_rate is not None:
+            runner = asyncio.ensure_future(self.__arrival_loop())
+        else:
+            runner = asyncio.ensure_future(self.__executes())
+        control = asyncio.ensure_future(self.__control_loop()) if self._command_queue is not None else None
+        monitor = asyncio.ensure_future(self.__monitor_loop())
+        await self.__time_loop()
+        monitor.cancel()
+        if control is not None:
+            control.cancel()
+        end_time = time.time()
+        teardown_time, timeouts = await self.__teardown(runner)
+        self._benchmark_context.users = len(self._clients)
+        result = self._benchmark_context.current_result
+        # the run time of the statistics does not include the teardown
+        result.last_time = end_time
+        result.teardown_time = teardown_time
+        result.teardown_timeouts = timeouts
+        result.finish = True
+        result.startup = self._startup
+        self._on_result(result)
+
+    async def __teardown(self, runner: asyncio.Future) -> Tuple[float, int]:
+        """
+        wait for the running requests and shutdown every client once, concurrently.
+        the whole phase is bounded by the shutdown_timeout of the config
+
+        :return: teardown time in seconds, count of clients which did not finish in time
+        """
+        st = time.monotonic()
+        deadline = st + self._config.shutdown_timeout
+        _, pending = await asyncio.wait([runner], timeout=self._config.shutdown_timeout)
+        if pending:
+            runner.cancel()
+            await asyncio.wait([runner])
+        timeouts = 0
+        tasks = [asyncio.ensure_future(client.shutdown()) for client in self._clients]
+        if len(tasks) > 0:
+            done, pending = await asyncio.wait(tasks, timeout=max(deadline - time.monotonic(), 0.0))
+            for task in pending:
+                task.cancel()
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    logging.warning(f'exception in shutdown client: {task.exception()!r}')
+            timeouts = len(pending)
+            if timeouts > 0:
+                logging.warning(f'timeout in shutdown {timeouts} clients, maybe you can fix it')
+        return time.monotonic() - st, timeouts
+
+    def set_target_users(self, users: int, hatch_rate: Optional[int] = None) -> None:
+        """
+        ramp the live users up or down to the target, with hatch_rate users per second
+        """
+        self._target_users = users
+        if hatch_rate is not None:
+            self._hatch_rate = hatch_rate
+        self._target_changed.set()
+
+    def set_arrival_rate(self, arrival_rate: float) -> None:
+        """
+        change the target requests per second of the open loop mode
+        """
+        self._arrival_rate = arrival_rate
 
     async def __time_loop(self) -> None:
         count = 0
-        users_count = 0
+        stages = self._config.stages
+        stage_index = 0
+        next_stage_time = stages[0].duration if stages is not None else -1
+        start = time.monotonic()
         for i in range(self._config.run_time):
-            # 每秒自增长客户端
-            users_count = sum(1 for client in self._clients if client is not None)
-            if users_count < self._config.users:
-                loop_count = min(self._config.users - users_count, self._config.hatch_rate)
-                for j in range(users_count, users_count + loop_count):
-                    self._clients[j] = self._ClientClass()
-                    self._clients[j].set_context(self._benchmark_context)
-                    self._clients[j].init_before_use(self._config.host)
-            await asyncio.sleep(1.0)
+            if self._stop_requested:
+                break
+            if i == next_stage_time and stage_index + 1 < len(stages):
+                stage_index += 1
+                stage = stages[stage_index]
+                next_stage_time += stage.duration
+                self._benchmark_context.stage = stage_index
+                self.set_target_users(stage.users, stage.hatch_rate)
+                if stage.arrival_rate is not None:
+                    self.set_arrival_rate(stage.arrival_rate)
+            # sleep to the next second of the run, so the report intervals do not drift
+            await asyncio.sleep(max(start + i + 1 - time.monotonic(), 0.0))
             # 统计结果
             count += 1
             if count >= self._call_interval:
-                self._benchmark_context.users = sum(1 for client in self._clients if client is not None)
-                result = deepcopy(self._benchmark_context.current_result)
+                count = 0
+                self._benchmark_context.users = len(self._clients)
+                self._benchmark_context.inflight = len(self._inflight) if self._open_loop else self._running
+                result = self._benchmark_context.current_result
+                if self._startup is not None and 'first request' in self._startup:
+                    result.startup = self._startup
+                    self._startup = None
                 self._on_result(result)
                 self._benchmark_context.reset()
 
         self._is_time_done = True
-        self._benchmark_context.users = users_count
-        result = deepcopy(self._benchmark_context.current_result)
-        result.finish = True
-        self._on_result(result)
+        self._target_changed.set()
+
+    async def __control_loop(self) -> None:
+        """
+        apply the commands of the controller, such as the load steps of the saturation search
+        """
+        while True:
+            try:
+                command = self._command_queue.get_nowait()
+            except queue.Empty:
+                await asyncio.sleep(0.1)
+                continue
+            if command[0] == 'users':
+                self.set_target_users(command[1], command[2])
+            elif command[0] == 'arrival_rate':
+                self.set_arrival_rate(command[1])
+            elif command[0] == 'stage':
+                self._benchmark_context.stage = command[1]
+            elif command[0] == 'stop':
+                self._stop_requested = True
+            else:
+                logging.warning(f'unknown command from controller: {command}')
+
+    async def __monitor_loop(self) -> None:
+        """
+        measure how late the event loop wakes up, a busy loop delays every request and its timing
+        """
+        while True:
+            st = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_SAMPLE_INTERVAL)
+            self._benchmark_context.report_loop_lag(max(time.monotonic() - st - LOOP_LAG_SAMPLE_INTERVAL, 0.0))
+
+    async def __spawner(self) -> None:
+        """
+        move the live users to the target, the hatches of a second are spread evenly over it
+        """
+        while not self._is_time_done:
+            if len(self._clients) == self._target_users:
+                self._target_changed.clear()
+                await self._target_changed.wait()
+                continue
+            self._target_changed.clear()
+            interval = 1.0 / self._hatch_rate
+            start = time.monotonic()
+            done = 0
+            while not self._is_time_done and not self._target_changed.is_set() \
+                    and len(self._clients) != self._target_users:
+                due = int((time.monotonic() - start) / interval) + 1 - done
+                for _ in range(min(due, abs(self._target_users - len(self._clients)))):
+                    if len(self._clients) < self._target_users:
+                        self.__hatch_user()
+                    else:
+                        self.__stop_user()
+                done += due
+                try:
+                    # wake up at once when the target changes or the time is done
+                    await asyncio.wait_for(self._target_changed.wait(),
+                                           timeout=max(start + done * interval - time.monotonic(), 0.0))
+                except asyncio.TimeoutError:
+                    pass
+
+    def __hatch_user(self) -> None:
+        client = self._ClientClass()
+        client.set_context(self._benchmark_context, len(self._clients))
+        client.init_before_use(self._config.host)
+        self._clients.append(client)
+        if self._open_loop:
+            self._idle_clients.append(client)
+        else:
+            self._user_tasks.append(asyncio.ensure_future(self.__execute(client)))
 
-    async def __wait_for_next_call(self):
-        if self._need_wait:
+    def __stop_user(self) -> None:
+        if self._open_loop:
+            # the pool of the open loop mode only shrinks by idle clients
+            if len(self._idle_clients) > 0:
+                client = self._idle_clients.pop()
+                self._clients.remove(client)
+                self.__retire(asyncio.ensure_future(client.shutdown()))
+            return
+        client = self._clients.pop()
+        self._stopping.add(client)
+        self.__retire(self._user_tasks.pop())
+
+    def __retire(self, task: asyncio.Task) -> None:
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def __wait_for_next_call(self, client: ClientProtocol):
+        wait_time = client.next_wait_time
+        if wait_time is not None:
+            client.next_wait_time = None
+            await asyncio.sleep(wait_time)
+        elif self._need_wait:
             await asyncio.sleep(self.__get_wait_time(self._config.wait_time))
 
     @staticmethod
@@ -81,28 +289,137 @@ class BenchmarkTool:
             else random.uniform(min_wait, max_wait)
 
     async def __executes(self):
-        tasks = [self.__execute(i) for i in range(len(self._clients))]
-        await asyncio.gather(*tasks)
+        await self.__spawner()
+        tasks = self._user_tasks + list(self._retiring)
+        try:
+            if len(tasks) > 0:
+                await asyncio.wait(tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
 
-    async def __execute(self, client_index):
-        while not self._is_time_done:
-            if self._clients[client_index] is not None:
-                try:
-                    st = time.time()
-                    ret = await self._clients[client_index].execute()
-                except Exception as e:
-                    self._clients[client_index].report_fail(f'exception: type {type(e)}, msg:{str(e)}')
-                else:
-                    if ret:
-                        pass
-                    else:
-                        self._clients[client_index].report_success(time.time() - st)
-                await self.__wait_for_next_call()
+    async def __execute(self, client: ClientProtocol):
+        if self._startup is not None and 'first request' not in self._startup:
+            self._startup['first request'] = time.time()
+        while not self._is_time_done and client not in self._stopping:
+            self._running += 1
+            try:
+                st = time.monotonic_ns()
+                client.start_timing(st)
+                ret = await client.execute()
+            except Exception as e:
+                client.report_exception(e, client.operation_name)
             else:
-                await asyncio.sleep(0.1)
-        for client in self._clients:
-            if client is not None:
-                try:
-                    await asyncio.wait_for(client.shutdown(), timeout=5.0)
-                except asyncio.TimeoutError:
-                    logging.warning(f'timeout in shutdown client, maybe you can fix it')
+                if ret:
+                    pass
+                else:
+                    self._benchmark_context.report_success_ns(time.monotonic_ns() - st, client.operation_name)
+            finally:
+                self._running -= 1
+            await self.__wait_for_next_call(client)
+        if client in self._stopping:
+            self._stopping.discard(client)
+            try:
+                await asyncio.wait_for(client.shutdown(), timeout=self._config.shutdown_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f'timeout in shutdown client, maybe you can fix it')
+
+    async def __arrival_loop(self):
+        """
+        open loop mode: sends are scheduled on a fixed timeline, independent of the response time.
+        the latency is measured from the intended send time, so stalls of the server are not hidden,
+        a send is dropped when no client is free at its time.
+        """
+        spawner = asyncio.ensure_future(self.__spawner())
+        # the timeline starts with the full pool, the sends of the hatching are not dropped
+        await self.__wait_for_pool()
+        rate = self._arrival_rate
+        # the timeline is in ns of the monotonic clock
+        interval = 1e9 / rate
+        start = time.monotonic_ns()
+        scheduled = 0
+        while not self._is_time_done:
+            now = time.monotonic_ns()
+            if rate != self._arrival_rate:
+                # a new timeline from the next send
+                rate = self._arrival_rate
+                start = start + scheduled * interval
+                interval = 1e9 / rate
+                scheduled = 0
+            due = int((now - start) / interval) + 1
+            for k in range(scheduled, due):
+                intended = int(start + k * interval)
+                if len(self._idle_clients) == 0:
+                    self._benchmark_context.report_dropped()
+                    continue
+                self._benchmark_context.report_schedule_lag((now - intended) / 1e9)
+                if self._startup is not None and 'first request' not in self._startup:
+                    self._startup['first request'] = time.time()
+                task = asyncio.ensure_future(self.__execute_once(self._idle_clients.popleft(), intended))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+            scheduled = due
+            await asyncio.sleep(max((start + scheduled * interval - time.monotonic_ns()) / 1e9, 0.0))
+        await self.__wait_open_loop(spawner)
+
+    async def __replay_loop(self):
+        """
+        replay mode: the records of the log are sent at their offset in the log divided by the speed,
+        the latency is measured from the intended send time like the open loop mode
+        """
+        spawner = asyncio.ensure_future(self.__spawner())
+        speed = self._config.replay.speed
+        # the timeline starts with the full pool, the first records of the log are not dropped
+        await self.__wait_for_pool()
+        start = time.monotonic_ns()
+        for offset, record in read_records(self._config.replay, self._index, self._config.worker):
+            intended = start + int(offset / speed * 1e9)
+            # sleep in short steps, a long gap of the log must not delay the end of the run
+            while not self._is_time_done and intended > time.monotonic_ns():
+                await asyncio.sleep(min((intended - time.monotonic_ns()) / 1e9, 0.5))
+            if self._is_time_done:
+                break
+            if len(self._idle_clients) == 0:
+                self._benchmark_context.report_dropped()
+                continue
+            self._benchmark_context.report_schedule_lag(max((time.monotonic_ns() - intended) / 1e9, 0.0))
+            if self._startup is not None and 'first request' not in self._startup:
+                self._startup['first request'] = time.time()
+            task = asyncio.ensure_future(self.__execute_once(self._idle_clients.popleft(), intended, record))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+        else:
+            # the log is done, end the run after the running requests
+            self._stop_requested = True
+        await self.__wait_open_loop(spawner)
+
+    async def __wait_for_pool(self) -> None:
+        while not self._is_time_done and len(self._clients) < self._target_users:
+            await asyncio.sleep(0.01)
+
+    async def __wait_open_loop(self, spawner: asyncio.Future):
+        await spawner
+        tasks = list(self._inflight) + list(self._retiring)
+        try:
+            if len(tasks) > 0:
+                await asyncio.wait(tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def __execute_once(self, client: ClientProtocol, intended: int, record: Optional[dict] = None):
+        """
+        :param intended: the time.monotonic_ns() the send was scheduled at
+        """
+        try:
+            client.start_timing()
+            ret = await (client.replay(record) if record is not None else client.execute())
+        except Exception as e:
+            client.report_exception(e, client.operation_name)
+        else:
+            if not ret:
+                self._benchmark_context.report_success_ns(time.monotonic_ns() - intended, client.operation_name)
+        finally:
+            self._idle_clients.append(client)
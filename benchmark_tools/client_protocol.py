@@ -1,14 +1,44 @@
+import time
 from abc import ABCMeta, abstractmethod
 from typing import Optional, Mapping, Any, Union
 from .benchmark_context import BenchmarkContext
 
 
+class PhaseTimer:
+    """
+    context manager which records the time of a phase of the request, only when it succeeds
+    """
+    __slots__ = ('_context', '_phase', '_start')
+
+    def __init__(self, context: BenchmarkContext, phase: str):
+        self._context = context
+        self._phase = phase
+        self._start = 0
+
+    def __enter__(self) -> 'PhaseTimer':
+        self._start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_type is None:
+            self._context.report_timing(self._phase, time.monotonic_ns() - self._start)
+        return False
+
+
 class ClientProtocol(metaclass=ABCMeta):
+    # the operation name of the latency measured around execute, None means not named
+    operation_name: Optional[str] = None
+    # seconds to wait after the current execute instead of the wait_time of the config, reset after use
+    next_wait_time: Optional[float] = None
+
     def __init__(self):
         self._context: Union[None, BenchmarkContext] = None
+        self._user_index = 0
+        self._mark_ns = 0
 
-    def set_context(self, context: BenchmarkContext):
+    def set_context(self, context: BenchmarkContext, user_index: int = 0):
         self._context = context
+        self._user_index = user_index
 
     @staticmethod
     def global_init(custom_conf: Optional[dict] = None) -> None:
@@ -49,12 +79,71 @@ class ClientProtocol(metaclass=ABCMeta):
         """
         raise NotImplementedError()
 
+    async def replay(self, record: dict) -> Optional[bool]:
+        """
+        send the request of a record of the replay log, called instead of execute in replay mode
+
+        :param record: the row of the csv or the object of the jsonl line
+        """
+        raise NotImplementedError()
+
     async def shutdown(self) -> None:
         pass
 
-    def report_success(self, time_second: float):
-        self._context.report_success(time_second)
+    def next_data(self) -> memoryview:
+        """
+        the next record of the data_feeder in the config, a zero copy view of the shared
+        data file, convert it with bytes() only when a copy is needed
+        """
+        return self._context.data_feeder.next(self._user_index)
+
+    def report_success(self, time_second: float, name: Optional[str] = None):
+        """
+        :param time_second: latency of the request
+        :param name: operation name, every name gets its own statistics
+        """
+        self._context.report_success(time_second, name)
+
+    def timing(self, phase: str) -> PhaseTimer:
+        """
+        time a phase of the request, every phase gets its own histogram::
 
-    def report_fail(self, fail_reason: str = ''):
-        self._context.report_fail(fail_reason)
+            with self.timing('connect'):
+                await self.connect()
+        """
+        return PhaseTimer(self._context, phase)
+
+    def start_timing(self, start_ns: Optional[int] = None) -> None:
+        """
+        the start of the request for mark, called right before execute
+
+        :param start_ns: time.monotonic_ns() of the start, now when None
+        """
+        self._mark_ns = start_ns if start_ns is not None else time.monotonic_ns()
+
+    def mark(self, phase: str) -> None:
+        """
+        record the time since the previous mark of the request, or since its start, as the phase::
+
+            await self.send(request)
+            self.mark('send')
+            await reader.readexactly(1)
+            self.mark('ttfb')
+        """
+        now = time.monotonic_ns()
+        self._context.report_timing(phase, now - self._mark_ns)
+        self._mark_ns = now
+
+    def report_fail(self, fail_reason: str = '', name: Optional[str] = None):
+        """
+        :param fail_reason: the failures are counted by the template of the reason, ids and numbers in it
+                            do not make new categories
+        """
+        self._context.report_fail(fail_reason, name)
+
+    def report_exception(self, e: BaseException, name: Optional[str] = None):
+        """
+        count a failure by the exception type and message template, or the http status when it has one
+        """
+        self._context.report_exception(e, name)
 
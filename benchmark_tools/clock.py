@@ -0,0 +1,5 @@
+import time
+
+
+# imported first by the package, the start of the import of the package
+IMPORT_START = time.time()
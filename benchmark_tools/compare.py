@@ -0,0 +1,232 @@
+import os
+import json
+import math
+from typing import Dict, List, Optional, Tuple
+from .histogram import LatencyHistogram, value_to_index
+from .benchmark_context import FinalResult
+from .timeseries import TimeSeries
+from .export import TOTAL, decode_histogram
+
+
+class BaselineConfig:
+    def __init__(self, conf):
+        if isinstance(conf, str):
+            conf = {'run': conf}
+        if not isinstance(conf, dict) or not isinstance(conf.get('run'), str):
+            raise ValueError('config err: "baseline" need the "run" directory of an exported run')
+        self.run: str = conf['run']
+        if not os.path.exists(self.run):
+            raise ValueError(f'config err: baseline run "{self.run}" not found')
+        # significance level of the tests, and the smallest relative change which counts
+        self.alpha = conf.get('alpha', 0.01)
+        self.tolerance = conf.get('tolerance', 0.05)
+        if type(self.alpha) not in (int, float) or not 0 < self.alpha < 1:
+            raise ValueError('config err: "alpha" of baseline need between 0 and 1')
+        if type(self.tolerance) not in (int, float) or self.tolerance < 0:
+            raise ValueError('config err: "tolerance" of baseline need >= 0')
+
+    def __str__(self):
+        return f'run:{self.run}, alpha:{self.alpha}, tolerance:{self.tolerance}'
+
+
+class RunData:
+    """
+    the histograms, fail counts and interval rps of a run, all a comparison needs
+    """
+    def __init__(self, histograms: Dict[str, LatencyHistogram], fails: Dict[str, int], interval_rps: List[float]):
+        self.histograms = histograms
+        self.fails = fails
+        self.interval_rps = interval_rps
+
+    @staticmethod
+    def from_result(fr: FinalResult, time_series: Optional[TimeSeries]) -> 'RunData':
+        histograms = {TOTAL: fr.success_results}
+        histograms.update(fr.operations)
+        fails = dict(fr.operation_fails)
+        fails[TOTAL] = fr.fail_count
+        return RunData(histograms, fails, _steady(list(time_series.rps) if time_series is not None else []))
+
+    @staticmethod
+    def load(path: str) -> 'RunData':
+        """
+        :param path: directory of an exported run, or its run.jsonl
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, 'run.jsonl')
+        checkpoint = None
+        rps = []
+        with open(path, 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['type'] == 'interval':
+                    rps.append(record['rps'])
+                elif record['type'] == 'checkpoint':
+                    checkpoint = record
+        if checkpoint is None:
+            raise ValueError(f'no histogram checkpoint in {path}, the run was exported without jsonl or crashed early')
+        return RunData({k: decode_histogram(v) for k, v in checkpoint['histograms'].items()},
+                       checkpoint['fails'], _steady(rps))
+
+
+def _steady(rps: List[float]) -> List[float]:
+    # the first and the last interval hold the ramp up and the teardown
+    return rps[1:-1] if len(rps) > 2 else rps
+
+
+def normal_sf(z: float) -> float:
+    """
+    P(Z > z) of the standard normal distribution
+    """
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _beta_cf(a: float, b: float, x: float) -> float:
+    # continued fraction of the incomplete beta function, modified Lentz method
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 200):
+        for num in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                    -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + num * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + num / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return h
+
+
+def t_sf(t: float, df: float) -> float:
+    """
+    P(T > t) of the student t distribution
+    """
+    if t == 0 or df <= 0:
+        return 0.5
+    # the regularized incomplete beta is only evaluated inside (0, 1)
+    x = min(max(df / (df + t * t), 1e-300), 1.0 - 1e-16)
+    a, b = df / 2, 0.5
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        tail = front * _beta_cf(a, b, x) / a
+    else:
+        tail = 1.0 - front * _beta_cf(b, a, 1 - x) / b
+    return tail / 2 if t > 0 else 1.0 - tail / 2
+
+
+def mann_whitney(baseline: LatencyHistogram, current: LatencyHistogram) -> Tuple[float, float]:
+    """
+    one sided Mann-Whitney U test that the current latencies are larger, on the buckets of the
+    histograms, the values of a bucket are ties. the cost depends on the buckets, not the samples
+
+    :return: probability that a current value is larger than a baseline value, p value
+    """
+    n1, n2 = baseline.count, current.count
+    if n1 == 0 or n2 == 0:
+        return 0.5, 1.0
+    u = 0.0
+    below = 0
+    ties = 0.0
+    for a, b in zip(baseline.raw_counts, current.raw_counts):
+        if a or b:
+            u += b * (below + a / 2)
+            below += a
+            t = a + b
+            ties += t * t * t - t
+    n = n1 + n2
+    mean = n1 * n2 / 2
+    var = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if var <= 0:
+        return u / (n1 * n2), 1.0
+    # continuity correction
+    return u / (n1 * n2), normal_sf((u - mean - 0.5) / math.sqrt(var))
+
+
+def two_proportion(x1: int, n1: int, x2: int, n2: int) -> float:
+    """
+    one sided two proportion z test that x2 / n2 is larger than x1 / n1
+
+    :return: p value
+    """
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    p = (x1 + x2) / (n1 + n2)
+    se = math.sqrt(p * (1 - p) * (1 / n1 + 1 / n2))
+    if se == 0:
+        return 1.0
+    return normal_sf((x2 / n2 - x1 / n1) / se)
+
+
+def welch(baseline: List[float], current: List[float]) -> float:
+    """
+    one sided Welch t test that the current mean is smaller
+
+    :return: p value
+    """
+    n1, n2 = len(baseline), len(current)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    m1, m2 = sum(baseline) / n1, sum(current) / n2
+    v1 = sum((x - m1) ** 2 for x in baseline) / (n1 - 1) / n1
+    v2 = sum((x - m2) ** 2 for x in current) / (n2 - 1) / n2
+    if v1 + v2 == 0:
+        return 0.0 if m2 < m1 else 1.0
+    df = (v1 + v2) ** 2 / (v1 ** 2 / (n1 - 1) + v2 ** 2 / (n2 - 1)) if v1 > 0 and v2 > 0 else n1 + n2 - 2
+    return t_sf((m1 - m2) / math.sqrt(v1 + v2), df)
+
+
+def _tail_count(h: LatencyHistogram, index: int) -> int:
+    return sum(h.raw_counts[index + 1:])
+
+
+class CompareRow:
+    def __init__(self, name: str, metric: str, baseline: float, current: float, p_value: float, regressed: bool):
+        self.name = name
+        self.metric = metric
+        self.baseline = baseline
+        self.current = current
+        self.p_value = p_value
+        self.regressed = regressed
+
+    @property
+    def change(self) -> float:
+        """
+        relative change in percent
+        """
+        if self.baseline == 0:
+            return 0.0 if self.current == 0 else math.inf
+        return (self.current - self.baseline) / self.baseline * 100
+
+
+def compare_runs(baseline: RunData, current: RunData, alpha: float = 0.01, tolerance: float = 0.05) \
+        -> List[CompareRow]:
+    """
+    a metric regresses when the one sided test is significant at alpha and the change is bigger than
+    the tolerance, a huge run makes every tiny change significant, the tolerance keeps it practical
+    """
+    rows = []
+    if len(baseline.interval_rps) > 0 and len(current.interval_rps) > 0:
+        b = sum(baseline.interval_rps) / len(baseline.interval_rps)
+        c = sum(current.interval_rps) / len(current.interval_rps)
+        p = welch(baseline.interval_rps, current.interval_rps)
+        rows.append(CompareRow(TOTAL, 'rps', b, c, p, p < alpha and c < b * (1 - tolerance)))
+    for name in sorted(set(baseline.histograms.keys()) & set(current.histograms.keys())):
+        bh, ch = baseline.histograms[name], current.histograms[name]
+        b50, b99 = bh.percentiles_us([0.5, 0.99])
+        c50, c99 = ch.percentiles_us([0.5, 0.99])
+        _, p = mann_whitney(bh, ch)
+        rows.append(CompareRow(name, 'p50 ms', b50 / 1000, c50 / 1000, p, p < alpha and c50 > b50 * (1 + tolerance)))
+        # share of the requests slower than the p99 of the baseline
+        index = value_to_index(b99)
+        p = two_proportion(_tail_count(bh, index), bh.count, _tail_count(ch, index), ch.count)
+        rows.append(CompareRow(name, 'p99 ms', b99 / 1000, c99 / 1000, p, p < alpha and c99 > b99 * (1 + tolerance)))
+        bf, cf = baseline.fails.get(name, 0), current.fails.get(name, 0)
+        bn, cn = bh.count + bf, ch.count + cf
+        b_rate = bf / bn * 100 if bn > 0 else 0.0
+        c_rate = cf / cn * 100 if cn > 0 else 0.0
+        p = two_proportion(bf, bn, cf, cn)
+        rows.append(CompareRow(name, 'error %', b_rate, c_rate, p, p < alpha and c_rate > b_rate * (1 + tolerance)))
+    return rows
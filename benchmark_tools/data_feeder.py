@@ -0,0 +1,163 @@
+import os
+import mmap
+import random
+import struct
+import logging
+from array import array
+from typing import Dict
+
+
+FORMATS = ('lines', 'length_prefixed')
+ORDERS = ('sequential', 'random', 'partition')
+# magic, file size, file mtime in ns, format
+_INDEX_HEADER = struct.Struct('<4Q')
+_INDEX_MAGIC = 0x62746964786631
+_LENGTH_PREFIX = struct.Struct('>I')
+
+
+class DataFeederConfig:
+    def __init__(self, conf: dict):
+        if not isinstance(conf, dict) or not isinstance(conf.get('file'), str):
+            raise ValueError('config err: "data_feeder" need a "file"')
+        self.file: str = conf['file']
+        if not os.path.isfile(self.file):
+            raise ValueError(f'config err: data file "{self.file}" not found')
+        self.format: str = conf.get('format', 'lines')
+        if self.format not in FORMATS:
+            raise ValueError(f'config err: "format" of data_feeder must be one of {FORMATS}')
+        self.order: str = conf.get('order', 'sequential')
+        if self.order not in ORDERS:
+            raise ValueError(f'config err: "order" of data_feeder must be one of {ORDERS}')
+        # set by the config loader, the number of users and workers of the whole run
+        self.partitions = 1
+        self.workers = 1
+
+    def __str__(self):
+        return f'file:{self.file}, format:{self.format}, order:{self.order}'
+
+
+def index_path(file: str) -> str:
+    return file + '.idx'
+
+
+def build_index(file: str, fmt: str) -> str:
+    """
+    build the record index of the data file, it is cached beside the file and only
+    rebuilt when the file changes
+
+    the index is the start offset of every record plus the end of the file, so the
+    record i is data[start[i] + head:start[i + 1] - tail]
+
+    :return: path of the index file
+    """
+    path = index_path(file)
+    st = os.stat(file)
+    header = (_INDEX_MAGIC, st.st_size, st.st_mtime_ns, FORMATS.index(fmt))
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            cached = f.read(_INDEX_HEADER.size)
+        if len(cached) == _INDEX_HEADER.size and _INDEX_HEADER.unpack(cached) == header:
+            return path
+    offsets = array('Q')
+    if st.st_size > 0:
+        with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = 0
+            size = st.st_size
+            if fmt == 'lines':
+                while pos < size:
+                    offsets.append(pos)
+                    end = data.find(b'\n', pos)
+                    pos = end + 1 if end >= 0 else size + 1
+            else:
+                while pos < size:
+                    offsets.append(pos)
+                    if pos + _LENGTH_PREFIX.size > size:
+                        raise ValueError(f'data file err: truncated length prefix at {pos}')
+                    pos += _LENGTH_PREFIX.size + _LENGTH_PREFIX.unpack_from(data, pos)[0]
+                    if pos > size:
+                        raise ValueError(f'data file err: truncated record at {offsets[-1]}')
+            offsets.append(pos)
+    # write to a temp file and rename, workers building the index at once do not see a partial one
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(_INDEX_HEADER.pack(*header))
+        offsets.tofile(f)
+    os.replace(tmp, path)
+    logging.info(f'built index of {len(offsets) - 1} records for {file}')
+    return path
+
+
+class DataFeeder:
+    """
+    Hand out the records of a large data file to the users of a worker.
+
+    The data file and its index are memory mapped read only, so every worker shares the
+    pages of the OS cache instead of holding its own copy, and a record is a memoryview
+    slice of the map which is only copied when the client converts it.
+
+    sequential: the workers take turns over the records
+    random:     every call picks a random record
+    partition:  every user owns a continuous range of the records and walks it in order
+    """
+    def __init__(self, conf: DataFeederConfig, worker_index: int):
+        self._order = conf.order
+        self._head = 0 if conf.format == 'lines' else _LENGTH_PREFIX.size
+        self._tail = 1 if conf.format == 'lines' else 0
+        path = build_index(conf.file, conf.format)
+        with open(path, 'rb') as f:
+            self._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = memoryview(self._index_map)[_INDEX_HEADER.size:].cast('Q')
+        self._count = len(self._offsets) - 1
+        if self._count <= 0:
+            raise ValueError(f'data file err: no record in {conf.file}')
+        with open(conf.file, 'rb') as f:
+            self._data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._data_map)
+        self._workers = conf.workers
+        self._cursor = worker_index % self._count
+        self._partitions = max(conf.partitions, 1)
+        self._worker_index = worker_index
+        self._user_cursors: Dict[int, int] = {}
+        self._random = random.Random()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, index: int) -> memoryview:
+        offsets = self._offsets
+        return self._data[offsets[index] + self._head:offsets[index + 1] - self._tail]
+
+    def next(self, user_index: int = 0) -> memoryview:
+        """
+        :param user_index: index of the user in the worker, only used by the partition order
+        """
+        if self._order == 'sequential':
+            index = self._cursor
+            self._cursor = (index + self._workers) % self._count
+        elif self._order == 'random':
+            index = self._random.randrange(self._count)
+        else:
+            index = self.__next_of_user(user_index)
+        return self.record(index)
+
+    def __next_of_user(self, user_index: int) -> int:
+        cursor = self._user_cursors.get(user_index)
+        # users of all workers are interleaved to the partitions
+        partition = (user_index * self._workers + self._worker_index) % self._partitions
+        start = partition * self._count // self._partitions
+        end = max((partition + 1) * self._count // self._partitions, start + 1)
+        if cursor is None or cursor >= end:
+            cursor = start
+        self._user_cursors[user_index] = cursor + 1
+        return cursor
+
+    def close(self) -> None:
+        try:
+            self._offsets.release()
+            self._data.release()
+            self._index_map.close()
+            self._data_map.close()
+        except BufferError:
+            # a client still holds a record, the maps are closed with the process
+            pass
+
@@ -0,0 +1,178 @@
+import os
+import csv
+import json
+import time
+import base64
+import sqlite3
+from datetime import datetime
+from typing import Dict, Optional, TextIO
+from .histogram import LatencyHistogram
+from .benchmark_context import FinalResult
+from .timeseries import TimeSeries
+
+
+FORMATS = ('jsonl', 'csv')
+# seconds between two checkpoints of the cumulative histograms
+CHECKPOINT_INTERVAL = 60.0
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    start_time REAL,
+    end_time REAL,
+    status TEXT,
+    config TEXT,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS intervals (
+    run_id TEXT, time REAL, stage INTEGER, users INTEGER, success INTEGER, fail INTEGER, dropped INTEGER,
+    rps REAL, error_rate REAL, p50 REAL, p90 REAL, p99 REAL, p999 REAL
+);
+CREATE TABLE IF NOT EXISTS histograms (
+    run_id TEXT, name TEXT, fail INTEGER, data BLOB, PRIMARY KEY (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    run_id TEXT, reason TEXT, count INTEGER, PRIMARY KEY (run_id, reason)
+);
+CREATE INDEX IF NOT EXISTS intervals_run ON intervals (run_id);
+'''
+
+# name of the histogram of all requests, the named operations keep their own names
+TOTAL = '_total'
+
+
+class ExportConfig:
+    def __init__(self, conf: dict):
+        if not isinstance(conf, dict):
+            raise ValueError('config err: "export" must be a dict')
+        self.dir: str = conf.get('dir', './benchmark_runs')
+        self.formats = conf.get('formats', list(FORMATS))
+        if not isinstance(self.formats, list) or any(f not in FORMATS for f in self.formats):
+            raise ValueError(f'config err: "formats" of export must be a list of {FORMATS}')
+        # the append only run history, None to disable
+        self.history: Optional[str] = conf.get('history', os.path.join(self.dir, 'history.sqlite'))
+
+    def __str__(self):
+        return f'dir:{self.dir}, formats:{self.formats}, history:{self.history}'
+
+
+def encode_histogram(h: LatencyHistogram) -> str:
+    return base64.b64encode(h.to_bytes()).decode()
+
+
+def decode_histogram(s: str) -> LatencyHistogram:
+    return LatencyHistogram.from_bytes(base64.b64decode(s))
+
+
+class RunExporter:
+    """
+    Write the results of a run to disk while it is running.
+
+    Every interval is appended and flushed at once, the cumulative histograms are written
+    every CHECKPOINT_INTERVAL, so a crashed run still leaves everything up to its last minute.
+
+    <dir>/<run id>/run.jsonl:      config, interval, checkpoint and summary records
+    <dir>/<run id>/intervals.csv:  the time series
+    history sqlite:                runs, intervals, histograms and failures of all runs
+    """
+    def __init__(self, conf: ExportConfig, config_file: str):
+        self._conf = conf
+        self._start_time = time.time()
+        self._run_id = datetime.fromtimestamp(self._start_time).strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+        self._run_dir = os.path.join(conf.dir, self._run_id)
+        os.makedirs(self._run_dir, exist_ok=True)
+        with open(config_file, 'r') as f:
+            self._config_text = f.read()
+        self._last_checkpoint = self._start_time
+        self._jsonl: Optional[TextIO] = None
+        self._csv: Optional[TextIO] = None
+        self._csv_writer = None
+        self._db: Optional[sqlite3.Connection] = None
+        if 'jsonl' in conf.formats:
+            self._jsonl = open(os.path.join(self._run_dir, 'run.jsonl'), 'w')
+            self.__write_json({'type': 'config', 'run_id': self._run_id, 'start_time': self._start_time,
+                               'config': self._config_text})
+        if 'csv' in conf.formats:
+            self._csv = open(os.path.join(self._run_dir, 'intervals.csv'), 'w', newline='')
+            self._csv_writer = csv.writer(self._csv)
+            self._csv_writer.writerow(TimeSeries.columns)
+            self._csv.flush()
+        if conf.history is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(conf.history)), exist_ok=True)
+            # called from the receiving threads of the controller, always under its lock
+            self._db = sqlite3.connect(conf.history, check_same_thread=False)
+            self._db.executescript(_SCHEMA)
+            self._db.execute('INSERT INTO runs VALUES (?, ?, NULL, ?, ?, NULL)',
+                             (self._run_id, self._start_time, 'running', self._config_text))
+            self._db.commit()
+
+    @property
+    def run_id(self) -> str:
+        return self._run_id
+
+    @property
+    def run_dir(self) -> str:
+        return self._run_dir
+
+    def __write_json(self, obj: dict) -> None:
+        self._jsonl.write(json.dumps(obj) + '\n')
+        self._jsonl.flush()
+
+    def on_interval(self, ts: TimeSeries, row: int) -> None:
+        values = ts.row(row)
+        if self._jsonl is not None:
+            record = dict(zip(TimeSeries.columns, values))
+            record['type'] = 'interval'
+            self.__write_json(record)
+        if self._csv is not None:
+            self._csv_writer.writerow(values)
+            self._csv.flush()
+        if self._db is not None:
+            self._db.execute('INSERT INTO intervals VALUES (?' + ', ?' * len(values) + ')', (self._run_id,) + values)
+            self._db.commit()
+
+    def need_checkpoint(self) -> bool:
+        return time.time() - self._last_checkpoint >= CHECKPOINT_INTERVAL
+
+    def checkpoint(self, fr: FinalResult) -> None:
+        """
+        write the cumulative histograms and failures
+        """
+        self._last_checkpoint = time.time()
+        histograms: Dict[str, LatencyHistogram] = {TOTAL: fr.success_results}
+        histograms.update(fr.operations)
+        fails = dict(fr.operation_fails)
+        fails[TOTAL] = fr.fail_count
+        if self._jsonl is not None:
+            self.__write_json({'type': 'checkpoint', 'time': self._last_checkpoint,
+                               'histograms': {k: encode_histogram(v) for k, v in histograms.items()},
+                               'fails': fails, 'failed_reasons': fr.failed_reasons,
+                               'failure_examples': fr.failure_examples,
+                               'timings': {k: encode_histogram(v) for k, v in fr.timings.items()}})
+        if self._db is not None:
+            self._db.executemany('INSERT OR REPLACE INTO histograms VALUES (?, ?, ?, ?)',
+                                 [(self._run_id, k, fails.get(k, 0), v.to_bytes()) for k, v in histograms.items()])
+            self._db.executemany('INSERT OR REPLACE INTO failures VALUES (?, ?, ?)',
+                                 [(self._run_id, k, v) for k, v in fr.failed_reasons.items() if v > 0])
+            self._db.commit()
+
+    def finish(self, fr: FinalResult, summary: Optional[dict], status: str = 'finished') -> None:
+        """
+        :param status: finished, or interrupted when the run was stopped by the user
+        """
+        self.checkpoint(fr)
+        end_time = time.time()
+        if self._jsonl is not None:
+            self.__write_json({'type': 'summary', 'end_time': end_time, 'status': status, 'summary': summary})
+        if self._db is not None:
+            self._db.execute('UPDATE runs SET end_time = ?, status = ?, summary = ? WHERE run_id = ?',
+                             (end_time, status, json.dumps(summary), self._run_id))
+            self._db.commit()
+        print(f'results exported to {self._run_dir}')
+
+    def close(self) -> None:
+        for f in (self._jsonl, self._csv):
+            if f is not None:
+                f.close()
+        if self._db is not None:
+            self._db.close()
@@ -0,0 +1,162 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+# the category of the failures over the limit of categories
+OTHER = '_other'
+# the category of report_fail without a reason
+DEFAULT = '_default'
+MAX_MESSAGE_LENGTH = 200
+# raw messages cached with their category, cleared when full
+_CACHE_SIZE = 4096
+
+# the variable parts of a message, replaced in order
+_PLACEHOLDERS = (
+    (re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'), '<uuid>'),
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'), '<ip>'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<hex>'),
+    (re.compile(r'\d+\.\d+(?:[eE][-+]?\d+)?'), '<n>'),
+    (re.compile(r'\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{8,}\b'), '<hex>'),
+    (re.compile(r'\d+'), '<n>'),
+    (re.compile(r"'[^']*'"), "'<s>'"),
+    (re.compile(r'"[^"]*"'), '"<s>"'),
+)
+# the category of an exception with a http status, normalized templates never end with digits
+_STATUS_CATEGORY = re.compile(r': HTTP \d+$')
+
+
+class FailureConfig:
+    def __init__(self, conf: dict):
+        if not isinstance(conf, dict):
+            raise ValueError('config err: "failures" must be a dict')
+        self.max_categories = conf.get('max_categories', 50)
+        if not isinstance(self.max_categories, int) or self.max_categories < 1:
+            raise ValueError('config err: "max_categories" of failures need >= 1')
+        # example messages kept for every category
+        self.examples = conf.get('examples', 3)
+        if not isinstance(self.examples, int) or self.examples < 0:
+            raise ValueError('config err: "examples" of failures need >= 0')
+        # category name -> regex, checked before the message is normalized
+        categories = conf.get('categories', {})
+        if not isinstance(categories, dict):
+            raise ValueError('config err: "categories" of failures must be a dict of name: regex')
+        try:
+            self.categories: List[Tuple[str, re.Pattern]] = [(k, re.compile(v)) for k, v in categories.items()]
+        except (re.error, TypeError) as e:
+            raise ValueError(f'config err: bad regex in "categories" of failures: {e}') from e
+
+    def __str__(self):
+        return f'max_categories:{self.max_categories}, examples:{self.examples}, ' \
+               f'categories:{[k for k, _ in self.categories]}'
+
+
+def normalize(message: str) -> str:
+    """
+    the template of a message, ids, addresses and numbers are replaced by placeholders
+    """
+    message = message[:MAX_MESSAGE_LENGTH * 2]
+    for pattern, placeholder in _PLACEHOLDERS:
+        message = pattern.sub(placeholder, message)
+    return message[:MAX_MESSAGE_LENGTH]
+
+
+def is_status_category(category: str) -> bool:
+    return _STATUS_CATEGORY.search(category) is not None
+
+
+def _status_of(e: BaseException) -> Optional[int]:
+    # aiohttp and httpx style exceptions
+    for attr in ('status', 'status_code'):
+        status = getattr(e, attr, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', getattr(response, 'status', None))
+    return status if isinstance(status, int) else None
+
+
+class FailureClassifier:
+    """
+    Map the failure messages of a worker to a bounded set of categories.
+
+    A message gets the first configured category whose regex matches it, otherwise its normalized
+    template. Once max_categories are known every new category is counted as OTHER, so the
+    counters of a worker never hold more than max_categories + 2 keys whatever the messages are.
+    The http status categories have a bound of their own, a storm of templates does not hide them.
+    The first distinct examples of every category are kept raw, each is only sent once.
+    """
+    def __init__(self, conf: FailureConfig):
+        self._conf = conf
+        self._known = set()
+        self._known_status = set()
+        self._cache: Dict[str, str] = {}
+        self._examples: Dict[str, List[str]] = {}
+
+    def __bound(self, category: str, known: Optional[set] = None) -> str:
+        known = self._known if known is None else known
+        if category not in known:
+            if len(known) >= self._conf.max_categories:
+                return OTHER
+            known.add(category)
+        return category
+
+    def __match(self, message: str) -> Optional[str]:
+        for name, pattern in self._conf.categories:
+            if pattern.search(message):
+                return name
+        return None
+
+    def classify(self, message: str) -> str:
+        category = self._cache.get(message)
+        if category is not None:
+            return category
+        category = self.__bound(self.__match(message) or normalize(message))
+        if len(self._cache) >= _CACHE_SIZE:
+            self._cache.clear()
+        self._cache[message] = category
+        return category
+
+    def classify_exception(self, e: BaseException) -> Tuple[str, str]:
+        """
+        :return: category, the raw message
+        """
+        message = f'{type(e).__name__}: {e}'
+        status = _status_of(e)
+        if status is None:
+            return self.classify(message), message
+        matched = self.__match(message)
+        if matched is not None:
+            return self.__bound(matched), message
+        # the status is the category, the message mostly holds the url
+        return self.__bound(f'{type(e).__name__}: HTTP {status}', self._known_status), message
+
+    def need_example(self, category: str, example: str) -> bool:
+        kept = self._examples.setdefault(category, [])
+        if len(kept) >= self._conf.examples or example in kept:
+            return False
+        kept.append(example)
+        return True
+
+
+def merge_failures(counts: Dict[str, int], examples: Dict[str, List[str]], new_counts: Dict[str, int],
+                   new_examples: Optional[Dict[str, List[str]]], conf: FailureConfig) -> None:
+    """
+    merge the failures of a worker into the run totals, with the same bounds as the workers
+    """
+    for category, count in new_counts.items():
+        if category not in counts:
+            status = is_status_category(category)
+            known = sum(1 for k in counts if is_status_category(k) == status)
+            if known >= conf.max_categories + (0 if status else 2):
+                category = OTHER
+        counts[category] = counts.get(category, 0) + count
+    if new_examples:
+        for category, messages in new_examples.items():
+            if category not in counts:
+                category = OTHER
+            kept = examples.setdefault(category, [])
+            for message in messages:
+                if len(kept) >= conf.examples:
+                    break
+                if message not in kept:
+                    kept.append(message)
@@ -1,6 +1,8 @@
 import importlib.util
 import threading
+from typing import Tuple
 from .client_protocol import ClientProtocol
+from .scenario import ScenarioClient
 
 
 class ThreadWrapper(threading.Thread):
@@ -20,7 +22,31 @@ def load_benchmark_class_from_file(file_path: str) -> type:
     spec = importlib.util.spec_from_file_location("benchmark_tools", file_path)
     mo = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(mo)
+    # a class of the file wins over a built-in client imported to use as is
+    builtin = None
     for k, v in mo.__dict__.items():
-        if isinstance(v, type) and issubclass(v, ClientProtocol) and k != 'ClientProtocol':
-            return v
+        # the base classes imported by the file are not the client
+        if isinstance(v, type) and issubclass(v, ClientProtocol) and v not in (ClientProtocol, ScenarioClient):
+            if v.__module__ == mo.__name__:
+                return v
+            if builtin is None:
+                builtin = v
+    if builtin is not None:
+        return builtin
     raise ValueError('load benchmark class failed')
+
+
+def check_client_class(client_class: type, replay: bool) -> None:
+    """
+    fail before the run when the client can not run the mode of the config
+    """
+    if replay and client_class.replay is ClientProtocol.replay:
+        raise ValueError(f'config err: "replay" need {client_class.__name__} to implement '
+                         f'async def replay(self, record)')
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    if len(host) == 0 or not port.isdigit():
+        raise ValueError(f'address err: "{address}" need host:port')
+    return host, int(port)
@@ -0,0 +1,301 @@
+from array import array
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+# values are tracked as integer microseconds, every bucket keeps a relative error below 1 / SUB_BUCKET_HALF
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+# 2^36 us is about 19 hours, bigger values are clamped into the last bucket
+MAX_VALUE_BITS = 36
+MAX_VALUE = (1 << MAX_VALUE_BITS) - 1
+BUCKET_COUNT = SUB_BUCKET_COUNT + (MAX_VALUE_BITS - SUB_BUCKET_BITS) * SUB_BUCKET_HALF
+
+
+def value_to_index(value: int) -> int:
+    if value < SUB_BUCKET_COUNT:
+        return value if value > 0 else 0
+    if value > MAX_VALUE:
+        value = MAX_VALUE
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (value >> shift) - SUB_BUCKET_HALF
+
+
+def write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+def index_to_value(index: int) -> int:
+    """
+    representative (middle) value of a bucket, in microseconds
+    """
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift = (index - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+    low = ((index - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + SUB_BUCKET_HALF) << shift
+    return low + ((1 << shift) >> 1)
+
+
+class LatencyHistogram:
+    """
+    Fixed memory, log bucketed latency histogram (HDR style).
+
+    Memory does not depend on the number of recorded values, and two histograms
+    merge by adding bucket counts, so workers can record into one and the controller
+    can merge them cheaply.
+    """
+    __slots__ = ('_counts', '_count', '_sum', '_min', '_max', '_nonzero')
+
+    def __init__(self):
+        self._counts = array('q', bytes(8 * BUCKET_COUNT))
+        self._count = 0
+        self._sum = 0
+        self._min = 0
+        self._max = 0
+        # indexes of the none zero buckets of an unpickled histogram, make merging it cheap
+        self._nonzero = None
+
+    def __len__(self):
+        return self._count
+
+    def __getstate__(self):
+        # only none zero buckets are pickled, keep the data sent between processes small
+        indexes = array('H')
+        counts = array('q')
+        for i, c in enumerate(self._counts):
+            if c:
+                indexes.append(i)
+                counts.append(c)
+        return self._count, self._sum, self._min, self._max, indexes, counts
+
+    def __setstate__(self, state):
+        self._count, self._sum, self._min, self._max, indexes, counts = state
+        self._counts = array('q', bytes(8 * BUCKET_COUNT))
+        for i, c in zip(indexes, counts):
+            self._counts[i] = c
+        self._nonzero = indexes
+
+    @property
+    def raw_counts(self) -> array:
+        """
+        the bucket counts, used to copy the histogram in and out of shared memory
+        """
+        return self._counts
+
+    def set_summary(self, count: int, total_us: int, min_us: int, max_us: int) -> None:
+        self._nonzero = None
+        self._count = count
+        self._sum = total_us
+        self._min = min_us
+        self._max = max_us
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def total_us(self) -> int:
+        return self._sum
+
+    @property
+    def min_us(self) -> int:
+        return self._min
+
+    @property
+    def max_us(self) -> int:
+        return self._max
+
+    @property
+    def mean_us(self) -> float:
+        return self._sum / self._count if self._count > 0 else 0.0
+
+    def record(self, time_second: float) -> None:
+        self.record_us(round(time_second * 1000000))
+
+    def record_ns(self, time_ns: int) -> None:
+        self.record_us((time_ns + 500) // 1000)
+
+    def record_us(self, value: int, count: int = 1) -> None:
+        if value < 0:
+            value = 0
+        self._nonzero = None
+        self._counts[value_to_index(value)] += count
+        if self._count == 0:
+            self._min = value
+            self._max = value
+        elif value < self._min:
+            self._min = value
+        elif value > self._max:
+            self._max = value
+        self._count += count
+        self._sum += value * count
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        if other is None or other._count == 0:
+            return
+        self._nonzero = None
+        counts = self._counts
+        other_counts = other._counts
+        if other._nonzero is not None:
+            for i in other._nonzero:
+                counts[i] += other_counts[i]
+        else:
+            for i in range(value_to_index(other._min), value_to_index(other._max) + 1):
+                c = other_counts[i]
+                if c:
+                    counts[i] += c
+        if self._count == 0 or other._min < self._min:
+            self._min = other._min
+        if self._count == 0 or other._max > self._max:
+            self._max = other._max
+        self._count += other._count
+        self._sum += other._sum
+
+    def diff(self, earlier: 'LatencyHistogram') -> 'LatencyHistogram':
+        """
+        the values recorded since the earlier copy of this histogram,
+        min and max are taken from the buckets
+        """
+        h = LatencyHistogram()
+        counts = h._counts
+        first = -1
+        last = -1
+        for i, (c, e) in enumerate(zip(self._counts, earlier._counts)):
+            if c != e:
+                counts[i] = c - e
+                if first < 0:
+                    first = i
+                last = i
+        if first >= 0:
+            h._count = self._count - earlier._count
+            h._sum = self._sum - earlier._sum
+            h._min = max(index_to_value(first), self._min)
+            h._max = min(index_to_value(last), self._max)
+        return h
+
+    def reset(self) -> None:
+        self._counts = array('q', bytes(8 * BUCKET_COUNT))
+        self._count = 0
+        self._sum = 0
+        self._min = 0
+        self._max = 0
+        self._nonzero = None
+
+    def copy(self) -> 'LatencyHistogram':
+        h = LatencyHistogram()
+        h._counts = array('q', self._counts)
+        h._count = self._count
+        h._sum = self._sum
+        h._min = self._min
+        h._max = self._max
+        h._nonzero = self._nonzero
+        return h
+
+    def percentiles_us(self, percents: Iterable[float]) -> List[int]:
+        """
+        values at the percents(0.0 - 1.0), the percents must be sorted ascending
+
+        :return: values in microseconds
+        """
+        percents = list(percents)
+        ret = [0] * len(percents)
+        if self._count == 0:
+            return ret
+        pos = 0
+        seen = 0
+        for i, c in enumerate(self._counts):
+            if not c:
+                continue
+            seen += c
+            while pos < len(percents) and seen >= max(percents[pos] * self._count, 1):
+                ret[pos] = min(max(index_to_value(i), self._min), self._max)
+                pos += 1
+            if pos == len(percents):
+                break
+        while pos < len(percents):
+            ret[pos] = self._max
+            pos += 1
+        return ret
+
+    def percentile_us(self, percent: float) -> int:
+        return self.percentiles_us([percent])[0]
+
+    def to_bytes(self) -> bytes:
+        """
+        compact encoding for the exported results, varints of the summary and of the
+        (index delta, count) of the none zero buckets
+        """
+        out = bytearray()
+        for v in (self._count, self._sum, self._min, self._max):
+            write_varint(out, v)
+        prev = 0
+        for i, c in self.nonzero_buckets():
+            write_varint(out, i - prev)
+            write_varint(out, c)
+            prev = i
+        return bytes(out)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'LatencyHistogram':
+        h = LatencyHistogram()
+        summary = []
+        pos = 0
+        for _ in range(4):
+            v, pos = read_varint(data, pos)
+            summary.append(v)
+        h._count, h._sum, h._min, h._max = summary
+        index = 0
+        while pos < len(data):
+            delta, pos = read_varint(data, pos)
+            c, pos = read_varint(data, pos)
+            index += delta
+            h._counts[index] = c
+        return h
+
+    def nonzero_buckets(self) -> Iterator[Tuple[int, int]]:
+        """
+        iterate over (index, count) of the none zero buckets, only the buckets between min and max are read
+        """
+        if self._count == 0:
+            return
+        counts = self._counts
+        indexes = self._nonzero if self._nonzero is not None \
+            else range(value_to_index(self._min), value_to_index(self._max) + 1)
+        for i in indexes:
+            c = counts[i]
+            if c:
+                yield i, c
+
+    @staticmethod
+    def from_buckets(buckets: Dict[int, int], total_us: int, min_us: int, max_us: int) -> 'LatencyHistogram':
+        """
+        :param buckets: bucket index -> count
+        """
+        h = LatencyHistogram()
+        for i, c in buckets.items():
+            h._counts[i] = c
+        h.set_summary(sum(buckets.values()), total_us, min_us, max_us)
+        return h
+
+    def buckets(self):
+        """
+        iterate over (bucket value in us, count) of the none zero buckets
+        """
+        for i, c in enumerate(self._counts):
+            if c:
+                yield index_to_value(i), c
@@ -0,0 +1,429 @@
+import ssl
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from .client_protocol import ClientProtocol
+
+
+_HEADER_END = b'\r\n\r\n'
+
+
+class HttpResponse:
+    __slots__ = ('status', 'raw_headers', 'body')
+
+    def __init__(self, status: int, raw_headers: bytes, body: bytes):
+        self.status = status
+        # the header lines as received, parsed only when a header is asked for
+        self.raw_headers = raw_headers
+        self.body = body
+
+    def header(self, name: str) -> Optional[str]:
+        prefix = name.lower().encode() + b':'
+        for line in self.raw_headers.split(b'\r\n'):
+            if line[:len(prefix)].lower() == prefix:
+                return line[len(prefix):].strip().decode('latin-1')
+        return None
+
+
+class RequestTemplate:
+    """
+    A request encoded once, only the body and its length are added per request.
+
+    encode() without arguments returns the same bytes object every time, so a fixed request
+    costs no allocation at all.
+    """
+    def __init__(self, method: str, path: str, host: str, headers: Optional[Dict[str, str]] = None,
+                 body: bytes = b'', keepalive: bool = True):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}']
+        if not keepalive:
+            lines.append('Connection: close')
+        for k, v in (headers or {}).items():
+            lines.append(f'{k}: {v}')
+        self._head = ('\r\n'.join(lines) + '\r\n').encode('latin-1')
+        self._fixed = self.encode_body(body)
+
+    def encode_body(self, body: bytes) -> bytes:
+        return b'%sContent-Length: %d\r\n\r\n%s' % (self._head, len(body), body) if body \
+            else self._head + b'\r\n'
+
+    def encode(self) -> bytes:
+        return self._fixed
+
+
+class _Connection(asyncio.Protocol):
+    """
+    one keep alive connection, the responses are matched to the pipelined requests in order
+    """
+    def __init__(self, pool: 'HttpPool'):
+        self._pool = pool
+        self._transport: Optional[asyncio.Transport] = None
+        self._buf = bytearray()
+        self._waiters: Deque[asyncio.Future] = deque()
+        # state of the response being read
+        self._status = 0
+        self._headers = b''
+        self._length = -1
+        self._chunked = False
+        self._close = False
+        self.closed = False
+        self.last_used = time.monotonic()
+        # in the available list of the pool
+        self.queued = False
+        # slots taken by requests which got the connection and did not send yet
+        self.reserved = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def load(self) -> int:
+        return len(self._waiters) + self.reserved
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        if self._waiters and self._status != 0 and self._length < 0 and not self._chunked and exc is None:
+            # the body without a length ends with the connection
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(HttpResponse(self._status, self._headers, bytes(self._buf)))
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionError(f'connection lost: {exc}') if exc is not None
+                                     else ConnectionResetError('connection closed by the server'))
+        self._pool.on_closed(self)
+
+    def send(self, data: bytes, waiter: asyncio.Future) -> None:
+        self._waiters.append(waiter)
+        self._transport.write(data)
+
+    def close(self) -> None:
+        if not self.closed and self._transport is not None:
+            self._transport.close()
+
+    def data_received(self, data: bytes) -> None:
+        self._buf += data
+        while self._waiters and self.__parse():
+            pass
+
+    def __parse(self) -> bool:
+        """
+        :return: True when a response was completed
+        """
+        buf = self._buf
+        if self._status == 0:
+            end = buf.find(_HEADER_END)
+            if end < 0:
+                return False
+            head = bytes(buf[:end])
+            del buf[:end + 4]
+            line_end = head.find(b'\r\n')
+            self._status = int(head[9:12])
+            self._headers = head[line_end + 2:] if line_end >= 0 else b''
+            self._length = -1
+            self._chunked = False
+            self._close = False
+            lower = self._headers.lower()
+            pos = lower.find(b'content-length:')
+            if pos >= 0:
+                line_end = lower.find(b'\r\n', pos)
+                self._length = int(lower[pos + 15:line_end if line_end >= 0 else None])
+            elif b'transfer-encoding: chunked' in lower:
+                self._chunked = True
+            self._close = b'connection: close' in lower
+            if self._length < 0 and not self._chunked:
+                # no body for the statuses without one, otherwise the body ends with the connection
+                self._length = 0 if self._status in (204, 304) or self._status < 200 else -1
+        if self._chunked:
+            body = self.__read_chunked()
+            if body is None:
+                return False
+        elif self._length >= 0:
+            if len(buf) < self._length:
+                return False
+            body = bytes(buf[:self._length])
+            del buf[:self._length]
+        else:
+            return False
+        response = HttpResponse(self._status, self._headers, body)
+        self._status = 0
+        self.last_used = time.monotonic()
+        waiter = self._waiters.popleft()
+        if not waiter.done():
+            waiter.set_result(response)
+        if self._close:
+            self.close()
+        else:
+            self._pool.on_response(self)
+        return True
+
+    def __read_chunked(self) -> Optional[bytes]:
+        """
+        :return: the body once all chunks are received
+        """
+        buf = self._buf
+        body = bytearray()
+        pos = 0
+        while True:
+            line_end = buf.find(b'\r\n', pos)
+            if line_end < 0:
+                return None
+            size = int(bytes(buf[pos:line_end]).split(b';')[0], 16)
+            if size == 0:
+                trailer_end = buf.find(b'\r\n\r\n', line_end)
+                if trailer_end < 0:
+                    return None
+                del buf[:trailer_end + 4]
+                return bytes(body)
+            if len(buf) < line_end + 2 + size + 2:
+                return None
+            body += buf[line_end + 2:line_end + 2 + size]
+            pos = line_end + 2 + size + 2
+
+
+class HttpPool:
+    """
+    Keep alive connections to one server, shared by all users of a worker.
+
+    At most size connections are opened, each carries up to pipeline requests at once. A request
+    takes the most recently used connection with a free slot, opens a new one when none has a
+    slot, or waits for the first slot freed. Connections idle for longer than keepalive seconds
+    are closed when they are picked. The users of the pool are counted, the last one to leave closes it.
+    """
+    def __init__(self, host: str, port: int, use_ssl: bool = False, size: int = 100, keepalive: float = 60.0,
+                 pipeline: int = 1):
+        self._host = host
+        self._port = port
+        self._ssl = ssl.create_default_context() if use_ssl else None
+        self._size = size
+        self._keepalive = keepalive
+        self._pipeline = pipeline
+        self._connections = set()
+        self._opening = 0
+        # connections with a free slot, the last one is the most recently used, each is listed once
+        self._available: Deque[_Connection] = deque()
+        self._slot_waiters: Deque[asyncio.Future] = deque()
+        self._users = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def connections(self) -> int:
+        return len(self._connections)
+
+    @property
+    def users(self) -> int:
+        return self._users
+
+    def add_user(self) -> None:
+        self._users += 1
+
+    def remove_user(self) -> None:
+        self._users -= 1
+        if self._users <= 0:
+            self.close()
+
+    async def request(self, data: bytes) -> HttpResponse:
+        """
+        :param data: the encoded request, see RequestTemplate
+        """
+        conn = await self.__acquire()
+        conn.reserved -= 1
+        if conn.closed:
+            # closed between the hand over and now
+            raise ConnectionResetError('connection closed by the server')
+        waiter = asyncio.get_running_loop().create_future()
+        conn.send(data, waiter)
+        self.__offer(conn)
+        return await waiter
+
+    def __offer(self, conn: _Connection) -> None:
+        if not conn.queued and not conn.closed and conn.load < self._pipeline:
+            conn.queued = True
+            self._available.append(conn)
+
+    async def __acquire(self) -> _Connection:
+        """
+        :return: a connection with a slot reserved for the caller
+        """
+        available = self._available
+        while available:
+            conn = available.pop()
+            conn.queued = False
+            if conn.closed or conn.load >= self._pipeline:
+                # the slot went to a waiting request, the next response lists it again
+                continue
+            if self._keepalive > 0 and conn.pending == 0 and time.monotonic() - conn.last_used > self._keepalive:
+                conn.close()
+                continue
+            conn.reserved += 1
+            return conn
+        if len(self._connections) + self._opening < self._size:
+            self._opening += 1
+            try:
+                _, conn = await asyncio.get_running_loop().create_connection(
+                    lambda: _Connection(self), self._host, self._port, ssl=self._ssl)
+            finally:
+                self._opening -= 1
+            self._connections.add(conn)
+            conn.reserved += 1
+            return conn
+        waiter = asyncio.get_running_loop().create_future()
+        self._slot_waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # cancelled after the hand over, give the slot back
+                self.__release(waiter.result())
+            raise
+
+    def __release(self, conn: _Connection) -> None:
+        conn.reserved -= 1
+        self.__free(conn)
+
+    def __free(self, conn: _Connection) -> None:
+        # hand the free slots to the waiting requests first
+        while self._slot_waiters and not conn.closed and conn.load < self._pipeline:
+            waiter = self._slot_waiters.popleft()
+            if not waiter.done():
+                conn.reserved += 1
+                waiter.set_result(conn)
+        self.__offer(conn)
+
+    def on_response(self, conn: _Connection) -> None:
+        if self._keepalive <= 0:
+            conn.close()
+            return
+        self.__free(conn)
+
+    def on_closed(self, conn: _Connection) -> None:
+        self._connections.discard(conn)
+        # a waiting request opens a new connection instead
+        while self._slot_waiters:
+            waiter = self._slot_waiters.popleft()
+            if not waiter.done():
+                asyncio.ensure_future(self.__reopen(waiter))
+                return
+
+    async def __reopen(self, waiter: asyncio.Future) -> None:
+        try:
+            conn = await self.__acquire()
+        except Exception as e:
+            if not waiter.done():
+                waiter.set_exception(e)
+            return
+        if waiter.done():
+            self.__release(conn)
+        else:
+            waiter.set_result(conn)
+
+    def close(self) -> None:
+        """
+        close the connections, a later request opens new ones
+        """
+        for conn in list(self._connections):
+            conn.close()
+        for conn in self._available:
+            conn.queued = False
+        self._available.clear()
+
+
+# the pools of the worker process, by host, port, ssl
+_pools: Dict[Tuple[str, int, bool], HttpPool] = {}
+
+
+def get_pool(host: str, port: int, use_ssl: bool = False, size: int = 100, keepalive: float = 60.0,
+             pipeline: int = 1) -> HttpPool:
+    """
+    the shared pool of the worker for the server, created by the first user
+    """
+    key = (host, port, use_ssl)
+    pool = _pools.get(key)
+    if pool is None or pool.users <= 0:
+        # the pool left by its last user is closed
+        pool = _pools[key] = HttpPool(host, port, use_ssl, size, keepalive, pipeline)
+    return pool
+
+
+class HttpClient(ClientProtocol):
+    """
+    HTTP/1.1 client over the shared connection pool of the worker.
+
+    The "http" section of the custom config sets the pool and the default request::
+
+        http:
+          pool_size: 100   # connections per worker
+          keepalive: 60    # seconds an idle connection is reused, 0 closes it after every request
+          pipeline: 1      # requests sent on a connection before the first response
+          method: GET
+          path: /          # default is the path of the host url
+          headers: {}
+          body: ''
+
+    execute sends the default request and fails on a status >= 400, override it to send others
+    with request(), encode them once with template().
+    """
+    http_conf: dict = {}
+
+    def __init__(self):
+        super().__init__()
+        self._pool: Optional[HttpPool] = None
+        self._authority = ''
+        self._request = b''
+
+    @staticmethod
+    def global_init(custom_conf: Optional[dict] = None) -> None:
+        conf = (custom_conf or {}).get('http', {})
+        if not isinstance(conf, dict):
+            raise ValueError('config err: "http" must be a dict')
+        HttpClient.http_conf = conf
+
+    def init_before_use(self, host: str) -> None:
+        url = urlsplit(host if '://' in host else 'http://' + host)
+        use_ssl = url.scheme == 'https'
+        port = url.port or (443 if use_ssl else 80)
+        conf = HttpClient.http_conf
+        keepalive = conf.get('keepalive', 60.0)
+        self._pool = get_pool(url.hostname, port, use_ssl, conf.get('pool_size', 100), keepalive,
+                              conf.get('pipeline', 1))
+        self._pool.add_user()
+        self._authority = url.netloc
+        body = conf.get('body', '')
+        self._request = self.template(conf.get('method', 'GET'), conf.get('path', url.path or '/'),
+                                      conf.get('headers'), body.encode() if isinstance(body, str) else body).encode()
+
+    @property
+    def pool(self) -> HttpPool:
+        return self._pool
+
+    def template(self, method: str, path: str, headers: Optional[Dict[str, str]] = None,
+                 body: bytes = b'') -> RequestTemplate:
+        return RequestTemplate(method, path, self._authority, headers, body,
+                               HttpClient.http_conf.get('keepalive', 60.0) > 0)
+
+    async def request(self, data: bytes) -> HttpResponse:
+        return await self._pool.request(data)
+
+    async def shutdown(self) -> None:
+        """
+        leave the shared pool, the last user of the worker closes its connections
+        """
+        if self._pool is not None:
+            self._pool.remove_user()
+            self._pool = None
+
+    async def execute(self) -> Optional[bool]:
+        response = await self._pool.request(self._request)
+        if response.status >= 400:
+            self.report_fail(f'HTTP {response.status}', self.operation_name)
+            return True
+        return False
@@ -0,0 +1,131 @@
+import math
+from typing import List, Optional
+
+
+class Stage:
+    def __init__(self, duration: int, users: int, hatch_rate: int, arrival_rate: Optional[float] = None):
+        self.duration = duration
+        self.users = users
+        self.hatch_rate = hatch_rate
+        self.arrival_rate = arrival_rate
+
+    def __str__(self):
+        s = f'duration:{self.duration}, users:{self.users}, hatch_rate:{self.hatch_rate}'
+        if self.arrival_rate is not None:
+            s += f', arrival_rate:{self.arrival_rate}'
+        return s
+
+    def __repr__(self):
+        return f'Stage({self})'
+
+
+def _need_int(conf: dict, key: str, min_value: int = 1) -> int:
+    if key in conf and isinstance(conf[key], int) and conf[key] >= min_value:
+        return conf[key]
+    raise ValueError(f'config err: "{key}" of load shape need >= {min_value}')
+
+
+def _need_rate(conf: dict, key: str) -> Optional[float]:
+    if key not in conf:
+        return None
+    if type(conf[key]) in (int, float) and conf[key] > 0:
+        return float(conf[key])
+    raise ValueError(f'config err: "{key}" of load shape need > 0')
+
+
+def parse_stages(stages: list, hatch_rate: Optional[int], arrival_rate: Optional[float]) -> List[Stage]:
+    """
+    parse the "stages" list of the config
+
+    :param hatch_rate: default hatch rate of the stages, None means reach the users of the stage at once
+    :param arrival_rate: default arrival rate of the stages, the rate is inherited by the next stage
+    """
+    if not isinstance(stages, list) or len(stages) == 0:
+        raise ValueError('config err: "stages" must be a list of stage')
+    ret = []
+    prev_users = 0
+    for s in stages:
+        if not isinstance(s, dict):
+            raise ValueError('config err: stage must be a dict with "duration" and "users"')
+        rate = _need_rate(s, 'arrival_rate')
+        if rate is not None:
+            arrival_rate = rate
+        users = _need_int(s, 'users', 0)
+        if 'hatch_rate' in s:
+            stage_hatch_rate = _need_int(s, 'hatch_rate')
+        else:
+            stage_hatch_rate = hatch_rate if hatch_rate else max(users, prev_users, 1)
+        prev_users = users
+        ret.append(Stage(_need_int(s, 'duration'), users, stage_hatch_rate, arrival_rate))
+    return ret
+
+
+def generate_shape(shape: dict, hatch_rate: Optional[int], arrival_rate: Optional[float]) -> List[Stage]:
+    """
+    expand the "shape" section of the config to stages
+
+    step:  start_users, step_users, step_duration, steps
+    spike: users, spike_users, duration, spike_duration, spike_at
+    sine:  min_users, max_users, period, duration, resolution
+    """
+    if not isinstance(shape, dict) or 'type' not in shape:
+        raise ValueError('config err: "shape" need a "type" of step, spike or sine')
+    if 'hatch_rate' in shape:
+        hatch_rate = _need_int(shape, 'hatch_rate')
+    elif not hatch_rate:
+        hatch_rate = max(_need_int(shape, key, 0) for key in ('start_users', 'users', 'spike_users', 'max_users')
+                         if key in shape) or 1
+    if 'arrival_rate' in shape:
+        arrival_rate = _need_rate(shape, 'arrival_rate')
+    shape_type = shape['type']
+    if shape_type == 'step':
+        start_users = _need_int(shape, 'start_users')
+        step_users = _need_int(shape, 'step_users', 0)
+        step_duration = _need_int(shape, 'step_duration')
+        steps = _need_int(shape, 'steps')
+        return [Stage(step_duration, start_users + i * step_users, hatch_rate, arrival_rate) for i in range(steps)]
+    elif shape_type == 'spike':
+        users = _need_int(shape, 'users')
+        spike_users = _need_int(shape, 'spike_users')
+        duration = _need_int(shape, 'duration')
+        spike_duration = _need_int(shape, 'spike_duration')
+        spike_at = _need_int(shape, 'spike_at', 0) if 'spike_at' in shape else (duration - spike_duration) // 2
+        if spike_at + spike_duration > duration:
+            raise ValueError('config err: spike of load shape out of the duration')
+        # a spike reaches its users at once
+        ret = [Stage(spike_at, users, hatch_rate, arrival_rate),
+               Stage(spike_duration, spike_users, max(spike_users, hatch_rate), arrival_rate),
+               Stage(duration - spike_at - spike_duration, users, max(spike_users, hatch_rate), arrival_rate)]
+        return [s for s in ret if s.duration > 0]
+    elif shape_type == 'sine':
+        min_users = _need_int(shape, 'min_users', 0)
+        max_users = _need_int(shape, 'max_users')
+        period = _need_int(shape, 'period')
+        duration = _need_int(shape, 'duration')
+        resolution = _need_int(shape, 'resolution') if 'resolution' in shape else max(period // 20, 1)
+        ret = []
+        t = 0
+        while t < duration:
+            d = min(resolution, duration - t)
+            phase = math.sin(2 * math.pi * (t + d / 2) / period)
+            ret.append(Stage(d, round(min_users + (max_users - min_users) * (phase + 1) / 2), hatch_rate, arrival_rate))
+            t += d
+        return ret
+    raise ValueError(f'config err: unknown load shape type "{shape_type}"')
+
+
+def split_stages(stages: List[Stage], worker: int) -> List[List[Stage]]:
+    """
+    split users and rates of the stages to the workers
+    """
+    ret = [[] for _ in range(worker)]
+    for s in stages:
+        base_count = math.floor(s.users / worker)
+        add_user_count = s.users - base_count * worker
+        hatch_rate = max(round(s.hatch_rate / worker), 1)
+        for i in range(worker):
+            ret[i].append(Stage(s.duration,
+                                base_count + 1 if i < add_user_count else base_count,
+                                hatch_rate,
+                                s.arrival_rate / worker if s.arrival_rate is not None else None))
+    return ret
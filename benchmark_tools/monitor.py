@@ -0,0 +1,33 @@
+import os
+import sys
+import resource
+
+
+# how often a worker measures the delay of its event loop
+LOOP_LAG_SAMPLE_INTERVAL = 0.05
+# a worker beyond these limits of the average cpu or loop lag is itself the bottleneck,
+# its latencies include its own scheduling delay
+CPU_LIMIT = 90.0
+LOOP_LAG_LIMIT = 0.02
+
+
+def rss_bytes() -> int:
+    """
+    resident memory of the current process, where /proc is not available it is the peak
+    resident memory of the process so far, which is all the report shows
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on linux and in bytes on macOS
+    return peak * 1024 if sys.platform.startswith('linux') else peak
+
+
+def is_overloaded(cpu_percent: float, loop_lag: float) -> bool:
+    return cpu_percent >= CPU_LIMIT or loop_lag >= LOOP_LAG_LIMIT
@@ -0,0 +1,71 @@
+import os
+import csv
+import json
+from datetime import datetime
+from typing import Iterator, Tuple
+
+
+FORMATS = ('csv', 'jsonl')
+
+
+class ReplayConfig:
+    def __init__(self, conf: dict):
+        if not isinstance(conf, dict) or not isinstance(conf.get('file'), str):
+            raise ValueError('config err: "replay" need a "file"')
+        self.file: str = conf['file']
+        if not os.path.isfile(self.file):
+            raise ValueError(f'config err: replay file "{self.file}" not found')
+        self.format: str = conf.get('format', 'csv' if self.file.endswith('.csv') else 'jsonl')
+        if self.format not in FORMATS:
+            raise ValueError(f'config err: "format" of replay must be one of {FORMATS}')
+        # column or key of the request time, epoch seconds or ISO 8601
+        self.time_field: str = conf.get('time_field', 'timestamp')
+        self.speed = conf.get('speed', 1.0)
+        if type(self.speed) not in (int, float) or self.speed <= 0:
+            raise ValueError('config err: "speed" of replay need > 0')
+        self.speed = float(self.speed)
+
+    def __str__(self):
+        return f'file:{self.file}, format:{self.format}, time_field:{self.time_field}, speed:{self.speed}'
+
+
+def parse_timestamp(value) -> float:
+    if type(value) in (int, float):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value).timestamp()
+
+
+def read_records(conf: ReplayConfig, worker_index: int, worker: int) -> Iterator[Tuple[float, dict]]:
+    """
+    stream the records of the log which belong to the worker, the records are dealt
+    round robin to the workers, the log is never loaded as a whole
+
+    :return: iterator of (seconds since the first record of the log, record)
+    """
+    origin = None
+    with open(conf.file, 'r', newline='') as f:
+        if conf.format == 'csv':
+            for i, row in enumerate(csv.DictReader(f)):
+                if origin is None:
+                    origin = parse_timestamp(row[conf.time_field])
+                if i % worker == worker_index:
+                    yield parse_timestamp(row[conf.time_field]) - origin, row
+        else:
+            i = 0
+            for line in f:
+                if len(line.strip()) == 0:
+                    continue
+                # only the records of this worker are parsed, besides the first one
+                if origin is None or i % worker == worker_index:
+                    record = json.loads(line)
+                    if origin is None:
+                        origin = parse_timestamp(record[conf.time_field])
+                    if i % worker == worker_index:
+                        yield parse_timestamp(record[conf.time_field]) - origin, record
+                i += 1
@@ -1,84 +1,272 @@
-from multiprocessing import Process, Queue
-from typing import Union
-import dash
-from dash.dependencies import Input, Output, ClientsideFunction
-import dash_core_components as dcc
-import dash_html_components as html
-import plotly
-import plotly.graph_objs as go
+import json
 import queue
-import webbrowser
 import logging
-log = logging.getLogger('werkzeug')
-log.setLevel(logging.ERROR)
-
-X = list()
-X.append(0)
-Y = list()
-Y.append(0)
-dash_process: Union[None, Process] = None
-msg_queue: Union[None, Queue] = None
-app = dash.Dash(__name__)
-browser_opened = False
-layout = go.Layout(title='RPS DashBoard')
-layout.yaxis.rangemode = "tozero"
-
-app.layout = html.Div(
-    [
-        dcc.Graph(id='live-graph', animate=False),
-        dcc.Interval(
-            id='graph-update',
-            interval=1000,
-            n_intervals=0
-        ),
-    ]
-)
-
-
-@app.callback(
-    Output('live-graph', 'figure'),
-    [Input('graph-update', 'n_intervals')]
-)
-def update_graph_scatter(n):
-    global browser_opened
-    if browser_opened is False:
-        browser_opened = True
-        webbrowser.open('http://127.0.0.1:8050/')
-    while True:
+import threading
+import webbrowser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional, Tuple
+
+# the history is halved in resolution when it reaches this many points
+MAX_POINTS = 600
+# points buffered for one browser before it is taken as too slow and disconnected
+CLIENT_BUFFER = 256
+HEARTBEAT_INTERVAL = 15.0
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>RPS DashBoard</title>
+<style>
+body { font-family: sans-serif; margin: 16px; }
+canvas { width: 100%; height: 240px; border: 1px solid #ddd; margin-bottom: 8px; }
+.legend span { margin-right: 12px; }
+</style>
+</head>
+<body>
+<h3>RPS DashBoard <small id="status"></small></h3>
+<div class="legend" id="l0"></div><canvas id="c0"></canvas>
+<div class="legend" id="l1"></div><canvas id="c1"></canvas>
+<div class="legend" id="l2"></div><canvas id="c2"></canvas>
+<div class="legend" id="l3"></div><canvas id="c3"></canvas>
+<script>
+const COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f'];
+let points = [];
+const charts = [
+  {title: 'rps / users', series: p => ({rps: p.rps, users: p.users})},
+  {title: 'response time (ms)', series: p => ({p50: p.p50, p90: p.p90, p99: p.p99, 'p99.9': p.p999})},
+  {title: 'error rate (%) / worker cpu (%)', series: p => {
+    const s = {'error %': p.error_rate};
+    for (const w in p.cpu) s['cpu ' + w] = p.cpu[w];
+    return s;
+  }},
+  {title: 'event loop lag (ms)', series: p => {
+    const s = {};
+    for (const w in p.loop_lag) s['worker ' + w] = p.loop_lag[w];
+    return s;
+  }},
+];
+
+function draw() {
+  charts.forEach((chart, n) => {
+    const canvas = document.getElementById('c' + n);
+    const ctx = canvas.getContext('2d');
+    canvas.width = canvas.clientWidth;
+    canvas.height = canvas.clientHeight;
+    const series = {};
+    points.forEach((p, i) => {
+      const s = chart.series(p);
+      for (const k in s) (series[k] = series[k] || []).push([i, s[k]]);
+    });
+    let max = 1;
+    for (const k in series) series[k].forEach(v => { max = Math.max(max, v[1]); });
+    const w = canvas.width - 50, h = canvas.height - 20;
+    const x = i => 45 + i * w / Math.max(points.length - 1, 1);
+    const y = v => 10 + h - v * h / max;
+    ctx.fillStyle = '#666';
+    ctx.fillText(max.toFixed(1), 2, 14);
+    ctx.fillText('0', 2, h + 10);
+    if (points.length > 0) {
+      ctx.fillText(points[0].time, 45, canvas.height - 1);
+      ctx.fillText(points[points.length - 1].time, canvas.width - 60, canvas.height - 1);
+    }
+    // a dashed line and the index at the start of every load shape stage
+    ctx.save();
+    ctx.strokeStyle = '#aaa';
+    ctx.setLineDash([4, 4]);
+    points.forEach((p, i) => {
+      if (i > 0 && p.stage !== points[i - 1].stage) {
+        ctx.beginPath();
+        ctx.moveTo(x(i), 10);
+        ctx.lineTo(x(i), h + 10);
+        ctx.stroke();
+        ctx.fillText('stage ' + p.stage, x(i) + 3, 24);
+      }
+    });
+    ctx.restore();
+    const legend = [];
+    Object.keys(series).forEach((k, i) => {
+      const color = COLORS[i % COLORS.length];
+      ctx.strokeStyle = color;
+      ctx.beginPath();
+      series[k].forEach((v, j) => j === 0 ? ctx.moveTo(x(v[0]), y(v[1])) : ctx.lineTo(x(v[0]), y(v[1])));
+      ctx.stroke();
+      legend.push(`<span style="color:${color}">${k} ${series[k][series[k].length - 1][1].toFixed(1)}</span>`);
+    });
+    document.getElementById('l' + n).innerHTML = `<b>${chart.title}</b> ` + legend.join('');
+  });
+}
+
+const source = new EventSource('/events');
+source.addEventListener('history', e => { points = JSON.parse(e.data); draw(); });
+source.onmessage = e => {
+  const p = JSON.parse(e.data);
+  if (p.stride > 1) points = points.slice(0, -1);
+  points.push(p);
+  draw();
+};
+source.onopen = () => { document.getElementById('status').textContent = 'live'; };
+source.onerror = () => { document.getElementById('status').textContent = 'disconnected'; };
+window.onresize = draw;
+</script>
+</body>
+</html>
+'''
+
+
+def _merge_points(points: List[dict]) -> dict:
+    """
+    merge the points of adjacent intervals, rates are averaged and latencies keep the worst
+    """
+    ret = dict(points[-1])
+    ret['time'] = points[0]['time']
+    for key in ('rps', 'error_rate'):
+        ret[key] = sum(p[key] for p in points) / len(points)
+    for key in ('p50', 'p90', 'p99', 'p999'):
+        ret[key] = max(p[key] for p in points)
+    for key in ('cpu', 'loop_lag'):
+        workers = {}
+        for p in points:
+            for worker, value in p[key].items():
+                workers[worker] = max(workers.get(worker, 0.0), value)
+        ret[key] = workers
+    return ret
+
+
+class DownsampledHistory:
+    """
+    Bounded history of the dashboard points.
+
+    When the history is full, every two adjacent points are merged and the following
+    points are merged by the new stride, so a run of any length keeps at most max_points.
+    """
+    def __init__(self, max_points: int = MAX_POINTS):
+        self._max_points = max_points
+        self._points: List[dict] = []
+        self._pending: List[dict] = []
+        self._stride = 1
+
+    @property
+    def points(self) -> List[dict]:
+        return self._points + ([_merge_points(self._pending)] if self._pending else [])
+
+    def append(self, point: dict) -> Tuple[dict, bool]:
+        """
+        :return: the point to show and whether the history was halved, a point with
+                 stride > 1 replaces the last shown one
+        """
+        self._pending.append(point)
+        merged = _merge_points(self._pending)
+        merged['stride'] = len(self._pending)
+        halved = False
+        if len(self._pending) >= self._stride:
+            self._points.append(merged)
+            self._pending = []
+            if len(self._points) >= self._max_points:
+                self._points = [_merge_points(self._points[i:i + 2]) for i in range(0, len(self._points), 2)]
+                self._stride *= 2
+                halved = True
+        return merged, halved
+
+
+class _DashHandler(BaseHTTPRequestHandler):
+    server: 'DashServer'
+
+    def do_GET(self):
+        if self.path == '/':
+            body = PAGE.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/events':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.server.stream_events(self.wfile)
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+class DashServer(ThreadingHTTPServer):
+    """
+    Live dashboard on a stdlib http server, the browser gets the bounded history once
+    and then only the new interval of every reporting period by server-sent events.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int] = ('127.0.0.1', 8050)):
+        super().__init__(address, _DashHandler)
+        self._history = DownsampledHistory()
+        self._subscribers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/'
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        print(f'rps dash on {self.url}')
+        webbrowser.open(self.url)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._lock:
+            for q in self._subscribers:
+                try:
+                    q.put_nowait(None)
+                except queue.Full:
+                    pass
+        self.shutdown()
+        self.server_close()
+
+    def publish(self, point: dict) -> None:
+        """
+        called by the controller with the statistics of every interval
+        """
+        with self._lock:
+            shown, halved = self._history.append(point)
+            # the browsers replace their history when it was halved
+            message = ('history', self._history.points) if halved else ('message', shown)
+            for q in list(self._subscribers):
+                try:
+                    q.put_nowait(message)
+                except queue.Full:
+                    logging.warning('rps dash client is too slow, disconnected')
+                    self._subscribers.remove(q)
+
+    def stream_events(self, wfile) -> None:
+        q = queue.Queue(CLIENT_BUFFER)
+        with self._lock:
+            history = self._history.points
+            self._subscribers.append(q)
         try:
-            x, y = msg_queue.get(block=False)
-            X.append(x)
-            Y.append(y)
-        except queue.Empty:
-            break
-    data = plotly.graph_objs.Scatter(
-        x=X,
-        y=Y,
-        name='Scatter',
-        mode='lines+markers'
-    )
-    # xaxis = dict(range=[min(X), max(X)]),
-    # yaxis = dict(range=[min(Y), max(Y)])
-    return {'data': [data],
-            'layout': layout
-            }
-
-
-def __run_app_server(q):
-    global msg_queue
-    msg_queue = q
-    app.run_server()
-
-
-def run_dash_server(q):
-    global dash_process
-    assert dash_process is None
-    dash_process = Process(target=__run_app_server, args=(q,))
-    dash_process.start()
-
-
-def stop_dash_server():
-    global dash_process
-    if dash_process is not None:
-        dash_process.terminate()
-        dash_process = None
+            message = ('history', history)
+            while message is not None:
+                event, data = message
+                wfile.write(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode())
+                wfile.flush()
+                message = None
+                while message is None and not self._stopped.is_set():
+                    try:
+                        message = q.get(timeout=HEARTBEAT_INTERVAL)
+                    except queue.Empty:
+                        wfile.write(b': heartbeat\n\n')
+                        wfile.flush()
+                if message is None or self._stopped.is_set():
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._lock:
+                if q in self._subscribers:
+                    self._subscribers.remove(q)
@@ -0,0 +1,176 @@
+import time
+import math
+from typing import Callable, List, Optional, Tuple
+from .benchmark_context import FinalResult
+
+
+class SearchConfig:
+    def __init__(self, conf: dict, arrival_rate: Optional[float]):
+        if not isinstance(conf, dict):
+            raise ValueError('config err: "search" must be a dict')
+        self.mode = conf.get('mode', 'arrival_rate' if arrival_rate is not None else 'users')
+        if self.mode not in ('users', 'arrival_rate'):
+            raise ValueError('config err: "mode" of search must be users or arrival_rate')
+        self.strategy = conf.get('strategy', 'step')
+        if self.strategy not in ('step', 'binary'):
+            raise ValueError('config err: "strategy" of search must be step or binary')
+        for key in ('start', 'max', 'step_time'):
+            if key not in conf or type(conf[key]) not in (int, float) or conf[key] <= 0:
+                raise ValueError(f'config err: "{key}" of search need > 0')
+        self.start = conf['start']
+        self.max = conf['max']
+        if self.max < self.start:
+            raise ValueError('config err: "max" of search need >= "start"')
+        self.step = conf.get('step', max((self.max - self.start) / 10, 1))
+        self.step_time = conf['step_time']
+        # seconds to reach the load before the measurement of a step starts
+        self.settle_time = conf.get('settle_time', min(5, self.step_time / 5))
+        self.precision = conf.get('precision', max((self.max - self.start) / 20, 1))
+        # p99 in ms and error rate in percent
+        self.p99 = conf.get('p99')
+        self.error_rate = conf.get('error_rate', 1.0)
+        if self.mode == 'users':
+            self.start = int(self.start)
+            self.max = int(self.max)
+            self.step = max(int(self.step), 1)
+
+    def __str__(self):
+        return f'mode:{self.mode}, strategy:{self.strategy}, start:{self.start}, max:{self.max}, ' \
+               f'step:{self.step}, step_time:{self.step_time}, p99:{self.p99} ms, error_rate:{self.error_rate}%'
+
+
+class SearchStep:
+    def __init__(self, index: int, load: float):
+        self.index = index
+        self.load = load
+        self.rps = 0.0
+        self.p99 = 0.0
+        self.error_rate = 0.0
+        self.passed = False
+
+
+class SaturationSearch:
+    """
+    Step or binary search of the offered load, every probe runs on the same workers as a stage.
+
+    A probe passes when the p99 latency and the error rate measured after the settle time
+    stay under the thresholds, the knee is the highest load which passed.
+    """
+    def __init__(self,
+                 conf: SearchConfig,
+                 set_load: Callable[[int, float], None],
+                 snapshot: Callable[[], FinalResult],
+                 need_quit: Callable[[], bool]):
+        self._conf = conf
+        self._set_load = set_load
+        self._snapshot = snapshot
+        self._need_quit = need_quit
+        self._steps: List[SearchStep] = []
+        self._knee: Optional[SearchStep] = None
+
+    @property
+    def steps(self) -> List[SearchStep]:
+        return self._steps
+
+    @property
+    def knee(self) -> Optional[SearchStep]:
+        return self._knee
+
+    def run(self) -> None:
+        c = self._conf
+        if c.strategy == 'step':
+            load = c.start
+            while load <= c.max and not self._need_quit():
+                step = self.__probe(load)
+                if step is None or not step.passed:
+                    break
+                self._knee = step
+                load += c.step
+        else:
+            lo, hi = c.start, c.max
+            step = self.__probe(lo)
+            if step is None or not step.passed:
+                return
+            self._knee = step
+            step = self.__probe(hi)
+            if step is None:
+                return
+            if step.passed:
+                self._knee = step
+                return
+            while hi - lo > c.precision and not self._need_quit():
+                mid = (lo + hi) / 2
+                if c.mode == 'users':
+                    mid = int(mid)
+                    if mid in (lo, hi):
+                        break
+                step = self.__probe(mid)
+                if step is None:
+                    return
+                if step.passed:
+                    self._knee = step
+                    lo = mid
+                else:
+                    hi = mid
+
+    def __probe(self, load: float) -> Optional[SearchStep]:
+        step = SearchStep(len(self._steps), load)
+        self._set_load(step.index, load)
+        if not self.__sleep(self._conf.settle_time):
+            return None
+        begin = self._snapshot()
+        begin_time = time.time()
+        if not self.__sleep(self._conf.step_time):
+            return None
+        end = self._snapshot()
+        run_time = time.time() - begin_time
+        h = end.success_results.diff(begin.success_results)
+        fail_count = end.fail_count - begin.fail_count
+        total = h.count + fail_count
+        step.rps = h.count / run_time
+        step.p99 = h.percentile_us(0.99) / 1000
+        step.error_rate = fail_count / total * 100 if total > 0 else 0.0
+        step.passed = total > 0 and step.error_rate <= self._conf.error_rate \
+            and (self._conf.p99 is None or step.p99 <= self._conf.p99)
+        self._steps.append(step)
+        print(f'search step {step.index}: {self._conf.mode} {load}, rps {step.rps:.1f}, p99 {step.p99:.1f} ms, '
+              f'error rate {step.error_rate:.2f}%, {"pass" if step.passed else "fail"}')
+        return step
+
+    def __sleep(self, seconds: float) -> bool:
+        end = time.time() + seconds
+        while not self._need_quit():
+            left = end - time.time()
+            if left <= 0:
+                return True
+            time.sleep(min(0.1, left))
+        return False
+
+    def report(self) -> str:
+        header = f"{'step':>6}{self._conf.mode:>14}{'rps':>12}{'99%(ms)':>10}{'error%':>9}{'result':>8}"
+        lines = [f'saturation search ({self._conf}):', header]
+        for s in self._steps:
+            lines.append(f'{s.index:>6}{s.load:>14}{s.rps:>12.1f}{s.p99:>10.1f}{s.error_rate:>9.2f}'
+                         f'{"pass" if s.passed else "fail":>8}')
+        if self._knee is None:
+            lines.append('knee point: not found, the start load already breaks the thresholds')
+        else:
+            lines.append(f'knee point: {self._conf.mode} {self._knee.load}, rps {self._knee.rps:.1f}, '
+                         f'p99 {self._knee.p99:.1f} ms')
+        return '\n'.join(lines)
+
+
+def split_load(load: float, worker: int, mode: str) -> List[Tuple[int, Optional[float]]]:
+    """
+    :return: users and arrival rate of every worker
+    """
+    ret = []
+    if mode == 'users':
+        base_count = math.floor(load / worker)
+        add_user_count = int(load) - base_count * worker
+        for i in range(worker):
+            ret.append((base_count + 1 if i < add_user_count else base_count, None))
+    else:
+        for i in range(worker):
+            ret.append((0, load / worker))
+    return ret
@@ -0,0 +1,132 @@
+import time
+import random
+import asyncio
+from bisect import bisect_left
+from typing import Callable, List, Optional, Tuple
+from .client_protocol import ClientProtocol
+
+
+class Step:
+    def __init__(self, func: Callable, name: str, wait_time: Optional[float]):
+        self.func = func
+        self.name = name
+        # seconds to wait after the step, None means the wait_time of the config
+        self.wait_time = wait_time
+
+
+def task(weight: float = 1, name: Optional[str] = None, wait_time: Optional[float] = None):
+    """
+    mark an async method of a ScenarioClient as a task of one step, picked with its weight
+    """
+    if weight <= 0:
+        raise ValueError('the weight of a task need > 0')
+
+    def decorator(func):
+        func.scenario_task = (weight, Step(func, name or func.__name__, wait_time))
+        return func
+    return decorator
+
+
+class Flow:
+    """
+    A task of several dependent steps which run in order, a failed step ends the flow.
+
+    The steps are added in the order they are defined::
+
+        purchase = Flow(weight=5)
+
+        @purchase.step(wait_time=1)
+        async def add_to_cart(self): ...
+
+        @purchase.step()
+        async def pay(self): ...
+    """
+    def __init__(self, weight: float = 1, name: Optional[str] = None):
+        if weight <= 0:
+            raise ValueError('the weight of a flow need > 0')
+        self.weight = weight
+        self.name = name
+        self.steps: List[Step] = []
+
+    def __set_name__(self, owner, name):
+        if self.name is None:
+            self.name = name
+
+    def step(self, name: Optional[str] = None, wait_time: Optional[float] = None):
+        def decorator(func):
+            self.steps.append(Step(func, name or func.__name__, wait_time))
+            return func
+        return decorator
+
+
+class ScenarioClient(ClientProtocol):
+    """
+    Client of a weighted mix of tasks and flows, execute runs one of them per call.
+
+    Every step is recorded as a named operation, "<flow>.<step>" inside a flow, and counts as a
+    request of the run. Every flow is recorded as a named operation too, its time is the sum of
+    its steps without the waits. The state of a user is kept on the client instance, the flows
+    of a user run one after another.
+
+    A step returns like execute: None or False is a success timed around the step, True means
+    the step reported its result itself.
+    """
+    # (cumulative weight, flow name or None, steps), built once per class, the steps of a flow
+    # are named "<flow>.<step>"
+    _scenario: List[Tuple[float, Optional[str], Tuple[Step, ...]]] = []
+    _scenario_weights: List[float] = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        entries = []
+        for klass in reversed(cls.__mro__):
+            for attr in vars(klass).values():
+                if hasattr(attr, 'scenario_task'):
+                    weight, step = attr.scenario_task
+                    entries.append((weight, None, (step,)))
+                elif isinstance(attr, Flow):
+                    if len(attr.steps) == 0:
+                        raise ValueError(f'flow {attr.name} of {cls.__name__} has no step')
+                    steps = tuple(Step(s.func, f'{attr.name}.{s.name}', s.wait_time) for s in attr.steps)
+                    entries.append((attr.weight, attr.name, steps))
+        total = 0.0
+        cls._scenario = []
+        cls._scenario_weights = []
+        for weight, flow, steps in entries:
+            total += weight
+            cls._scenario.append((total, flow, steps))
+            cls._scenario_weights.append(total)
+
+    def pick(self) -> Tuple[float, Optional[str], Tuple[Step, ...]]:
+        weights = self._scenario_weights
+        return self._scenario[bisect_left(weights, random.random() * weights[-1])]
+
+    async def execute(self) -> Optional[bool]:
+        if len(self._scenario) == 0:
+            raise NotImplementedError(f'{type(self).__name__} has no task or flow')
+        _, flow, steps = self.pick()
+        context = self._context
+        flow_time = 0
+        last = len(steps) - 1
+        for i, step in enumerate(steps):
+            st = time.monotonic_ns()
+            self.start_timing(st)
+            try:
+                ret = await step.func(self)
+            except Exception as e:
+                self.report_exception(e, step.name)
+                if flow is not None:
+                    context.report_operation_fail(flow)
+                return True
+            cost = time.monotonic_ns() - st
+            flow_time += cost
+            if not ret:
+                context.report_success_ns(cost, step.name)
+            if i < last:
+                await asyncio.sleep(step.wait_time if step.wait_time is not None else context.wait_time())
+            elif step.wait_time is not None:
+                # the wait after the last step replaces the wait of the config
+                self.next_wait_time = step.wait_time
+        if flow is not None:
+            context.report_operation_ns(flow, flow_time)
+        return True
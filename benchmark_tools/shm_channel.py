@@ -0,0 +1,224 @@
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+import logging
+from .histogram import LatencyHistogram, BUCKET_COUNT, write_varint, read_varint
+from .benchmark_context import RunResult
+
+
+RING_SLOTS = 16
+# record layout in int64 slots
+_SEQ = 0
+_NOW_USER = 1
+_LAST_TIME = 2
+_DROPPED = 3
+_SUCCESS = 4
+_LAG = 8
+_START_TIME = 12
+_STAGE = 13
+_FINISH = 14
+# cpu percent * 100
+_CPU = 15
+# loop lag in us, rss in bytes
+_LOOP_LAG_MAX = 16
+_LOOP_LAG_MEAN = 17
+_RSS = 18
+_INFLIGHT = 19
+# bytes of the named operations in the operations area of the slot, 0 for none
+_OPERATIONS_LENGTH = 20
+_HEADER_SIZE = 24
+_SUCCESS_COUNTS = _HEADER_SIZE
+_LAG_COUNTS = _SUCCESS_COUNTS + BUCKET_COUNT
+RECORD_SIZE = _LAG_COUNTS + BUCKET_COUNT
+# the first slot of the block is the number of records written
+_RECORDS_BASE = 8
+# bytes of the operations area of every slot, the named operations of a record which do not fit
+# are sent through the queue
+OPERATIONS_SIZE = 1 << 16
+
+
+def _write_histogram(mv: memoryview, base: int, counts_base: int, h: LatencyHistogram) -> None:
+    mv[counts_base:counts_base + BUCKET_COUNT] = h.raw_counts
+    mv[base] = h.count
+    mv[base + 1] = h.total_us
+    mv[base + 2] = h.min_us
+    mv[base + 3] = h.max_us
+
+
+def _read_histogram(mv: memoryview, base: int, counts_base: int) -> LatencyHistogram:
+    h = LatencyHistogram()
+    memoryview(h.raw_counts)[:] = mv[counts_base:counts_base + BUCKET_COUNT]
+    h.set_summary(mv[base], mv[base + 1], mv[base + 2], mv[base + 3])
+    return h
+
+
+def _encode_histograms(out: bytearray, histograms: Optional[Dict[int, LatencyHistogram]]) -> None:
+    write_varint(out, len(histograms) if histograms else 0)
+    for op_id, h in (histograms or {}).items():
+        data = h.to_bytes()
+        write_varint(out, op_id)
+        write_varint(out, len(data))
+        out += data
+
+
+def _decode_histograms(data: bytes, pos: int) -> Tuple[Optional[Dict[int, LatencyHistogram]], int]:
+    count, pos = read_varint(data, pos)
+    histograms = {}
+    for _ in range(count):
+        op_id, pos = read_varint(data, pos)
+        length, pos = read_varint(data, pos)
+        histograms[op_id] = LatencyHistogram.from_bytes(data[pos:pos + length])
+        pos += length
+    return histograms or None, pos
+
+
+def encode_operations(result: RunResult) -> bytes:
+    """
+    the named operations of a result: the new names, the latency and timing histograms and the
+    fail counts, empty when there are none
+    """
+    if not (result.new_operations or result.operations or result.timings or result.operation_fails):
+        return b''
+    out = bytearray()
+    names = result.new_operations or {}
+    write_varint(out, len(names))
+    for op_id, name in names.items():
+        data = name.encode()
+        write_varint(out, op_id)
+        write_varint(out, len(data))
+        out += data
+    _encode_histograms(out, result.operations)
+    _encode_histograms(out, result.timings)
+    fails = result.operation_fails or {}
+    write_varint(out, len(fails))
+    for op_id, count in fails.items():
+        write_varint(out, op_id)
+        write_varint(out, count)
+    return bytes(out)
+
+
+def decode_operations(data: bytes, result: RunResult) -> None:
+    count, pos = read_varint(data, 0)
+    names = {}
+    for _ in range(count):
+        op_id, pos = read_varint(data, pos)
+        length, pos = read_varint(data, pos)
+        names[op_id] = data[pos:pos + length].decode()
+        pos += length
+    result.new_operations = names or None
+    result.operations, pos = _decode_histograms(data, pos)
+    result.timings, pos = _decode_histograms(data, pos)
+    count, pos = read_varint(data, pos)
+    fails = {}
+    for _ in range(count):
+        op_id, pos = read_varint(data, pos)
+        fails[op_id], pos = read_varint(data, pos)
+    result.operation_fails = fails or None
+
+
+class ShmChannel:
+    """
+    Single writer ring buffer of fixed layout interval records in shared memory.
+
+    The worker process writes the latency histograms and counters of every RunResult into
+    the next slot, the named operations go compactly encoded into the operations area of the
+    slot. The controller copies new slots out without any pickling. Only the rare data
+    (failure reasons, finish) still needs the queue.
+    """
+    def __init__(self, worker_index: int):
+        self._worker_index = worker_index
+        records_size = (_RECORDS_BASE + RING_SLOTS * RECORD_SIZE) * 8
+        self._shm = shared_memory.SharedMemory(create=True, size=records_size + RING_SLOTS * OPERATIONS_SIZE)
+        self._mv = self._shm.buf[:records_size].cast('q')
+        self._operations_mv = self._shm.buf[records_size:]
+        self._mv[0] = 0
+        self._read_count = 0
+        self._lost = 0
+
+    @property
+    def lost(self) -> int:
+        return self._lost
+
+    def write(self, result: RunResult) -> bool:
+        """
+        called in the worker process
+
+        :return: False when the named operations did not fit, they need to go through the queue
+        """
+        mv = self._mv
+        written = mv[0]
+        base = _RECORDS_BASE + (written % RING_SLOTS) * RECORD_SIZE
+        # invalidate the slot while it is changing
+        mv[base + _SEQ] = -1
+        rec = mv[base:base + RECORD_SIZE]
+        rec[_NOW_USER] = result.now_user
+        rec[_LAST_TIME] = int(result.last_time * 1000000)
+        rec[_DROPPED] = result.dropped
+        rec[_START_TIME] = int(result.start_time * 1000000)
+        rec[_STAGE] = result.stage
+        rec[_FINISH] = 1 if result.finish else 0
+        rec[_CPU] = int(result.cpu_percent * 100)
+        rec[_LOOP_LAG_MAX] = int(result.loop_lag_max * 1000000)
+        rec[_LOOP_LAG_MEAN] = int(result.loop_lag_mean * 1000000)
+        rec[_RSS] = result.rss
+        rec[_INFLIGHT] = result.inflight
+        _write_histogram(rec, _SUCCESS, _SUCCESS_COUNTS, result.success_results)
+        _write_histogram(rec, _LAG, _LAG_COUNTS, result.schedule_lag)
+        operations = encode_operations(result)
+        fits = len(operations) <= OPERATIONS_SIZE
+        if fits and len(operations) > 0:
+            start = (written % RING_SLOTS) * OPERATIONS_SIZE
+            self._operations_mv[start:start + len(operations)] = operations
+        rec[_OPERATIONS_LENGTH] = len(operations) if fits else 0
+        mv[base + _SEQ] = written + 1
+        mv[0] = written + 1
+        return fits
+
+    def read(self) -> List[RunResult]:
+        """
+        called in the controller process, return the records written since the last read
+        """
+        mv = self._mv
+        written = mv[0]
+        ret = []
+        if written - self._read_count > RING_SLOTS:
+            self._lost += written - RING_SLOTS - self._read_count
+            logging.warning(f'worker {self._worker_index} overrun the shared memory ring, '
+                            f'{written - RING_SLOTS - self._read_count} reports lost')
+            self._read_count = written - RING_SLOTS
+        while self._read_count < written:
+            base = _RECORDS_BASE + (self._read_count % RING_SLOTS) * RECORD_SIZE
+            rec = mv[base:base + RECORD_SIZE]
+            result = RunResult()
+            result.worker_index = self._worker_index
+            result.now_user = rec[_NOW_USER]
+            result.last_time = rec[_LAST_TIME] / 1000000
+            result.dropped = rec[_DROPPED]
+            result.start_time = rec[_START_TIME] / 1000000
+            result.stage = rec[_STAGE]
+            result.finish = rec[_FINISH] == 1
+            result.cpu_percent = rec[_CPU] / 100
+            result.loop_lag_max = rec[_LOOP_LAG_MAX] / 1000000
+            result.loop_lag_mean = rec[_LOOP_LAG_MEAN] / 1000000
+            result.rss = rec[_RSS]
+            result.inflight = rec[_INFLIGHT]
+            result.failed_reason = {}
+            result.success_results = _read_histogram(rec, _SUCCESS, _SUCCESS_COUNTS)
+            result.schedule_lag = _read_histogram(rec, _LAG, _LAG_COUNTS)
+            length = rec[_OPERATIONS_LENGTH]
+            start = (self._read_count % RING_SLOTS) * OPERATIONS_SIZE
+            operations = bytes(self._operations_mv[start:start + length]) if length > 0 else None
+            self._read_count += 1
+            if rec[_SEQ] != self._read_count:
+                # the writer wrapped around while copying
+                self._lost += 1
+                continue
+            if operations is not None:
+                decode_operations(operations, result)
+            ret.append(result)
+        return ret
+
+    def close(self) -> None:
+        self._mv.release()
+        self._operations_mv.release()
+        self._shm.close()
+        self._shm.unlink()
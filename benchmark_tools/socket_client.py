@@ -0,0 +1,379 @@
+import struct
+import asyncio
+from typing import Optional, Tuple, Union
+from .client_protocol import ClientProtocol
+
+
+SCHEMES = ('tcp', 'udp', 'unix')
+# struct formats of the length prefix by its size in bytes
+_LENGTH_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+def parse_socket_address(address: str) -> Tuple[str, Union[str, Tuple[str, int]]]:
+    """
+    :param address: tcp://host:port, udp://host:port or unix:///path, tcp without a scheme
+    :return: scheme, (host, port) or the path of the unix socket
+    """
+    scheme, sep, rest = address.partition('://')
+    if len(sep) == 0:
+        scheme, rest = 'tcp', address
+    if scheme not in SCHEMES:
+        raise ValueError(f'address err: scheme of "{address}" must be one of {SCHEMES}')
+    if scheme == 'unix':
+        if len(rest) == 0:
+            raise ValueError(f'address err: "{address}" need the path of the socket')
+        return scheme, rest
+    host, _, port = rest.rpartition(':')
+    if len(host) == 0 or not port.isdigit():
+        raise ValueError(f'address err: "{address}" need host:port')
+    return scheme, (host.strip('[]'), int(port))
+
+
+class SocketConfig:
+    def __init__(self, conf: dict):
+        if not isinstance(conf, dict):
+            raise ValueError('config err: "socket" must be a dict')
+        # length: a length prefix before every frame, delimiter: every frame ends with the delimiter
+        self.framing = conf.get('framing', 'length')
+        if self.framing not in ('length', 'delimiter'):
+            raise ValueError('config err: "framing" of socket must be length or delimiter')
+        self.length_bytes = conf.get('length_bytes', 4)
+        if self.length_bytes not in _LENGTH_FORMATS:
+            raise ValueError(f'config err: "length_bytes" of socket must be one of {tuple(_LENGTH_FORMATS)}')
+        self.byteorder = conf.get('byteorder', 'big')
+        if self.byteorder not in ('big', 'little'):
+            raise ValueError('config err: "byteorder" of socket must be big or little')
+        # the length counts the prefix too
+        self.length_includes_header = conf.get('length_includes_header', False)
+        if type(self.length_includes_header) != bool:
+            raise ValueError('config err: "length_includes_header" of socket must be boolean type')
+        delimiter = conf.get('delimiter', '\n')
+        if not isinstance(delimiter, str) or len(delimiter) == 0:
+            raise ValueError('config err: "delimiter" of socket must be a none empty string')
+        self.delimiter = delimiter.encode()
+        # the payload of the request, None sends the records of the data_feeder
+        if 'message' in conf and 'message_hex' in conf:
+            raise ValueError('config err: socket need only one of "message" or "message_hex"')
+        try:
+            self.message: Optional[bytes] = bytes.fromhex(conf['message_hex']) if 'message_hex' in conf \
+                else conf['message'].encode() if 'message' in conf else None
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(f'config err: bad "message" of socket: {e}') from e
+        self.max_frame = conf.get('max_frame', 1 << 20)
+        if not isinstance(self.max_frame, int) or self.max_frame < 1:
+            raise ValueError('config err: "max_frame" of socket need >= 1')
+        # the initial size of the receive buffer of a connection, it grows up to the max_frame
+        self.buffer_size = conf.get('buffer_size', 4096)
+        if not isinstance(self.buffer_size, int) or self.buffer_size < 16:
+            raise ValueError('config err: "buffer_size" of socket need >= 16')
+        self.timeout = conf.get('timeout', 5.0)
+        if type(self.timeout) not in (int, float) or self.timeout <= 0:
+            raise ValueError('config err: "timeout" of socket need > 0')
+        # fail a response which is not the payload sent
+        self.check_echo = conf.get('check_echo', False)
+        if type(self.check_echo) != bool:
+            raise ValueError('config err: "check_echo" of socket must be boolean type')
+        self.length_format = ('>' if self.byteorder == 'big' else '<') + _LENGTH_FORMATS[self.length_bytes]
+
+    def __str__(self):
+        framing = f'length:{self.length_bytes}/{self.byteorder}' if self.framing == 'length' \
+            else f'delimiter:{self.delimiter!r}'
+        return f'framing:{framing}, max_frame:{self.max_frame}, timeout:{self.timeout}, check_echo:{self.check_echo}'
+
+    @property
+    def overhead(self) -> int:
+        """
+        bytes a frame adds to its payload
+        """
+        return self.length_bytes if self.framing == 'length' else len(self.delimiter)
+
+    def encode_into(self, buf: bytearray, payload) -> memoryview:
+        """
+        write the frame of the payload into the start of buf
+
+        :return: the view of the frame in buf
+        """
+        n = len(payload)
+        if self.framing == 'length':
+            struct.pack_into(self.length_format, buf, 0, n + self.length_bytes if self.length_includes_header else n)
+            buf[self.length_bytes:self.length_bytes + n] = payload
+        else:
+            buf[:n] = payload
+            buf[n:n + len(self.delimiter)] = self.delimiter
+        return memoryview(buf)[:n + self.overhead]
+
+    def encode(self, payload) -> memoryview:
+        return self.encode_into(bytearray(len(payload) + self.overhead), payload)
+
+    def frame_length(self, buf, start: int) -> int:
+        """
+        :return: the payload length of the frame with the length prefix at start
+        """
+        n = struct.unpack_from(self.length_format, buf, start)[0]
+        return n - self.length_bytes if self.length_includes_header else n
+
+
+class _Waiting:
+    """
+    the response waiter of a connection, a client sends the next request after the response
+    """
+    def __init__(self):
+        self.waiter: Optional[asyncio.Future] = None
+        self.closed = False
+        self.transport: Optional[asyncio.BaseTransport] = None
+
+    def deliver(self, frame: memoryview) -> None:
+        waiter = self.waiter
+        # a frame without a request is dropped
+        if waiter is not None:
+            self.waiter = None
+            if not waiter.done():
+                waiter.set_result(frame)
+
+    def fail(self, exc: Exception) -> None:
+        waiter = self.waiter
+        if waiter is not None:
+            self.waiter = None
+            if not waiter.done():
+                waiter.set_exception(exc)
+
+    def close(self) -> None:
+        if not self.closed and self.transport is not None:
+            self.transport.close()
+
+
+class _StreamProtocol(_Waiting, asyncio.BufferedProtocol):
+    """
+    Frames of a tcp or unix stream, read straight into one reusable buffer.
+
+    The data between start and end is not parsed yet. The buffer is compacted when the socket is
+    read again, the frame delivered is a view of the buffer valid until the next request.
+    """
+    def __init__(self, conf: SocketConfig):
+        super().__init__()
+        self._conf = conf
+        self._buf = bytearray(conf.buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        # where the search for the delimiter goes on
+        self._scan = 0
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        self.fail(ConnectionError(f'connection lost: {exc}') if exc is not None
+                  else ConnectionResetError('connection closed by the server'))
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._start > 0:
+            n = self._end - self._start
+            if n > 0:
+                # same length, the buffer is not resized
+                self._buf[:n] = self._view[self._start:self._end]
+            self._scan -= self._start
+            self._start = 0
+            self._end = n
+        if self._end == len(self._buf):
+            size = min(len(self._buf) * 2, self._conf.max_frame + self._conf.overhead)
+            if size <= self._end:
+                self.__violate(f'frame larger than max_frame {self._conf.max_frame}')
+                return self._view
+            # the views delivered keep the old buffer alive
+            buf = bytearray(size)
+            buf[:self._end] = self._view[:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._end += nbytes
+        conf = self._conf
+        while self._start < self._end:
+            if conf.framing == 'length':
+                header = conf.length_bytes
+                if self._end - self._start < header:
+                    break
+                n = conf.frame_length(self._buf, self._start)
+                if n > conf.max_frame or n < 0:
+                    self.__violate(f'frame length {n} out of range')
+                    return
+                if self._end - self._start < header + n:
+                    break
+                frame = self._view[self._start + header:self._start + header + n]
+                self._start += header + n
+            else:
+                delimiter = conf.delimiter
+                i = self._buf.find(delimiter, max(self._scan, self._start), self._end)
+                if i < 0:
+                    # the delimiter may start in the bytes not received yet
+                    self._scan = max(self._end - len(delimiter) + 1, self._start)
+                    if self._end - self._start > conf.max_frame:
+                        self.__violate(f'no delimiter in max_frame {conf.max_frame} bytes')
+                    break
+                frame = self._view[self._start:i]
+                self._start = self._scan = i + len(delimiter)
+            self.deliver(frame)
+        if self._start == self._end:
+            self._start = self._end = self._scan = 0
+
+    def __violate(self, reason: str) -> None:
+        self._start = self._end = self._scan = 0
+        self.fail(ValueError(f'protocol err: {reason}'))
+        self.close()
+
+
+class _DatagramProtocol(_Waiting, asyncio.DatagramProtocol):
+    """
+    every datagram holds one frame
+    """
+    def __init__(self, conf: SocketConfig):
+        super().__init__()
+        self._conf = conf
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        self.fail(ConnectionError(f'connection lost: {exc}'))
+
+    def error_received(self, exc: Exception) -> None:
+        self.fail(exc)
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        conf = self._conf
+        view = memoryview(data)
+        if conf.framing == 'length':
+            if len(data) < conf.length_bytes or conf.frame_length(data, 0) != len(data) - conf.length_bytes:
+                self.fail(ValueError(f'protocol err: datagram of {len(data)} bytes with a bad length'))
+                return
+            self.deliver(view[conf.length_bytes:])
+        else:
+            n = len(conf.delimiter)
+            self.deliver(view[:-n] if data.endswith(conf.delimiter) else view)
+
+
+class SocketClient(ClientProtocol):
+    """
+    Client of a request response protocol over tcp, udp or unix sockets, one connection per user.
+
+    The host of the config picks the transport: tcp://host:port, udp://host:port or
+    unix:///path. The "socket" section of the custom config sets the framing::
+
+        socket:
+          framing: length         # or delimiter
+          length_bytes: 4         # 1, 2, 4 or 8
+          byteorder: big
+          length_includes_header: false
+          delimiter: "\\n"
+          message: hello          # or message_hex, without both the data_feeder records are sent
+          max_frame: 1048576
+          timeout: 5              # seconds to wait for a response, the connection is closed after
+          check_echo: false       # fail a response which is not the payload sent
+
+    The frame of the message is encoded once, other payloads are framed in a reused buffer. The
+    responses are read into a reused buffer too, execute sends the message and waits for its
+    response, override it to send others with request().
+    """
+    socket_conf: Optional[SocketConfig] = None
+
+    def __init__(self):
+        super().__init__()
+        self._scheme = 'tcp'
+        self._address: Union[str, Tuple[str, int]] = ''
+        self._protocol: Union[None, _StreamProtocol, _DatagramProtocol] = None
+        self._frame: Optional[memoryview] = None
+        self._payload: Optional[memoryview] = None
+        self._send_buf = bytearray()
+
+    @staticmethod
+    def global_init(custom_conf: Optional[dict] = None) -> None:
+        SocketClient.socket_conf = SocketConfig((custom_conf or {}).get('socket', {}))
+
+    def init_before_use(self, host: str) -> None:
+        self._scheme, self._address = parse_socket_address(host)
+        conf = SocketClient.socket_conf
+        if conf.message is not None:
+            self._frame = conf.encode(conf.message)
+            self._payload = self._frame[conf.length_bytes:] if conf.framing == 'length' \
+                else self._frame[:len(conf.message)]
+
+    async def __connect(self) -> Union[_StreamProtocol, _DatagramProtocol]:
+        conf = SocketClient.socket_conf
+        loop = asyncio.get_running_loop()
+        if self._scheme == 'tcp':
+            _, protocol = await loop.create_connection(lambda: _StreamProtocol(conf), *self._address)
+        elif self._scheme == 'unix':
+            _, protocol = await loop.create_unix_connection(lambda: _StreamProtocol(conf), self._address)
+        else:
+            _, protocol = await loop.create_datagram_endpoint(lambda: _DatagramProtocol(conf),
+                                                              remote_addr=self._address)
+        self._protocol = protocol
+        return protocol
+
+    def __frame(self, payload) -> memoryview:
+        conf = SocketClient.socket_conf
+        size = len(payload) + conf.overhead
+        if len(self._send_buf) < size:
+            self._send_buf = bytearray(max(size, len(self._send_buf) * 2))
+        return conf.encode_into(self._send_buf, payload)
+
+    async def send_frame(self, frame: memoryview) -> memoryview:
+        """
+        send an encoded frame and wait for the response
+
+        :return: the payload of the response, a view valid until the next request
+        """
+        protocol = self._protocol
+        if protocol is None or protocol.closed:
+            protocol = await self.__connect()
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        protocol.waiter = waiter
+        if self._scheme == 'udp':
+            protocol.transport.sendto(frame)
+        else:
+            protocol.transport.write(frame)
+        if frame.obj is self._send_buf and protocol.transport.get_write_buffer_size() > 0:
+            # the transport still holds the frame, the next request uses a new buffer
+            self._send_buf = bytearray(len(self._send_buf))
+        timer = loop.call_later(SocketClient.socket_conf.timeout, self.__expire, protocol, waiter)
+        try:
+            return await waiter
+        finally:
+            timer.cancel()
+
+    @staticmethod
+    def __expire(protocol: Union[_StreamProtocol, _DatagramProtocol], waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            waiter.set_exception(TimeoutError(f'no response in {SocketClient.socket_conf.timeout}s'))
+        # a late response would answer the next request
+        protocol.waiter = None
+        protocol.close()
+
+    async def request(self, payload) -> memoryview:
+        """
+        :param payload: bytes like object, framed in a reused buffer
+        """
+        return await self.send_frame(self.__frame(payload))
+
+    async def execute(self) -> Optional[bool]:
+        if self._frame is not None:
+            payload = self._payload
+            response = await self.send_frame(self._frame)
+        elif self._context.data_feeder is not None:
+            payload = self.next_data()
+            response = await self.request(payload)
+        else:
+            raise ValueError('config err: socket need "message", "message_hex" or a data_feeder')
+        if SocketClient.socket_conf.check_echo and response != payload:
+            self.report_fail('response is not the echo of the request', self.operation_name)
+            return True
+        return False
+
+    async def shutdown(self) -> None:
+        if self._protocol is not None:
+            self._protocol.close()
@@ -0,0 +1,158 @@
+import asyncio
+from typing import Optional, Union
+import uvloop
+from .helper import parse_address
+from .socket_client import parse_socket_address
+
+
+_HEADER_END = b'\r\n\r\n'
+_ECHO_BUFFER_SIZE = 65536
+
+
+class _StubProtocol(asyncio.Protocol):
+    """
+    answer every request with the same prebuilt response, pipelined requests are answered in order
+    """
+    def __init__(self, response: bytes, delay: float):
+        self._response = response
+        self._delay = delay
+        self._transport: Optional[asyncio.Transport] = None
+        self._buf = bytearray()
+        # bytes of the body of the current request still to skip
+        self._skip = 0
+        self._loop = asyncio.get_running_loop()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._transport = None
+
+    def data_received(self, data: bytes) -> None:
+        buf = self._buf
+        buf += data
+        while True:
+            if self._skip > 0:
+                n = min(self._skip, len(buf))
+                del buf[:n]
+                self._skip -= n
+                if self._skip > 0:
+                    return
+            end = buf.find(_HEADER_END)
+            if end < 0:
+                return
+            lower = bytes(buf[:end]).lower()
+            del buf[:end + 4]
+            pos = lower.find(b'content-length:')
+            if pos >= 0:
+                line_end = lower.find(b'\r\n', pos)
+                self._skip = int(lower[pos + 15:line_end if line_end >= 0 else None])
+            self.__reply(b'connection: close' in lower)
+
+    def __reply(self, close: bool) -> None:
+        if self._delay > 0:
+            self._loop.call_later(self._delay, self.__send, close)
+        else:
+            self.__send(close)
+
+    def __send(self, close: bool) -> None:
+        if self._transport is None:
+            return
+        self._transport.write(self._response)
+        if close:
+            self._transport.close()
+
+
+def build_response(body: bytes) -> bytes:
+    return b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body)
+
+
+async def start_stub_server(host: str, port: int, body: bytes = b'ok', delay: float = 0.0) -> asyncio.AbstractServer:
+    """
+    :param delay: seconds before every response is sent
+    """
+    response = build_response(body)
+    return await asyncio.get_running_loop().create_server(lambda: _StubProtocol(response, delay), host, port,
+                                                          reuse_address=True)
+
+
+def run_stub_server(listen: str, body: bytes = b'ok', delay: float = 0.0) -> None:
+    """
+    serve until interrupted, a local target to benchmark the HttpClient offline
+    """
+    async def serve():
+        server = await start_stub_server(*parse_address(listen), body, delay)
+        print(f'stub server listening on {listen}, delay {delay}s')
+        async with server:
+            await server.serve_forever()
+
+    uvloop.install()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+class _EchoProtocol(asyncio.BufferedProtocol):
+    """
+    send every byte of a tcp or unix stream back, whatever the framing is
+    """
+    def __init__(self):
+        self._transport: Optional[asyncio.Transport] = None
+        self._view = memoryview(bytearray(_ECHO_BUFFER_SIZE))
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._view
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._transport.write(self._view[:nbytes])
+        if self._transport.get_write_buffer_size() > 0:
+            # the transport still holds the data, read the next into a new buffer
+            self._view = memoryview(bytearray(_ECHO_BUFFER_SIZE))
+
+
+class _EchoDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self._transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._transport.sendto(data, addr)
+
+
+async def start_echo_server(listen: str) -> Union[asyncio.AbstractServer, asyncio.DatagramTransport]:
+    """
+    :param listen: tcp://host:port, udp://host:port or unix:///path
+    """
+    scheme, address = parse_socket_address(listen)
+    loop = asyncio.get_running_loop()
+    if scheme == 'tcp':
+        return await loop.create_server(_EchoProtocol, *address, reuse_address=True)
+    if scheme == 'unix':
+        return await loop.create_unix_server(_EchoProtocol, address)
+    transport, _ = await loop.create_datagram_endpoint(_EchoDatagramProtocol, local_addr=address)
+    return transport
+
+
+def run_echo_server(listen: str) -> None:
+    """
+    serve until interrupted, a local target to benchmark the SocketClient offline
+    """
+    async def serve():
+        server = await start_echo_server(listen)
+        print(f'echo server listening on {listen}')
+        try:
+            await asyncio.Event().wait()
+        finally:
+            server.close()
+
+    uvloop.install()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
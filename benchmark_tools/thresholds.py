@@ -0,0 +1,145 @@
+import math
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+from .histogram import LatencyHistogram
+from .timeseries import Window
+
+
+# percentiles in ms, error rate in percent
+METRICS = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99, 'p999': 0.999, 'error_rate': None, 'rps': None}
+
+
+class Threshold:
+    def __init__(self, conf: dict):
+        if not isinstance(conf, dict) or conf.get('metric') not in METRICS:
+            raise ValueError(f'config err: "metric" of a threshold must be one of {tuple(METRICS)}')
+        self.metric: str = conf['metric']
+        if ('max' in conf) == ('min' in conf):
+            raise ValueError(f'config err: threshold of {self.metric} need one of "max" or "min"')
+        self.is_max = 'max' in conf
+        self.limit = conf['max'] if self.is_max else conf['min']
+        if type(self.limit) not in (int, float):
+            raise ValueError(f'config err: limit of threshold {self.metric} must be a number')
+        # seconds of the sliding window the metric is measured over
+        self.window = conf.get('window', 10)
+        if type(self.window) not in (int, float) or self.window <= 0:
+            raise ValueError(f'config err: "window" of threshold {self.metric} need > 0')
+        # seconds after the start before the threshold is checked, None means after the ramp up
+        self.after: Optional[float] = conf.get('after')
+        if self.after is not None and (type(self.after) not in (int, float) or self.after < 0):
+            raise ValueError(f'config err: "after" of threshold {self.metric} need >= 0')
+        # stop the run on a breach, or only record it
+        self.abort = conf.get('abort', True)
+        if type(self.abort) != bool:
+            raise ValueError(f'config err: "abort" of threshold {self.metric} must be boolean type')
+
+    def __str__(self):
+        unit = {'error_rate': '%', 'rps': ''}.get(self.metric, ' ms')
+        return f"{self.metric} {'<' if self.is_max else '>'} {self.limit}{unit} over {self.window}s " \
+               f"after {self.after}s"
+
+    def __repr__(self):
+        return self.__str__()
+
+    def passed(self, value: float) -> bool:
+        return value < self.limit if self.is_max else value > self.limit
+
+
+def parse_thresholds(conf, ramp_time: float) -> List[Threshold]:
+    if not isinstance(conf, list) or len(conf) == 0:
+        raise ValueError('config err: "thresholds" must be a none empty list')
+    thresholds = [Threshold(c) for c in conf]
+    for t in thresholds:
+        if t.after is None:
+            t.after = ramp_time
+    return thresholds
+
+
+class Breach:
+    def __init__(self, threshold: Threshold, value: float, time: float, elapsed: float):
+        self.threshold = threshold
+        self.value = value
+        self.time = time
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return f'threshold "{self.threshold}" tripped at {datetime.fromtimestamp(self.time).strftime("%H:%M:%S")} ' \
+               f'({self.elapsed:.0f}s into the run) with {self.value:.2f}'
+
+    def to_dict(self) -> dict:
+        return {'threshold': str(self.threshold), 'value': self.value, 'time': self.time, 'elapsed': self.elapsed}
+
+
+class ThresholdMonitor:
+    """
+    Check the thresholds against the sliding windows of the completed report intervals.
+
+    Every threshold trips once, the first breach is kept. The histograms of the intervals in a
+    window are merged per window length, thresholds with the same window share the merge.
+    """
+    def __init__(self, thresholds: List[Threshold], origin: float, interval: float):
+        self._thresholds = thresholds
+        self._origin = origin
+        self._lengths = {t.window: max(math.ceil(t.window / interval), 1) for t in thresholds}
+        self._recent: Deque[Window] = deque(maxlen=max(self._lengths.values()))
+        self._breaches: List[Breach] = []
+        self._tripped = set()
+
+    @property
+    def breaches(self) -> List[Breach]:
+        return self._breaches
+
+    @property
+    def aborted(self) -> bool:
+        return any(b.threshold.abort for b in self._breaches)
+
+    def on_window(self, window: Window) -> List[Breach]:
+        """
+        :return: the new breaches of this window
+        """
+        self._recent.append(window)
+        end = window.start_time + window.duration
+        merged: Dict[int, tuple] = {}
+        ret = []
+        for i, t in enumerate(self._thresholds):
+            if i in self._tripped:
+                continue
+            length = self._lengths[t.window]
+            # a window is judged only when it is full and starts after the ramp
+            if len(self._recent) < length or self._recent[-length].start_time - self._origin < t.after:
+                continue
+            if length not in merged:
+                merged[length] = self.__merge(length)
+            value = self.__value(t.metric, *merged[length])
+            if not t.passed(value):
+                self._tripped.add(i)
+                breach = Breach(t, value, end, end - self._origin)
+                self._breaches.append(breach)
+                ret.append(breach)
+        return ret
+
+    def __merge(self, length: int) -> tuple:
+        h = LatencyHistogram()
+        fails = 0
+        duration = 0.0
+        for i in range(len(self._recent) - length, len(self._recent)):
+            w = self._recent[i]
+            h.merge(w.histogram)
+            fails += w.fail_count
+            duration += w.duration
+        return h, fails, duration
+
+    @staticmethod
+    def __value(metric: str, h: LatencyHistogram, fails: int, duration: float) -> float:
+        if metric == 'rps':
+            return h.count / max(duration, 0.001)
+        if metric == 'error_rate':
+            total = h.count + fails
+            return fails / total * 100 if total > 0 else 0.0
+        return h.percentile_us(METRICS[metric]) / 1000
+
+    def report(self) -> str:
+        if len(self._breaches) == 0:
+            return f'all {len(self._thresholds)} thresholds passed'
+        return '\n'.join(str(b) for b in self._breaches)
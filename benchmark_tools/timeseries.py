@@ -0,0 +1,245 @@
+from array import array
+from datetime import datetime
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+from .histogram import LatencyHistogram
+from .benchmark_context import RunResult
+
+
+WINDOW_PERCENTS = (0.5, 0.9, 0.99, 0.999)
+
+
+class Window:
+    """
+    results of all workers in one reporting interval
+    """
+    def __init__(self, index: int, start_time: float = 0.0):
+        self.index = index
+        self.histogram = LatencyHistogram()
+        self.fail_count = 0
+        self.dropped = 0
+        self.stage = 0
+        self.users: Dict[int, int] = {}
+        self.cpu: Dict[int, float] = {}
+        self.loop_lag: Dict[int, float] = {}
+        self.durations: List[float] = []
+        # the start of the interval on the timeline of the run, the late results moved in do not change it
+        self.start_time = start_time
+
+    def add(self, result: RunResult) -> None:
+        self.histogram.merge(result.success_results)
+        self.fail_count += sum(result.failed_reason.values()) if result.failed_reason else 0
+        self.dropped += result.dropped
+        self.stage = max(self.stage, result.stage)
+        self.users[result.worker_index] = result.now_user
+        self.cpu[result.worker_index] = result.cpu_percent
+        self.loop_lag[result.worker_index] = result.loop_lag_mean
+
+    @property
+    def duration(self) -> float:
+        return sum(self.durations) / len(self.durations) if len(self.durations) > 0 else 1.0
+
+
+class WindowAggregator:
+    """
+    Group the results of the workers by reporting interval.
+
+    A result belongs to the interval which its start time rounds to, a window is complete when
+    every worker reported it, or when a worker is already more than two intervals ahead. The finish
+    result of a worker joins the last interval it reported while that one is open, a window which
+    no worker reported, such as one with only the teardown tail, is dropped at the flush.
+    """
+    def __init__(self, num_of_worker: int, origin: float, interval: float):
+        self._num_of_worker = num_of_worker
+        self._origin = origin
+        self._interval = interval
+        self._windows: Dict[int, Window] = {}
+        self._reported: Dict[int, Set[int]] = {}
+        self._newest = -1
+        self._emitted = -1
+        # worker index -> the last interval the worker reported
+        self._last_index: Dict[int, int] = {}
+
+    def add(self, result: RunResult, report: bool = True) -> List[Window]:
+        """
+        :param report: False for the data which is sent beside the report of the interval, such as failures
+        :return: the windows completed by this result
+        """
+        index = max(int((result.start_time - self._origin) / self._interval + 0.5), 0)
+        if result.finish and self._last_index.get(result.worker_index, -1) in self._windows:
+            index = self._last_index[result.worker_index]
+        if index <= self._emitted:
+            # the window is already completed, the late data goes to the next one
+            index = self._emitted + 1
+        if index not in self._windows:
+            self._windows[index] = Window(index, self._origin + index * self._interval)
+            self._reported[index] = set()
+        window = self._windows[index]
+        window.add(result)
+        if report:
+            if not result.finish:
+                # the finish result only holds the tail of the teardown, its duration means nothing
+                window.durations.append(result.last_time - result.start_time)
+                self._reported[index].add(result.worker_index)
+                self._last_index[result.worker_index] = index
+                self._newest = max(self._newest, index)
+        ret = []
+        for i in sorted(self._windows.keys()):
+            if len(self._reported[i]) >= self._num_of_worker or i < self._newest - 2:
+                ret.append(self.__pop(i))
+            else:
+                break
+        return ret
+
+    def flush(self) -> List[Window]:
+        """
+        the open windows at the end of the run, those without a report only hold data already in the totals
+        """
+        reported = [i for i in sorted(self._windows.keys()) if len(self._reported[i]) > 0]
+        ret = [self.__pop(i) for i in reported]
+        self._windows.clear()
+        self._reported.clear()
+        return ret
+
+    def __pop(self, index: int) -> Window:
+        self._emitted = max(self._emitted, index)
+        del self._reported[index]
+        return self._windows.pop(index)
+
+
+class Phase:
+    """
+    results of the windows in one phase of the run
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.histogram = LatencyHistogram()
+        self.fail_count = 0
+        self.start_time = 0.0
+        self.end_time = 0.0
+
+    def add(self, window: Window) -> None:
+        self.histogram.merge(window.histogram)
+        self.fail_count += window.fail_count
+        if self.start_time == 0 or window.start_time < self.start_time:
+            self.start_time = window.start_time
+        self.end_time = max(self.end_time, window.start_time + window.duration)
+
+    @property
+    def run_time(self) -> float:
+        return max(self.end_time - self.start_time, 0.0)
+
+
+class PhaseSplitter:
+    """
+    Split the completed windows into the warmup, the steady state and the cooldown.
+
+    The warmup is the first seconds of the run. The end of the run is not known ahead, a run
+    can be stopped early, so the windows of the last cooldown seconds are held back and only
+    move to the steady state once a newer window is cooldown seconds later.
+    """
+    def __init__(self, origin: float, warmup: float, cooldown: float):
+        self._origin = origin
+        self._warmup_time = warmup
+        self._cooldown_time = cooldown
+        self._pending: Deque[Window] = deque()
+        self.warmup = Phase('warmup')
+        self.steady = Phase('steady')
+        self.cooldown = Phase('cooldown')
+
+    def add(self, window: Window) -> None:
+        if window.start_time - self._origin < self._warmup_time:
+            self.warmup.add(window)
+            return
+        self._pending.append(window)
+        while window.start_time - self._pending[0].start_time >= self._cooldown_time:
+            self.steady.add(self._pending.popleft())
+            if len(self._pending) == 0:
+                break
+
+    def finish(self) -> None:
+        while len(self._pending) > 0:
+            self.cooldown.add(self._pending.popleft())
+
+    @property
+    def phases(self) -> List[Phase]:
+        return [self.warmup, self.steady, self.cooldown]
+
+
+class TimeSeries:
+    """
+    Columnar in memory store of the per interval statistics, latencies in ms.
+    """
+    columns = ('time', 'stage', 'users', 'success', 'fail', 'dropped', 'rps', 'error_rate',
+               'p50', 'p90', 'p99', 'p999')
+
+    def __init__(self, interval: float = 1.0):
+        # a window shorter than most of the interval, such as the tail of the run, is partial
+        self._full_duration = interval * 0.9
+        self.time = array('d')
+        self.stage = array('l')
+        self.users = array('l')
+        self.success = array('q')
+        self.fail = array('q')
+        self.dropped = array('q')
+        self.rps = array('d')
+        self.error_rate = array('d')
+        self.p50 = array('d')
+        self.p90 = array('d')
+        self.p99 = array('d')
+        self.p999 = array('d')
+        # seconds the window covers, 0 when no worker reported a full interval in it, not exported
+        self.duration = array('d')
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, window: Window) -> int:
+        """
+        :return: the row index of the window
+        """
+        h = window.histogram
+        total = h.count + window.fail_count
+        self.time.append(window.start_time)
+        self.stage.append(window.stage)
+        self.users.append(sum(window.users.values()))
+        self.success.append(h.count)
+        self.fail.append(window.fail_count)
+        self.dropped.append(window.dropped)
+        self.rps.append(h.count / max(window.duration, 0.001))
+        self.duration.append(window.duration if len(window.durations) > 0 else 0.0)
+        self.error_rate.append(window.fail_count / total * 100 if total > 0 else 0.0)
+        for column, value in zip((self.p50, self.p90, self.p99, self.p999), h.percentiles_us(WINDOW_PERCENTS)):
+            column.append(value / 1000)
+        return len(self.time) - 1
+
+    def row(self, index: int) -> tuple:
+        return tuple(getattr(self, c)[index] for c in self.columns)
+
+    def rows(self, start: int = 0, end: Optional[int] = None):
+        for i in range(start, len(self) if end is None else end):
+            yield self.row(i)
+
+    @staticmethod
+    def header() -> str:
+        return f"{'time':>10}{'stage':>6}{'users':>8}{'rps':>10}{'error%':>8}" \
+               f"{'50%':>9}{'90%':>9}{'99%':>9}{'99.9%':>9}"
+
+    def format_row(self, index: int) -> str:
+        return f"{datetime.fromtimestamp(self.time[index]).strftime('%H:%M:%S'):>10}" \
+               f"{self.stage[index]:>6}{self.users[index]:>8}{self.rps[index]:>10.1f}" \
+               f"{self.error_rate[index]:>8.2f}{self.p50[index]:>9.1f}{self.p90[index]:>9.1f}" \
+               f"{self.p99[index]:>9.1f}{self.p999[index]:>9.1f}"
+
+    def peak(self, column: str) -> int:
+        """
+        the partial windows are skipped, a few requests in the short tail of the run would
+        make a bogus peak, unless every window is partial
+
+        :return: the row index with the max value of the column, -1 when empty
+        """
+        values = getattr(self, column)
+        if len(values) == 0:
+            return -1
+        rows = [i for i in range(len(values)) if self.duration[i] >= self._full_duration]
+        return max(rows or range(len(values)), key=values.__getitem__)
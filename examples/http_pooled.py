@@ -0,0 +1,19 @@
+import json
+from typing import Optional
+from benchmark_tools import HttpClient
+
+
+class OrderClient(HttpClient):
+    """
+    the users of a worker share the connection pool configured in the "http" section of custom_config
+    """
+    def init_before_use(self, host: str) -> None:
+        super().init_before_use(host)
+        # encoded once, only the body is added per request
+        self._create = self.template('POST', '/orders', {'Content-Type': 'application/json'})
+        self._body = json.dumps({'item': 42, 'count': 1}).encode()
+
+    async def execute(self) -> Optional[bool]:
+        response = await self.request(self._create.encode_body(self._body))
+        if response.status != 200:
+            raise ValueError(f'response with err http status code:{response.status}')
@@ -0,0 +1,21 @@
+import struct
+import random
+from typing import Optional
+from benchmark_tools import SocketClient
+
+
+class KvClient(SocketClient):
+    """
+    a get of a binary key value protocol, the framing is set in the "socket" section of custom_config
+    """
+    def init_before_use(self, host: str) -> None:
+        super().init_before_use(host)
+        # op code, key, reused for every request
+        self._payload = bytearray(9)
+
+    async def execute(self) -> Optional[bool]:
+        struct.pack_into('>BQ', self._payload, 0, 1, random.randrange(1 << 20))
+        response = await self.request(self._payload)
+        # the response is a view of the receive buffer, parsed before the next request
+        if len(response) == 0 or response[0] != 1:
+            raise ValueError(f'response with err status:{response[0] if len(response) > 0 else None}')
@@ -0,0 +1,27 @@
+import pytest
+from benchmark_tools.benchmark_conf import load_benchmark_config_from_file
+
+
+def _load(tmp_path, conf: str):
+    class_file = tmp_path / 'client.py'
+    class_file.write_text('')
+    conf_file = tmp_path / 'conf.yml'
+    conf_file.write_text(f'host: localhost\nusers: 2\nrun_time: 1\nworker: 2\n'
+                         f'benchmark_class_file: {class_file}\n{conf}')
+    return load_benchmark_config_from_file(str(conf_file))
+
+
+def test_agents_need_an_authkey(tmp_path):
+    with pytest.raises(ValueError, match='authkey'):
+        _load(tmp_path, 'agents: 1\n')
+    conf = _load(tmp_path, 'agents: 1\nauthkey: secret\n')
+    assert conf.authkey == 'secret'
+    assert conf.listen == '127.0.0.1:5557'
+    assert _load(tmp_path, '').authkey is None
+
+
+def test_dash_port(tmp_path):
+    assert _load(tmp_path, '').dash_port == 8050
+    assert _load(tmp_path, 'dash_port: 9050\n').dash_port == 9050
+    with pytest.raises(ValueError, match='dash_port'):
+        _load(tmp_path, 'dash_port: 70000\n')
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import List
+from benchmark_tools.benchmark_conf import load_benchmark_config_from_file
+from benchmark_tools.benchmark_context import RunResult
+from benchmark_tools.benchmark_tool import BenchmarkTool
+from benchmark_tools.client_protocol import ClientProtocol
+
+
+class _SleepClient(ClientProtocol):
+    delay = 0.01
+    hatched: List[float] = []
+    running = 0
+    # clients shut down while a request of theirs was running
+    shutdown_running = 0
+    shutdowns = 0
+    shutdown_delay = 0.0
+
+    def __init__(self):
+        super().__init__()
+        self._busy = False
+
+    def init_before_use(self, host: str) -> None:
+        _SleepClient.hatched.append(time.monotonic())
+
+    async def execute(self):
+        self._busy = True
+        _SleepClient.running += 1
+        try:
+            await asyncio.sleep(_SleepClient.delay)
+        finally:
+            _SleepClient.running -= 1
+            self._busy = False
+        return False
+
+    async def shutdown(self) -> None:
+        _SleepClient.shutdowns += 1
+        if self._busy:
+            _SleepClient.shutdown_running += 1
+        await asyncio.sleep(_SleepClient.shutdown_delay)
+
+
+def _run(tmp_path, conf: str, delay: float = 0.01, shutdown_delay: float = 0.0) -> List[RunResult]:
+    class_file = tmp_path / 'client.py'
+    class_file.write_text('')
+    conf_file = tmp_path / 'conf.yml'
+    conf_file.write_text(f'host: localhost\nworker: 1\nbenchmark_class_file: {class_file}\n{conf}')
+    _SleepClient.delay = delay
+    _SleepClient.hatched = []
+    _SleepClient.shutdown_running = 0
+    _SleepClient.shutdowns = 0
+    _SleepClient.shutdown_delay = shutdown_delay
+    results = []
+    tool = BenchmarkTool(0, load_benchmark_config_from_file(str(conf_file)), results.append,
+                         client_class=_SleepClient)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        tool.run()
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    return results
+
+
+def _success(results: List[RunResult]) -> int:
+    return sum(r.success_results.count for r in results if r.success_results is not None)
+
+
+def test_open_loop_keeps_the_arrival_rate(tmp_path):
+    results = _run(tmp_path, 'users: 5\nrun_time: 3\narrival_rate: 50\n')
+    # the timeline starts once the pool is hatched, the intervals after it have the full rate
+    counts = [r.success_results.count for r in results[1:3]]
+    assert all(48 <= c <= 52 for c in counts)
+    assert 99 <= sum(counts) <= 101
+    assert sum(r.dropped for r in results) == 0
+    # the latency is measured from the intended send, the lag of every send is recorded
+    assert sum(r.schedule_lag.count for r in results if r.schedule_lag is not None) == _success(results)
+    assert min(r.success_results.min_us for r in results if r.success_results.count > 0) >= 10000
+
+
+def test_open_loop_counts_the_missed_arrivals(tmp_path):
+    # one client busy for 0.1s takes every sixth send of 50 per second, the sends without a free client
+    # are dropped
+    results = _run(tmp_path, 'users: 1\nrun_time: 3\narrival_rate: 50\n', delay=0.1)
+    for r in results[1:3]:
+        assert 7 <= r.success_results.count <= 10
+        assert 48 <= r.success_results.count + r.dropped <= 52
+
+
+def test_teardown_shuts_every_client_down_once(tmp_path):
+    results = _run(tmp_path, 'users: 4\nrun_time: 1\n', shutdown_delay=0.05)
+    finish = results[-1]
+    assert finish.finish
+    assert _SleepClient.shutdowns == 4
+    assert finish.teardown_timeouts == 0
+    # the clients are shut down concurrently, not one after another
+    assert finish.teardown_time < 0.15
+
+
+def test_teardown_is_bounded_by_the_shutdown_timeout(tmp_path):
+    results = _run(tmp_path, 'users: 3\nrun_time: 1\nshutdown_timeout: 0.3\n', shutdown_delay=10.0)
+    finish = results[-1]
+    assert _SleepClient.shutdowns == 3
+    assert finish.teardown_timeouts == 3
+    assert 0.3 <= finish.teardown_time < 0.5
+
+
+def test_spawner_spreads_the_hatches_over_the_second(tmp_path):
+    _run(tmp_path, 'users: 10\nhatch_rate: 10\nrun_time: 2\n')
+    hatched = _SleepClient.hatched
+    assert len(hatched) == 10
+    gaps = [b - a for a, b in zip(hatched, hatched[1:])]
+    assert all(0.07 < gap < 0.13 for gap in gaps)
+
+
+def test_closed_loop_ramp_down(tmp_path):
+    results = _run(tmp_path, 'stages:\n  - {duration: 1, users: 6}\n  - {duration: 2, users: 2}\n', delay=0.05)
+    assert [r.now_user for r in results[:3]] == [6, 2, 2]
+    # the stopped users finish their request before the shutdown
+    assert _SleepClient.shutdowns == 6
+    assert _SleepClient.shutdown_running == 0
+
+
+def test_open_loop_ramp_down_stops_idle_clients_only(tmp_path):
+    results = _run(tmp_path, 'stages:\n  - {duration: 1, users: 6, arrival_rate: 40}\n  - {duration: 2, users: 2}\n',
+                   delay=0.1)
+    assert results[-2].now_user == 2
+    assert _SleepClient.shutdowns == 6
+    assert _SleepClient.shutdown_running == 0
+    # the smaller pool can not keep the rate, the sends are dropped instead of cutting the running requests
+    assert results[-2].dropped > 0
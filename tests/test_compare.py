@@ -0,0 +1,82 @@
+import math
+from benchmark_tools.compare import RunData, compare_runs, mann_whitney, t_sf, two_proportion, welch
+from benchmark_tools.export import TOTAL
+from benchmark_tools.histogram import LatencyHistogram
+
+
+def _histogram(values) -> LatencyHistogram:
+    h = LatencyHistogram()
+    for v in values:
+        h.record_us(v)
+    return h
+
+
+def test_t_sf():
+    assert t_sf(0, 5) == 0.5
+    assert t_sf(0, 0) == 0.5
+    assert abs(t_sf(1e-12, 5) - 0.5) < 1e-6
+    # 95% quantiles of the t distribution
+    assert abs(t_sf(2.015, 5) - 0.05) < 1e-4
+    assert abs(t_sf(1.96, 100000) - 0.025) < 1e-4
+    assert abs(t_sf(-2.015, 5) - 0.95) < 1e-4
+    assert 0 <= t_sf(1e8, 3) < 1e-20
+
+
+def test_welch():
+    assert welch([1, 2, 3], [1, 2, 3]) == 0.5
+    assert welch([100, 101, 99, 100], [80, 81, 79, 80]) < 0.001
+    assert welch([80, 81, 79, 80], [100, 101, 99, 100]) > 0.999
+    assert welch([1], [1, 2]) == 1.0
+
+
+def test_welch_zero_variance():
+    assert welch([5, 5, 5], [5, 5, 5]) == 1.0
+    assert welch([5, 5, 5], [1, 1, 1]) == 0.0
+    assert welch([1, 1, 1], [5, 5, 5]) == 1.0
+    # only one side has a variance
+    p = welch([5, 5, 5], [1, 2, 3])
+    assert 0 < p < 0.05
+
+
+def test_mann_whitney():
+    h = _histogram(range(1000, 2000))
+    prob, p = mann_whitney(h, h)
+    assert prob == 0.5
+    assert p > 0.4
+    prob, p = mann_whitney(h, _histogram(range(1500, 2500)))
+    assert prob > 0.5
+    assert p < 1e-6
+    _, p = mann_whitney(_histogram(range(1500, 2500)), h)
+    assert p > 0.999
+    # every value in one bucket
+    _, p = mann_whitney(_histogram([1000] * 10), _histogram([1000] * 10))
+    assert p == 1.0
+    assert mann_whitney(LatencyHistogram(), h) == (0.5, 1.0)
+
+
+def test_two_proportion():
+    assert two_proportion(10, 100, 10, 100) == 0.5
+    assert two_proportion(0, 0, 10, 100) == 1.0
+    # no failure or only failures on both sides
+    assert two_proportion(0, 100, 0, 100) == 1.0
+    assert two_proportion(100, 100, 100, 100) == 1.0
+    assert two_proportion(10, 1000, 100, 1000) < 1e-6
+    assert two_proportion(100, 1000, 10, 1000) > 0.999
+
+
+def test_compare_identical_runs():
+    h = _histogram(range(1000, 3000))
+    run = RunData({TOTAL: h}, {TOTAL: 5}, [100.0, 100.0, 100.0])
+    rows = compare_runs(run, run)
+    assert [r.metric for r in rows] == ['rps', 'p50 ms', 'p99 ms', 'error %']
+    assert not any(r.regressed for r in rows)
+    assert all(not math.isnan(r.p_value) for r in rows)
+    assert all(r.change == 0 for r in rows)
+
+
+def test_compare_regressed_run():
+    baseline = RunData({TOTAL: _histogram(range(1000, 3000))}, {TOTAL: 0}, [100.0, 101.0, 99.0, 100.0])
+    current = RunData({TOTAL: _histogram(range(2000, 4000))}, {TOTAL: 200}, [80.0, 81.0, 79.0, 80.0])
+    rows = {r.metric: r for r in compare_runs(baseline, current)}
+    assert all(r.regressed for r in rows.values())
+    assert rows['error %'].change == math.inf
@@ -0,0 +1,102 @@
+import os
+import struct
+import pytest
+from benchmark_tools.data_feeder import DataFeeder, DataFeederConfig, build_index, index_path
+
+
+def _feeder(path, fmt: str = 'lines', order: str = 'sequential', worker: int = 0, workers: int = 1,
+            partitions: int = 1) -> DataFeeder:
+    conf = DataFeederConfig({'file': str(path), 'format': fmt, 'order': order})
+    conf.workers = workers
+    conf.partitions = partitions
+    return DataFeeder(conf, worker)
+
+
+def _records(feeder: DataFeeder) -> list:
+    return [bytes(feeder.record(i)) for i in range(len(feeder))]
+
+
+def test_lines_index(tmp_path):
+    data = tmp_path / 'data.txt'
+    data.write_bytes(b'a\n\nbcd\nlast')
+    feeder = _feeder(data)
+    # the empty line is a record, the last line has no trailing newline
+    assert _records(feeder) == [b'a', b'', b'bcd', b'last']
+    feeder.close()
+    data.write_bytes(b'a\nb\n')
+    feeder = _feeder(data)
+    assert _records(feeder) == [b'a', b'b']
+    feeder.close()
+
+
+def test_length_prefixed_index(tmp_path):
+    data = tmp_path / 'data.bin'
+    records = [b'\x00\n\x01', b'', b'x' * 300]
+    data.write_bytes(b''.join(struct.pack('>I', len(r)) + r for r in records))
+    feeder = _feeder(data, 'length_prefixed')
+    assert _records(feeder) == records
+    feeder.close()
+
+
+def test_truncated_record(tmp_path):
+    data = tmp_path / 'data.bin'
+    data.write_bytes(struct.pack('>I', 10) + b'short')
+    with pytest.raises(ValueError, match='truncated record'):
+        build_index(str(data), 'length_prefixed')
+
+
+def test_empty_file(tmp_path):
+    data = tmp_path / 'data.txt'
+    data.write_bytes(b'')
+    with pytest.raises(ValueError, match='no record'):
+        _feeder(data)
+
+
+def test_index_is_cached_until_the_file_changes(tmp_path):
+    data = tmp_path / 'data.txt'
+    data.write_bytes(b'a\nb\n')
+    path = build_index(str(data), 'lines')
+    assert path == index_path(str(data))
+    # the index is replaced by a new file when it is rebuilt
+    inode = os.stat(path).st_ino
+    build_index(str(data), 'lines')
+    assert os.stat(path).st_ino == inode
+    # an index of another format is rebuilt
+    with pytest.raises(ValueError):
+        build_index(str(data), 'length_prefixed')
+    assert os.stat(path).st_ino == inode
+    data.write_bytes(b'a\nb\nc\n')
+    build_index(str(data), 'lines')
+    assert os.stat(path).st_ino != inode
+    feeder = _feeder(data)
+    assert _records(feeder) == [b'a', b'b', b'c']
+    feeder.close()
+
+
+def test_sequential_records_are_split_over_the_workers(tmp_path):
+    data = tmp_path / 'data.txt'
+    data.write_bytes(b''.join(b'%d\n' % i for i in range(5)))
+    feeders = [_feeder(data, worker=i, workers=2) for i in range(2)]
+    taken = [[int(bytes(f.next())) for _ in range(5)] for f in feeders]
+    assert taken == [[0, 2, 4, 1, 3], [1, 3, 0, 2, 4]]
+    for f in feeders:
+        f.close()
+
+
+def test_partition_order(tmp_path):
+    data = tmp_path / 'data.txt'
+    data.write_bytes(b''.join(b'%d\n' % i for i in range(8)))
+    # 4 users on 2 workers, every user walks its own two records and starts over
+    feeders = [_feeder(data, 'lines', 'partition', worker=i, workers=2, partitions=4) for i in range(2)]
+    taken = {(w, u): [int(bytes(f.next(u))) for _ in range(3)] for w, f in enumerate(feeders) for u in range(2)}
+    assert taken == {(0, 0): [0, 1, 0], (1, 0): [2, 3, 2], (0, 1): [4, 5, 4], (1, 1): [6, 7, 6]}
+    for f in feeders:
+        f.close()
+
+
+def test_random_order(tmp_path):
+    data = tmp_path / 'data.txt'
+    data.write_bytes(b'a\nb\nc\n')
+    feeder = _feeder(data, order='random')
+    assert {bytes(feeder.next()) for _ in range(100)} == {b'a', b'b', b'c'}
+    feeder.close()
@@ -0,0 +1,134 @@
+import csv
+import json
+import sqlite3
+import pytest
+from benchmark_tools import export
+from benchmark_tools.benchmark_context import FinalResult, RunResult
+from benchmark_tools.compare import RunData
+from benchmark_tools.export import TOTAL, ExportConfig, RunExporter
+from benchmark_tools.histogram import LatencyHistogram
+from benchmark_tools.timeseries import TimeSeries, Window
+
+
+def _result(values, fails: int = 0) -> FinalResult:
+    r = RunResult()
+    r.worker_index = 0
+    r.success_results = LatencyHistogram()
+    for v in values:
+        r.success_results.record_us(v)
+    r.failed_reason = {'HTTP 500': fails} if fails else {}
+    r.operations = {0: r.success_results.copy()}
+    r.operation_fails = {0: fails} if fails else {}
+    r.new_operations = {0: 'login'}
+    r.start_time = 100.0
+    r.last_time = 101.0
+    fr = FinalResult(1)
+    fr.update(r)
+    return fr
+
+
+def _series(n: int) -> TimeSeries:
+    ts = TimeSeries()
+    for i in range(n):
+        w = Window(i, 100.0 + i)
+        w.histogram.record_us(1000 * (i + 1))
+        w.durations.append(1.0)
+        ts.append(w)
+    return ts
+
+
+def _exporter(tmp_path, formats=('jsonl', 'csv')) -> RunExporter:
+    conf_file = tmp_path / 'conf.yml'
+    conf_file.write_text('host: localhost\n')
+    conf = ExportConfig({'dir': str(tmp_path / 'runs'), 'formats': list(formats),
+                         'history': str(tmp_path / 'history.sqlite')})
+    return RunExporter(conf, str(conf_file))
+
+
+def _jsonl(exporter: RunExporter) -> list:
+    with open(f'{exporter.run_dir}/run.jsonl') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_export_config():
+    conf = ExportConfig({'dir': 'out'})
+    assert conf.formats == ['jsonl', 'csv']
+    assert conf.history.endswith('history.sqlite')
+    assert ExportConfig({'history': None}).history is None
+    with pytest.raises(ValueError, match='config err'):
+        ExportConfig({'formats': ['xml']})
+
+
+def test_intervals_are_written_as_they_come(tmp_path):
+    exporter = _exporter(tmp_path)
+    ts = _series(2)
+    exporter.on_interval(ts, 0)
+    # flushed at once, readable while the run goes on
+    records = _jsonl(exporter)
+    assert [r['type'] for r in records] == ['config', 'interval']
+    assert records[0]['config'] == 'host: localhost\n'
+    assert records[1]['p50'] == ts.p50[0]
+    exporter.on_interval(ts, 1)
+    with open(f'{exporter.run_dir}/intervals.csv', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(TimeSeries.columns)
+    assert [float(r[0]) for r in rows[1:]] == [100.0, 101.0]
+    db = sqlite3.connect(str(tmp_path / 'history.sqlite'))
+    assert db.execute('SELECT status FROM runs WHERE run_id = ?', (exporter.run_id,)).fetchone() == ('running',)
+    assert db.execute('SELECT time FROM intervals ORDER BY time').fetchall() == [(100.0,), (101.0,)]
+    db.close()
+    exporter.close()
+
+
+def test_checkpoint_and_summary(tmp_path):
+    exporter = _exporter(tmp_path)
+    fr = _result([1000, 2000, 3000], fails=2)
+    exporter.checkpoint(fr)
+    exporter.finish(fr, {'rps': 3.0})
+    exporter.close()
+    records = _jsonl(exporter)
+    assert [r['type'] for r in records] == ['config', 'checkpoint', 'checkpoint', 'summary']
+    assert records[-1]['status'] == 'finished'
+    assert records[-1]['summary'] == {'rps': 3.0}
+    checkpoint = records[-2]
+    assert checkpoint['fails'] == {'login': 2, TOTAL: 2}
+    assert checkpoint['failed_reasons'] == {'HTTP 500': 2}
+    assert export.decode_histogram(checkpoint['histograms']['login']).count == 3
+    db = sqlite3.connect(str(tmp_path / 'history.sqlite'))
+    assert db.execute('SELECT status, summary FROM runs').fetchone() == ('finished', '{"rps": 3.0}')
+    rows = db.execute('SELECT name, fail, data FROM histograms ORDER BY name').fetchall()
+    assert [(name, fail) for name, fail, _ in rows] == [(TOTAL, 2), ('login', 2)]
+    assert LatencyHistogram.from_bytes(rows[0][2]).total_us == 6000
+    assert db.execute('SELECT reason, count FROM failures').fetchall() == [('HTTP 500', 2)]
+    db.close()
+
+
+def test_baseline_is_loaded_from_the_last_checkpoint(tmp_path):
+    exporter = _exporter(tmp_path, ['jsonl'])
+    ts = _series(4)
+    for i in range(4):
+        exporter.on_interval(ts, i)
+        exporter.checkpoint(_result([1000] * (i + 1)))
+    # a run which crashed after its last checkpoint
+    exporter.close()
+    run = RunData.load(exporter.run_dir)
+    assert run.histograms[TOTAL].count == 4
+    assert run.histograms['login'].count == 4
+    assert run.fails == {TOTAL: 0}
+    # the first and the last interval are not steady
+    assert run.interval_rps == [ts.rps[1], ts.rps[2]]
+
+
+def test_baseline_without_a_checkpoint(tmp_path):
+    exporter = _exporter(tmp_path, ['jsonl'])
+    exporter.close()
+    with pytest.raises(ValueError, match='no histogram checkpoint'):
+        RunData.load(exporter.run_dir)
+
+
+def test_checkpoint_interval(tmp_path, monkeypatch):
+    exporter = _exporter(tmp_path, [])
+    assert not exporter.need_checkpoint()
+    monkeypatch.setattr(export, 'CHECKPOINT_INTERVAL', 0.0)
+    assert exporter.need_checkpoint()
+    exporter.close()
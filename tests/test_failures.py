@@ -0,0 +1,46 @@
+from benchmark_tools.failures import FailureClassifier, FailureConfig, OTHER, is_status_category, merge_failures
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f'{status} for {url}')
+        self.status = status
+
+
+def test_examples_are_distinct():
+    classifier = FailureClassifier(FailureConfig({'examples': 2}))
+    assert classifier.need_example('timeout', 'timeout to 10.0.0.1')
+    assert not classifier.need_example('timeout', 'timeout to 10.0.0.1')
+    assert classifier.need_example('timeout', 'timeout to 10.0.0.2')
+    assert not classifier.need_example('timeout', 'timeout to 10.0.0.3')
+
+
+def test_merge_keeps_distinct_examples():
+    conf = FailureConfig({'examples': 3})
+    counts, examples = {}, {}
+    merge_failures(counts, examples, {'boom <n>': 2}, {'boom <n>': ['boom 1', 'boom 2']}, conf)
+    merge_failures(counts, examples, {'boom <n>': 3}, {'boom <n>': ['boom 1', 'boom 2', 'boom 3', 'boom 4']}, conf)
+    assert counts == {'boom <n>': 5}
+    assert examples == {'boom <n>': ['boom 1', 'boom 2', 'boom 3']}
+
+
+def test_status_categories_have_their_own_bound():
+    classifier = FailureClassifier(FailureConfig({'max_categories': 2}))
+    assert classifier.classify('a') == 'a'
+    assert classifier.classify('b') == 'b'
+    assert classifier.classify('c') == OTHER
+    category, message = classifier.classify_exception(_HttpError(503, 'http://127.0.0.1/x'))
+    assert category == '_HttpError: HTTP 503'
+    assert message == '_HttpError: 503 for http://127.0.0.1/x'
+    assert is_status_category(category)
+    assert not is_status_category(classifier.classify('HTTP 500'))
+    assert classifier.classify_exception(_HttpError(500, '/'))[0] == '_HttpError: HTTP 500'
+    assert classifier.classify_exception(_HttpError(502, '/'))[0] == OTHER
+
+
+def test_merge_status_categories_have_their_own_bound():
+    conf = FailureConfig({'max_categories': 1})
+    counts, examples = {}, {}
+    merge_failures(counts, examples, {'_default': 1, OTHER: 1, 'a': 1, 'b': 1}, None, conf)
+    merge_failures(counts, examples, {'E: HTTP 500': 1, 'E: HTTP 503': 1}, None, conf)
+    assert counts == {'_default': 1, OTHER: 3, 'a': 1, 'E: HTTP 500': 1}
@@ -0,0 +1,72 @@
+from benchmark_tools.benchmark_context import FinalResult, RunResult
+from benchmark_tools.benchmark_result import BenchmarkResult
+from benchmark_tools.histogram import LatencyHistogram
+
+
+def _result(worker: int, values, fails: int = 0, start: float = 100.0, users: int = 5) -> RunResult:
+    r = RunResult()
+    r.worker_index = worker
+    r.now_user = users
+    r.success_results = LatencyHistogram()
+    for v in values:
+        r.success_results.record_us(v)
+    r.failed_reason = {'boom': fails} if fails else {}
+    r.start_time = start
+    r.last_time = start + 1
+    return r
+
+
+def test_running_aggregates():
+    fr = FinalResult(2)
+    fr.update(_result(0, [1000, 2000], fails=1, users=3))
+    fr.update(_result(1, [3000], start=100.5, users=4))
+    fr.update(_result(0, [4000], fails=2, start=101.0, users=6))
+    assert fr.users == 10
+    assert fr.success_results.count == 4
+    assert fr.success_results.total_us == 10000
+    assert fr.fail_count == 3
+    assert fr.failed_reasons == {'boom': 3}
+    assert (fr.first_time, fr.last_time) == (100.0, 102.0)
+
+
+def test_snapshot_is_independent():
+    fr = FinalResult(1)
+    fr.update(_result(0, [1000], fails=1))
+    snapshot = fr.snapshot()
+    fr.update(_result(0, [2000, 3000], fails=1, start=101.0, users=8))
+    assert (snapshot.success_results.count, snapshot.fail_count, snapshot.users) == (1, 1, 5)
+    assert snapshot.failed_reasons == {'boom': 1}
+    assert snapshot.last_time == 101.0
+    assert (fr.success_results.count, fr.fail_count, fr.users) == (3, 2, 8)
+
+
+def test_snapshot_does_not_grow_with_the_run():
+    fr = FinalResult(1)
+    for i in range(1000):
+        fr.update(_result(0, [1000 + i], start=100.0 + i))
+    snapshot = fr.snapshot()
+    # the aggregates are histograms and counters, no list of the intervals is kept
+    assert snapshot.success_results.count == 1000
+    assert not any(isinstance(v, list) and len(v) > 1 for v in vars(snapshot).values())
+
+
+def test_report_of_a_snapshot():
+    fr = FinalResult(1)
+    fr.update(_result(0, [1000] * 9 + [9000], fails=10))
+    snapshot = fr.snapshot()
+    snapshot.run_time = 2.0
+    r = BenchmarkResult.generate_benchmark_result(snapshot).to_dict()
+    assert r['success_count'] == 10
+    assert r['rps'] == 5.0
+    assert r['accuracy'] == 50.0
+
+
+def test_report_of_a_run_shorter_than_an_interval():
+    fr = FinalResult(1)
+    r = _result(0, [1000])
+    r.operations = {0: r.success_results.copy()}
+    r.new_operations = {0: 'login'}
+    fr.update(r)
+    fr.run_time = 0
+    result = BenchmarkResult.generate_benchmark_result(fr)
+    assert 'login' in result.operation_table()
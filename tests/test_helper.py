@@ -0,0 +1,20 @@
+import pytest
+from benchmark_tools import ClientProtocol
+from benchmark_tools.helper import check_client_class
+
+
+class _Execute(ClientProtocol):
+    async def execute(self):
+        pass
+
+
+class _Replay(_Execute):
+    async def replay(self, record):
+        pass
+
+
+def test_replay_needs_an_implementation():
+    check_client_class(_Execute, False)
+    check_client_class(_Replay, True)
+    with pytest.raises(ValueError, match='_Execute to implement'):
+        check_client_class(_Execute, True)
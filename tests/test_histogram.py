@@ -0,0 +1,83 @@
+import pickle
+import random
+from benchmark_tools.histogram import LatencyHistogram, value_to_index, index_to_value, BUCKET_COUNT, \
+    SUB_BUCKET_HALF, MAX_VALUE
+
+
+def _random_histogram(seed: int, n: int = 2000) -> LatencyHistogram:
+    rnd = random.Random(seed)
+    h = LatencyHistogram()
+    for _ in range(n):
+        h.record_us(int(rnd.lognormvariate(7, 1.5)))
+    return h
+
+
+def test_bucket_relative_error():
+    for value in (0, 1, 255, 256, 1000, 123456, 10 ** 9, MAX_VALUE):
+        index = value_to_index(value)
+        assert 0 <= index < BUCKET_COUNT
+        assert abs(index_to_value(index) - value) <= value / SUB_BUCKET_HALF
+    assert value_to_index(MAX_VALUE * 4) == value_to_index(MAX_VALUE)
+
+
+def test_summary_and_percentiles():
+    h = LatencyHistogram()
+    for v in range(1, 101):
+        h.record_us(v)
+    assert (h.count, h.total_us, h.min_us, h.max_us) == (100, 5050, 1, 100)
+    assert h.percentiles_us([0.5, 0.99, 1.0]) == [50, 99, 100]
+    h.record_ns(1499)
+    h.record(0.0000026)
+    assert h.min_us == 1
+    assert h.percentile_us(0.0) == 1
+    assert LatencyHistogram().percentiles_us([0.5]) == [0]
+
+
+def test_bytes_roundtrip():
+    h = _random_histogram(1)
+    r = LatencyHistogram.from_bytes(h.to_bytes())
+    assert (r.count, r.total_us, r.min_us, r.max_us) == (h.count, h.total_us, h.min_us, h.max_us)
+    assert list(r.raw_counts) == list(h.raw_counts)
+    empty = LatencyHistogram.from_bytes(LatencyHistogram().to_bytes())
+    assert empty.count == 0
+
+
+def test_pickle_roundtrip_merges_like_the_original():
+    a, b = _random_histogram(2), _random_histogram(3)
+    unpickled = pickle.loads(pickle.dumps(b))
+    assert list(unpickled.raw_counts) == list(b.raw_counts)
+    merged = a.copy()
+    merged.merge(unpickled)
+    expected = a.copy()
+    expected.merge(b)
+    assert list(merged.raw_counts) == list(expected.raw_counts)
+
+
+def test_merge_equals_recording_all():
+    a, b = _random_histogram(4), _random_histogram(5)
+    merged = a.copy()
+    merged.merge(b)
+    merged.merge(LatencyHistogram())
+    assert merged.count == a.count + b.count
+    assert merged.total_us == a.total_us + b.total_us
+    assert merged.min_us == min(a.min_us, b.min_us)
+    assert merged.max_us == max(a.max_us, b.max_us)
+    assert [x + y for x, y in zip(a.raw_counts, b.raw_counts)] == list(merged.raw_counts)
+    # merging into an empty histogram takes the min and max of the other
+    empty = LatencyHistogram()
+    empty.merge(b)
+    assert (empty.min_us, empty.max_us) == (b.min_us, b.max_us)
+
+
+def test_diff_is_the_values_since_the_copy():
+    h = _random_histogram(6)
+    earlier = h.copy()
+    for v in (300, 5000, 70000):
+        h.record_us(v)
+    d = h.diff(earlier)
+    assert d.count == 3
+    assert d.total_us == 75300
+    # min and max come from the buckets, within their relative error
+    assert abs(d.min_us - 300) <= 300 / SUB_BUCKET_HALF
+    assert abs(d.max_us - 70000) <= 70000 / SUB_BUCKET_HALF
+    assert h.diff(h.copy()).count == 0
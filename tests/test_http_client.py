@@ -0,0 +1,65 @@
+import asyncio
+from benchmark_tools.http_client import HttpClient, HttpPool, RequestTemplate, _Connection
+from benchmark_tools.stub_server import start_stub_server
+
+
+_PORT = 18781
+
+
+def test_pool_keeps_the_pipeline_depth(monkeypatch):
+    max_pending = []
+    send = _Connection.send
+
+    def checked_send(conn, data, waiter):
+        send(conn, data, waiter)
+        max_pending.append(conn.pending)
+
+    monkeypatch.setattr(_Connection, 'send', checked_send)
+
+    async def run():
+        server = await start_stub_server('127.0.0.1', _PORT, delay=0.005)
+        pool = HttpPool('127.0.0.1', _PORT, size=2, pipeline=3)
+        request = RequestTemplate('GET', '/', f'127.0.0.1:{_PORT}').encode()
+        try:
+            for _ in range(3):
+                responses = await asyncio.gather(*[pool.request(request) for _ in range(40)])
+                assert all(r.status == 200 for r in responses)
+            assert pool.connections == 2
+        finally:
+            pool.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+    assert len(max_pending) == 120
+    assert max(max_pending) == 3
+
+
+def test_last_client_closes_the_pool():
+    async def run():
+        server = await start_stub_server('127.0.0.1', _PORT + 1)
+        HttpClient.global_init({})
+        clients = [HttpClient(), HttpClient()]
+        for client in clients:
+            client.init_before_use(f'127.0.0.1:{_PORT + 1}')
+        pool = clients[0].pool
+        try:
+            assert clients[1].pool is pool
+            assert (await clients[0].request(clients[0].template('GET', '/').encode())).status == 200
+            await clients[0].shutdown()
+            assert pool.connections == 1
+            assert (await clients[1].request(clients[1].template('GET', '/').encode())).status == 200
+            await clients[1].shutdown()
+            await asyncio.sleep(0.05)
+            assert pool.connections == 0
+            # a new user after the last one left gets a new pool
+            client = HttpClient()
+            client.init_before_use(f'127.0.0.1:{_PORT + 1}')
+            assert client.pool is not pool
+            assert client.pool.users == 1
+            await client.shutdown()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
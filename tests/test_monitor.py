@@ -0,0 +1,27 @@
+import builtins
+import resource
+from benchmark_tools import monitor
+
+
+class _Usage:
+    ru_maxrss = 1000
+
+
+def test_peak_rss_units(monkeypatch):
+    monkeypatch.setattr(resource, 'getrusage', lambda who: _Usage())
+    monkeypatch.setattr(monitor.sys, 'platform', 'linux')
+    assert monitor.peak_rss_bytes() == 1000 * 1024
+    # macOS reports bytes
+    monkeypatch.setattr(monitor.sys, 'platform', 'darwin')
+    assert monitor.peak_rss_bytes() == 1000
+
+
+def test_rss_without_proc(monkeypatch):
+    def no_proc(file, *args, **kwargs):
+        raise FileNotFoundError(file)
+
+    assert monitor.rss_bytes() > 0
+    monkeypatch.setattr(resource, 'getrusage', lambda who: _Usage())
+    monkeypatch.setattr(monitor.sys, 'platform', 'darwin')
+    monkeypatch.setattr(builtins, 'open', no_proc)
+    assert monitor.rss_bytes() == 1000
@@ -0,0 +1,65 @@
+import json
+import threading
+import http.client
+from benchmark_tools.rps_dash import DashServer, DownsampledHistory
+
+
+def _point(i: int) -> dict:
+    return {'time': f't{i}', 'stage': 0, 'users': 1, 'rps': float(i), 'error_rate': 0.0, 'p50': 1.0,
+            'p90': 2.0, 'p99': float(i), 'p999': float(i), 'cpu': {'0': float(i)}, 'loop_lag': {'0': 0.1}}
+
+
+def test_history_stays_bounded():
+    history = DownsampledHistory(8)
+    halved = 0
+    for i in range(100):
+        _, h = history.append(_point(i))
+        halved += h
+    points = history.points
+    assert len(points) <= 8
+    assert halved == 4
+    # merged points start at the first of their intervals, average the rates and keep the worst latency
+    assert points[0]['time'] == 't0'
+    assert points[0]['rps'] == sum(range(16)) / 16
+    assert points[0]['p99'] == 15.0
+    assert points[0]['cpu'] == {'0': 15.0}
+
+
+def _read_event(response) -> tuple:
+    event, data = None, None
+    while True:
+        line = response.fp.readline().decode().rstrip('\n')
+        if line.startswith('event: '):
+            event = line[7:]
+        elif line.startswith('data: '):
+            data = json.loads(line[6:])
+        elif line == '' and event is not None:
+            return event, data
+
+
+def test_server_streams_the_history_and_the_new_points():
+    server = DashServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        server.publish(_point(1))
+        conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+        conn.request('GET', '/')
+        page = conn.getresponse()
+        assert page.status == 200
+        assert b'EventSource' in page.read()
+        conn.request('GET', '/events')
+        events = conn.getresponse()
+        assert events.getheader('Content-Type') == 'text/event-stream'
+        event, data = _read_event(events)
+        assert event == 'history'
+        assert [p['time'] for p in data] == ['t1']
+        server.publish(_point(2))
+        event, data = _read_event(events)
+        assert event == 'message'
+        assert (data['time'], data['stride']) == ('t2', 1)
+        conn.close()
+    finally:
+        server.stop()
+    thread.join(5)
+    assert not thread.is_alive()
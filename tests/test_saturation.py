@@ -0,0 +1,70 @@
+from benchmark_tools.benchmark_context import FinalResult, RunResult
+from benchmark_tools.histogram import LatencyHistogram
+from benchmark_tools.saturation import SaturationSearch, SearchConfig, split_load
+
+
+class _Target:
+    """
+    a server whose latency in ms is the load, failing above fail_above
+    """
+    def __init__(self, fail_above: float = 1e9):
+        self.fail_above = fail_above
+        self.loads = []
+        self._result = FinalResult(1)
+
+    def set_load(self, index: int, load: float) -> None:
+        self.loads.append(load)
+
+    def snapshot(self) -> FinalResult:
+        if len(self.loads) > 0:
+            load = self.loads[-1]
+            r = RunResult()
+            r.success_results = LatencyHistogram()
+            for _ in range(100):
+                r.success_results.record_us(int(load * 1000))
+            r.failed_reason = {'boom': 10} if load > self.fail_above else {}
+            self._result.update(r)
+        return self._result.snapshot()
+
+
+def _search(conf: dict, target: _Target) -> SaturationSearch:
+    conf = dict({'step_time': 0.01, 'settle_time': 0.0}, **conf)
+    search = SaturationSearch(SearchConfig(conf, None), target.set_load, target.snapshot, lambda: False)
+    search.run()
+    return search
+
+
+def test_step_search_stops_at_the_first_failed_step():
+    target = _Target()
+    search = _search({'start': 10, 'max': 100, 'step': 10, 'p99': 55}, target)
+    assert target.loads == [10, 20, 30, 40, 50, 60]
+    assert search.knee.load == 50
+    assert [s.passed for s in search.steps] == [True] * 5 + [False]
+    assert 'knee point: users 50' in search.report()
+
+
+def test_binary_search_narrows_to_the_precision():
+    target = _Target()
+    search = _search({'start': 10, 'max': 100, 'strategy': 'binary', 'precision': 4, 'p99': 55}, target)
+    assert target.loads[:3] == [10, 100, 55]
+    assert 51 <= search.knee.load <= 55
+    assert all(s.passed == (s.load <= search.knee.load) for s in search.steps)
+
+
+def test_search_by_error_rate():
+    target = _Target(fail_above=30)
+    search = _search({'start': 10, 'max': 100, 'step': 10, 'error_rate': 5}, target)
+    assert search.knee.load == 30
+    assert abs(search.steps[-1].error_rate - 100 * 10 / 110) < 1e-6
+
+
+def test_search_without_a_passing_load():
+    search = _search({'start': 10, 'max': 100, 'strategy': 'binary', 'p99': 5}, _Target())
+    assert search.knee is None
+    assert len(search.steps) == 1
+    assert 'knee point: not found' in search.report()
+
+
+def test_split_load():
+    assert split_load(10, 3, 'users') == [(4, None), (3, None), (3, None)]
+    assert split_load(90.0, 3, 'arrival_rate') == [(0, 30.0), (0, 30.0), (0, 30.0)]
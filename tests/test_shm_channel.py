@@ -0,0 +1,88 @@
+from benchmark_tools.benchmark_context import FinalResult, RunResult
+from benchmark_tools.histogram import LatencyHistogram, BUCKET_COUNT, index_to_value
+from benchmark_tools.shm_channel import ShmChannel, RING_SLOTS, OPERATIONS_SIZE
+
+
+def _histogram(*values) -> LatencyHistogram:
+    h = LatencyHistogram()
+    for v in values:
+        h.record_us(v)
+    return h
+
+
+def _result(index: int) -> RunResult:
+    r = RunResult()
+    r.worker_index = 1
+    r.now_user = 7
+    r.start_time = 1000.0 + index
+    r.last_time = 1001.0 + index
+    r.stage = 2
+    r.success_results = _histogram(100, 200, 300 + index)
+    r.schedule_lag = _histogram(5)
+    r.failed_reason = {}
+    return r
+
+
+def test_roundtrip_with_operations():
+    channel = ShmChannel(1)
+    try:
+        r = _result(0)
+        r.new_operations = {0: 'login', 1: 'pay'}
+        r.operations = {0: _histogram(1000, 2000), 1: _histogram(50000)}
+        r.timings = {0: _histogram(10)}
+        r.operation_fails = {1: 3}
+        assert channel.write(r)
+        r = _result(1)
+        assert channel.write(r)
+        first, second = channel.read()
+        assert (first.worker_index, first.now_user, first.stage, first.start_time) == (1, 7, 2, 1000.0)
+        assert list(first.success_results.raw_counts) == list(_histogram(100, 200, 300).raw_counts)
+        assert first.schedule_lag.count == 1
+        assert first.new_operations == {0: 'login', 1: 'pay'}
+        assert list(first.operations[0].raw_counts) == list(_histogram(1000, 2000).raw_counts)
+        assert first.operations[1].max_us == 50000
+        assert first.timings[0].count == 1
+        assert first.operation_fails == {1: 3}
+        assert second.operations is None and second.new_operations is None
+        assert channel.read() == []
+    finally:
+        channel.close()
+
+
+def test_ring_overrun_counts_lost_reports():
+    channel = ShmChannel(0)
+    try:
+        for i in range(RING_SLOTS + 3):
+            channel.write(_result(i))
+        assert len(channel.read()) == RING_SLOTS
+        assert channel.lost == 3
+    finally:
+        channel.close()
+
+
+def test_operations_over_the_area_are_not_written():
+    channel = ShmChannel(0)
+    try:
+        # every bucket used, about 3 bytes a bucket encoded
+        full = _histogram(*(index_to_value(i) for i in range(BUCKET_COUNT)))
+        r = _result(0)
+        count = OPERATIONS_SIZE // (BUCKET_COUNT * 2) + 1
+        r.new_operations = {i: f'op{i}' for i in range(count)}
+        r.operations = {i: full for i in range(count)}
+        assert not channel.write(r)
+        assert channel.read()[0].operations is None
+    finally:
+        channel.close()
+
+
+def test_final_result_waits_for_the_names():
+    fr = FinalResult(2)
+    later = _result(1)
+    later.operations = {0: _histogram(1000)}
+    fr.update(later)
+    assert fr.operations == {}
+    first = _result(0)
+    first.new_operations = {0: 'login'}
+    first.operations = {0: _histogram(2000)}
+    fr.update(first)
+    assert fr.operations['login'].count == 2
@@ -0,0 +1,45 @@
+from benchmark_tools.benchmark_context import FinalResult, RunResult
+from benchmark_tools.histogram import LatencyHistogram
+
+
+def _result(worker: int, stage: int, values, fails: int = 0, start: float = 100.0) -> RunResult:
+    r = RunResult()
+    r.worker_index = worker
+    r.stage = stage
+    r.now_user = 5
+    r.success_results = LatencyHistogram()
+    for v in values:
+        r.success_results.record_us(v)
+    r.failed_reason = {'_default': fails}
+    r.start_time = start
+    r.last_time = start + 1
+    return r
+
+
+def test_stage_summary_matches_the_interval_histograms():
+    fr = FinalResult(2)
+    fr.update(_result(0, 0, [100, 200, 300], fails=1))
+    fr.update(_result(1, 0, [150, 5000]))
+    fr.update(_result(0, 1, [7000], start=101.0))
+    stage = fr.stage_results[0]
+    expected = LatencyHistogram()
+    for v in (100, 200, 300, 150, 5000):
+        expected.record_us(v)
+    h = stage.histogram()
+    assert list(h.raw_counts) == list(expected.raw_counts)
+    assert (h.count, h.total_us, h.min_us, h.max_us) == (5, 5750, 100, 5000)
+    assert (stage.users, stage.fail_count, stage.first_time, stage.last_time) == (10, 1, 100.0, 101.0)
+    assert fr.stage_results[1].success_count == 1
+
+
+def test_snapshot_shares_stages_until_they_change():
+    fr = FinalResult(2)
+    fr.update(_result(0, 0, [100]))
+    fr.update(_result(0, 1, [200]))
+    snapshot = fr.snapshot()
+    assert snapshot.stage_results[0] is fr.stage_results[0]
+    # a late report of a stage copies it, the snapshot keeps its values
+    fr.update(_result(1, 0, [300]))
+    assert snapshot.stage_results[0].success_count == 1
+    assert fr.stage_results[0].success_count == 2
+    assert snapshot.stage_results[1] is fr.stage_results[1]
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from benchmark_tools import BenchmarkTools, IMPORT_START
+from tests.test_benchmark_tool import _run
+
+
+def test_dashboard_and_agent_are_not_imported():
+    code = 'import sys, benchmark_tools; print(sorted(m for m in sys.modules if m in ' \
+           '("benchmark_tools.rps_dash", "benchmark_tools.agent", "webbrowser")))'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == '[]'
+
+
+def test_worker_sends_its_startup_once(tmp_path):
+    results = _run(tmp_path, 'users: 2\nrun_time: 2\n')
+    startups = [r.startup for r in results if r.startup is not None]
+    # with the first report after the first request
+    assert len(startups) == 1
+    assert results.index(next(r for r in results if r.startup is not None)) == 0
+    phases = startups[0]
+    assert list(phases) == ['worker start', 'class load', 'global init', 'first request']
+    assert list(phases.values()) == sorted(phases.values())
+
+
+def test_startup_report():
+    tools = BenchmarkTools()
+    start = IMPORT_START + 1.0
+    tools._startup = {'run': start, 'load config': start + 0.01, 'preload class': start + 0.03,
+                      'fork workers': start + 0.04}
+    worker = {'worker start': start + 0.05, 'class load': start + 0.05, 'global init': start + 0.06,
+              'first request': start + 0.1}
+    tools._worker_startup = {0: worker, 1: dict(worker, **{'first request': start + 0.2})}
+    lines = tools.startup_report().split('\n')
+    rows = {line[:24].strip(): float(line[24:]) for line in lines[2:]}
+    assert round(rows['load config'], 1) == 10.0
+    assert round(rows['worker start'], 1) == 20.0
+    # the slowest worker
+    assert round(rows['worker first request'], 1) == 140.0
+    assert round(rows['time to first request'], 1) == 1100.0
@@ -0,0 +1,105 @@
+import queue
+import time
+import pytest
+from benchmark_tools import BenchmarkTools
+from benchmark_tools.thresholds import ThresholdMonitor, parse_thresholds
+from benchmark_tools.timeseries import Window
+
+
+ORIGIN = 1000.0
+
+
+def _window(index: int, latency_us: int = 1000, count: int = 100, fails: int = 0) -> Window:
+    w = Window(index, ORIGIN + index)
+    for _ in range(count):
+        w.histogram.record_us(latency_us)
+    w.fail_count = fails
+    w.durations.append(1.0)
+    return w
+
+
+def _monitor(conf: list, ramp_time: float = 0.0) -> ThresholdMonitor:
+    return ThresholdMonitor(parse_thresholds(conf, ramp_time), ORIGIN, 1.0)
+
+
+def test_parse_thresholds():
+    thresholds = parse_thresholds([{'metric': 'p99', 'max': 200}, {'metric': 'rps', 'min': 10, 'after': 5}], 30.0)
+    # the ramp time is the default grace period
+    assert [t.after for t in thresholds] == [30.0, 5]
+    assert thresholds[0].window == 10 and thresholds[0].abort
+    for conf in ([], [{'metric': 'p75', 'max': 1}], [{'metric': 'p99'}], [{'metric': 'p99', 'max': 1, 'min': 0}],
+                 [{'metric': 'p99', 'max': 1, 'window': 0}], [{'metric': 'p99', 'max': 1, 'after': -1}]):
+        with pytest.raises(ValueError, match='config err'):
+            parse_thresholds(conf, 0.0)
+
+
+def test_latency_breach_over_the_sliding_window():
+    monitor = _monitor([{'metric': 'p99', 'max': 50, 'window': 3}])
+    assert monitor.on_window(_window(0)) == []
+    # one slow interval of three is below the 99th percentile of the window
+    assert monitor.on_window(_window(1, 100000, count=1)) == []
+    assert monitor.on_window(_window(2)) == []
+    breaches = monitor.on_window(_window(3, 100000, count=10))
+    assert len(breaches) == 1
+    assert breaches[0].value >= 50
+    assert breaches[0].elapsed == 4.0
+    assert monitor.aborted
+
+
+def test_error_rate_and_rps():
+    monitor = _monitor([{'metric': 'error_rate', 'max': 5, 'window': 1},
+                        {'metric': 'rps', 'min': 50, 'window': 2, 'abort': False}])
+    assert monitor.on_window(_window(0, fails=1)) == []
+    breaches = monitor.on_window(_window(1, count=10, fails=10))
+    assert [b.threshold.metric for b in breaches] == ['error_rate', 'rps']
+    assert breaches[0].value == 50.0
+    # the rps of the two intervals
+    assert breaches[1].value == 55.0
+
+
+def test_grace_period():
+    monitor = _monitor([{'metric': 'p50', 'max': 5, 'window': 2}], ramp_time=3.0)
+    for i in range(4):
+        # the slow ramp is not judged, the window starting at 2s is still inside it
+        assert monitor.on_window(_window(i, 100000)) == []
+    assert len(monitor.on_window(_window(4, 100000))) == 1
+
+
+def test_trips_once_and_records_without_abort():
+    monitor = _monitor([{'metric': 'p50', 'max': 5, 'window': 1, 'abort': False}])
+    assert len(monitor.on_window(_window(0, 100000))) == 1
+    assert monitor.on_window(_window(1, 100000)) == []
+    assert len(monitor.breaches) == 1
+    assert not monitor.aborted
+    assert 'tripped' in monitor.report()
+    assert _monitor([{'metric': 'p50', 'max': 5}]).report() == 'all 1 thresholds passed'
+
+
+def test_abort_stops_the_workers_once():
+    tools = BenchmarkTools()
+    tools._threshold_monitor = _monitor([{'metric': 'p50', 'max': 5, 'window': 1},
+                                         {'metric': 'p99', 'max': 5, 'window': 1}])
+    tools._command_queues = [queue.Queue(), queue.Queue()]
+    check = tools._BenchmarkTools__check_thresholds
+    check(_window(0))
+    assert all(q.empty() for q in tools._command_queues)
+    check(_window(1, 10000, count=1))
+    check(_window(2, 10000, count=1))
+    assert [q.get_nowait() for q in tools._command_queues] == [('stop',), ('stop',)]
+    assert all(q.empty() for q in tools._command_queues)
+
+
+def test_breached_run_stops_early_and_exits_1(tmp_path):
+    client = tmp_path / 'client.py'
+    client.write_text('import asyncio\n'
+                      'from benchmark_tools import ClientProtocol\n\n\n'
+                      'class SlowClient(ClientProtocol):\n'
+                      '    async def execute(self):\n'
+                      '        await asyncio.sleep(0.02)\n'
+                      '        return False\n')
+    conf = tmp_path / 'conf.yml'
+    conf.write_text(f'host: localhost\nworker: 1\nusers: 2\nrun_time: 30\nbenchmark_class_file: {client}\n'
+                    f'thresholds:\n  - {{metric: p50, max: 5, window: 1, after: 0}}\n')
+    start = time.time()
+    assert BenchmarkTools().run(str(conf)) == 1
+    assert time.time() - start < 10
@@ -0,0 +1,111 @@
+from benchmark_tools.benchmark_context import FinalResult, RunResult
+from benchmark_tools.benchmark_result import BenchmarkResult
+from benchmark_tools.histogram import LatencyHistogram
+from benchmark_tools.timeseries import PhaseSplitter, TimeSeries, Window, WindowAggregator
+
+
+def _window(index: int, values, durations) -> Window:
+    w = Window(index)
+    w.start_time = 1000.0 + index
+    for v in values:
+        w.histogram.record_us(v)
+    w.durations = list(durations)
+    return w
+
+
+def test_peak_skips_partial_windows():
+    ts = TimeSeries(1.0)
+    ts.append(_window(0, [1000] * 50, [1.0, 0.999]))
+    ts.append(_window(1, [3000] * 80, [1.0, 1.0]))
+    # the tail of the run: a few slow requests in a short window, and the finish only window
+    ts.append(_window(2, [90000] * 3, [0.2]))
+    ts.append(_window(3, [80000] * 5, []))
+    assert ts.peak('p99') == 1
+    assert ts.peak('rps') == 1
+    assert ts.duration[3] == 0.0
+
+
+def test_peak_of_only_partial_windows():
+    ts = TimeSeries(1.0)
+    assert ts.peak('p99') == -1
+    ts.append(_window(0, [1000], [0.3]))
+    ts.append(_window(1, [2000], [0.3]))
+    assert ts.peak('p99') == 1
+
+
+def test_phase_splitter():
+    phases = PhaseSplitter(1000.0, 2, 2)
+    for i in range(8):
+        w = _window(i, [1000 * (i + 1)] * 10, [1.0])
+        w.fail_count = 1
+        phases.add(w)
+    phases.finish()
+    assert [p.histogram.count for p in phases.phases] == [20, 40, 20]
+    assert phases.steady.fail_count == 4
+    assert phases.steady.start_time == 1002.0
+    assert phases.steady.run_time == 4.0
+    assert phases.cooldown.run_time == 2.0
+
+
+def test_summary_labels_the_scopes():
+    phases = PhaseSplitter(1000.0, 1, 1)
+    for i in range(4):
+        phases.add(_window(i, [1000] * 10, [1.0]))
+    phases.finish()
+    fr = FinalResult(1)
+    fr.run_time = 4.0
+    r = BenchmarkResult.generate_benchmark_result(fr, phases=phases)
+    summary = str(r)
+    assert 'run time                      :4.0 (whole run)' in summary
+    assert 'steady state                  :2.0 s' in summary
+    assert 'success count                 :20\n' in summary
+    assert r.to_dict()['steady_time'] == 2.0
+    assert '(whole run)' not in str(BenchmarkResult.generate_benchmark_result(fr))
+
+
+def _report(worker: int, start: float, values=(1000,), fails: int = 0, finish: bool = False) -> RunResult:
+    r = RunResult()
+    r.worker_index = worker
+    r.success_results = LatencyHistogram()
+    for v in values:
+        r.success_results.record_us(v)
+    r.failed_reason = {'boom': fails} if fails else {}
+    r.start_time = start
+    r.last_time = start + 1.0
+    r.finish = finish
+    return r
+
+
+def test_late_queue_data_keeps_the_window_times():
+    origin = 1000.0
+    aggregator = WindowAggregator(2, origin, 1.0)
+    windows = []
+    for i in range(3):
+        for worker in range(2):
+            windows += aggregator.add(_report(worker, origin + i + 0.01 * worker))
+        # the failures and the startup of the interval come through the queue after the shared memory
+        late = _report(1, origin + i + 0.012, values=(), fails=1)
+        windows += aggregator.add(late, False)
+    # the tail of the teardown, through the shared memory and the queue
+    for worker in range(2):
+        windows += aggregator.add(_report(worker, origin + 3.02, values=(5000,), finish=True))
+        windows += aggregator.add(_report(worker, origin + 3.02, values=(), fails=1, finish=True), False)
+    windows += aggregator.flush()
+    assert [w.start_time for w in windows] == [origin, origin + 1, origin + 2]
+    assert [w.index for w in windows] == [0, 1, 2]
+    # the late failures of an interval move to the next one, which keeps its own time, those after the
+    # last interval and the teardown tail are only in the totals
+    assert [w.fail_count for w in windows] == [0, 1, 1]
+    assert all(len(w.durations) == 2 for w in windows)
+
+
+def test_finish_joins_the_last_open_interval():
+    origin = 1000.0
+    aggregator = WindowAggregator(2, origin, 1.0)
+    assert aggregator.add(_report(0, origin)) == []
+    # worker 0 finished while worker 1 did not report the interval yet
+    assert aggregator.add(_report(0, origin + 1.0, values=(5000,), finish=True)) == []
+    windows = aggregator.add(_report(1, origin + 0.01))
+    assert len(windows) == 1
+    assert windows[0].histogram.count == 3
+    assert aggregator.flush() == []